@@ -0,0 +1,239 @@
+import re
+import threading
+import time
+from collections import Counter, deque
+from datetime import datetime, timedelta
+from typing import List, Optional
+from sqlalchemy.dialects import postgresql, sqlite
+from app.cache import async_redis_client, redis_client
+from app.config import (
+    ANALYTICS_BACKEND,
+    ANALYTICS_BATCH_SIZE,
+    ANALYTICS_CLAIM_IDLE_SECONDS,
+    ANALYTICS_CONSUMER_NAME,
+    ANALYTICS_FLUSH_INTERVAL_SECONDS,
+    ANALYTICS_STREAM_KEY,
+    ANALYTICS_STREAM_MAX_LENGTH,
+)
+from app.database import SessionLocal
+from app.models import ClickRollup
+from app.tasks import PeriodicTask
+
+GRANULARITIES = {
+    "minute": timedelta(minutes=1),
+    "hour": timedelta(hours=1),
+    "day": timedelta(days=1),
+}
+
+# Checked in order: Edge and Opera also advertise Chrome, Chrome also advertises Safari
+USER_AGENT_FAMILIES = [
+    ("bot", re.compile(r"bot|crawl|spider|slurp", re.I)),
+    ("edge", re.compile(r"Edg(e|A|iOS)?/")),
+    ("opera", re.compile(r"OPR/|Opera")),
+    ("chrome", re.compile(r"Chrome/|CriOS/")),
+    ("firefox", re.compile(r"Firefox/|FxiOS/")),
+    ("safari", re.compile(r"Safari/")),
+    ("curl", re.compile(r"^curl/")),
+]
+
+
+def user_agent_family(user_agent: Optional[str]) -> str:
+    if not user_agent:
+        return "unknown"
+    for family, pattern in USER_AGENT_FAMILIES:
+        if pattern.search(user_agent):
+            return family
+    return "other"
+
+
+def bucket_start(moment: datetime, granularity: str) -> datetime:
+    if granularity == "minute":
+        return moment.replace(second=0, microsecond=0)
+    if granularity == "hour":
+        return moment.replace(minute=0, second=0, microsecond=0)
+    return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+class MemoryEventLog:
+    def __init__(self, max_events: int = ANALYTICS_STREAM_MAX_LENGTH):
+        self._events = deque(maxlen=max_events)
+        self._lock = threading.Lock()
+
+    def append(self, event: dict):
+        self._events.append(event)
+
+    async def async_append(self, event: dict):
+        self._events.append(event)
+
+    def read(self, count: int):
+        with self._lock:
+            batch = []
+            while self._events and len(batch) < count:
+                batch.append(self._events.popleft())
+            return batch, batch
+
+    def ack(self, token):
+        pass
+
+    def restore(self, token):
+        with self._lock:
+            self._events.extendleft(reversed(token))
+
+    def clear(self):
+        self._events.clear()
+
+
+class RedisEventStream:
+    GROUP = "rollups"
+
+    def __init__(
+        self,
+        client,
+        async_client=None,
+        key: str = ANALYTICS_STREAM_KEY,
+        max_length: int = ANALYTICS_STREAM_MAX_LENGTH,
+        consumer: str = ANALYTICS_CONSUMER_NAME,
+        claim_idle_seconds: float = ANALYTICS_CLAIM_IDLE_SECONDS,
+    ):
+        self.client = client
+        self.async_client = async_client
+        self.key = key
+        self.max_length = max_length
+        self.consumer = consumer
+        self.claim_idle_seconds = claim_idle_seconds
+        self._group_ready = False
+        # Starts with this consumer's own pending entries, left by a failed roll-up or the previous process
+        self._has_pending = True
+        self._claim_cursor = "0-0"
+        self._next_claim = 0.0
+
+    def append(self, event: dict):
+        fields = {name: value for name, value in event.items() if value is not None}
+        self.client.xadd(self.key, fields, maxlen=self.max_length, approximate=True)
+
+    async def async_append(self, event: dict):
+        fields = {name: value for name, value in event.items() if value is not None}
+        await self.async_client.xadd(self.key, fields, maxlen=self.max_length, approximate=True)
+
+    def ensure_group(self):
+        if not self._group_ready:
+            try:
+                self.client.xgroup_create(self.key, self.GROUP, id="0", mkstream=True)
+            except Exception as error:
+                if "BUSYGROUP" not in str(error):
+                    raise
+            self._group_ready = True
+
+    def read_group(self, stream_id: str, count: int):
+        response = self.client.xreadgroup(self.GROUP, self.consumer, {self.key: stream_id}, count=count)
+        return response[0][1] if response else []
+
+    def claim_idle(self, count: int):
+        # Pending entries of consumers that stopped without acknowledging them, scanned a page per interval
+        self._next_claim = time.monotonic() + self.claim_idle_seconds
+        cursor, entries, *_ = self.client.xautoclaim(
+            self.key, self.GROUP, self.consumer, int(self.claim_idle_seconds * 1000), start_id=self._claim_cursor, count=count,
+        )
+        self._claim_cursor = cursor.decode("utf-8") if isinstance(cursor, bytes) else cursor
+        return entries
+
+    def read(self, count: int):
+        self.ensure_group()
+        entries = []
+        if self._has_pending:
+            entries = self.read_group("0", count)
+            self._has_pending = bool(entries)
+        if not entries and time.monotonic() >= self._next_claim:
+            entries = self.claim_idle(count)
+        if not entries:
+            entries = self.read_group(">", count)
+        if not entries:
+            return [], []
+        # Entries trimmed from the stream while pending come back without fields; they are only acknowledged
+        events = [
+            {name.decode("utf-8"): value.decode("utf-8") for name, value in fields.items()}
+            for _, fields in entries if fields
+        ]
+        return events, [entry_id for entry_id, _ in entries]
+
+    def ack(self, token):
+        if token:
+            self.client.xack(self.key, self.GROUP, *token)
+
+    def restore(self, token):
+        # Unacknowledged entries stay pending on this consumer and are read again first
+        self._has_pending = True
+
+    def clear(self):
+        self.client.delete(self.key)
+
+
+event_log = RedisEventStream(redis_client, async_redis_client) if ANALYTICS_BACKEND == "redis" else MemoryEventLog()
+
+
+def click_event(short_code: str, referrer: Optional[str], user_agent: Optional[str], country: Optional[str]) -> dict:
+    return {
+        "code": short_code,
+        "ts": time.time(),
+        "ref": referrer,
+        "ua": user_agent_family(user_agent),
+        "country": country,
+    }
+
+
+def emit_click(short_code: str, referrer: Optional[str] = None, user_agent: Optional[str] = None, country: Optional[str] = None):
+    event_log.append(click_event(short_code, referrer, user_agent, country))
+
+
+async def async_emit_click(short_code: str, referrer: Optional[str] = None, user_agent: Optional[str] = None, country: Optional[str] = None):
+    await event_log.async_append(click_event(short_code, referrer, user_agent, country))
+
+
+def upsert_statement(dialect_name: str):
+    dialect_insert = postgresql.insert if dialect_name == "postgresql" else sqlite.insert
+    statement = dialect_insert(ClickRollup.__table__)
+    return statement.on_conflict_do_update(
+        index_elements=["short_code", "granularity", "bucket_start"],
+        set_={"clicks": ClickRollup.__table__.c.clicks + statement.excluded.clicks},
+    )
+
+
+def aggregate_events(db=None, batch_size: int = ANALYTICS_BATCH_SIZE) -> int:
+    events, token = event_log.read(batch_size)
+    if not events:
+        event_log.ack(token)
+        return 0
+    counts = Counter()
+    for event in events:
+        moment = datetime.utcfromtimestamp(float(event["ts"]))
+        for granularity in GRANULARITIES:
+            counts[(event["code"], granularity, bucket_start(moment, granularity))] += 1
+    session = db or SessionLocal()
+    try:
+        session.execute(upsert_statement(session.get_bind().dialect.name), [
+            {"short_code": code, "granularity": granularity, "bucket_start": start, "clicks": clicks}
+            for (code, granularity, start), clicks in counts.items()
+        ])
+        session.commit()
+    except Exception:
+        session.rollback()
+        event_log.restore(token)
+        raise
+    finally:
+        if db is None:
+            session.close()
+    event_log.ack(token)
+    return len(events)
+
+
+def get_timeseries(db, short_code: str, granularity: str, start: datetime, end: datetime) -> List[dict]:
+    rows = db.query(ClickRollup.bucket_start, ClickRollup.clicks).filter(
+        ClickRollup.short_code == short_code,
+        ClickRollup.granularity == granularity,
+        ClickRollup.bucket_start >= bucket_start(start, granularity),
+        ClickRollup.bucket_start <= end,
+    ).order_by(ClickRollup.bucket_start).all()
+    return [{"bucket": row.bucket_start, "clicks": row.clicks} for row in rows]
+
+
+analytics_aggregator = PeriodicTask("analytics-aggregator", ANALYTICS_FLUSH_INTERVAL_SECONDS, aggregate_events)
@@ -0,0 +1,45 @@
+from datetime import datetime
+from typing import Optional
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.database import async_fan_out
+from app.models import Link
+from app.clicks import async_pending_clicks
+from app.services import keyset_key, keyset_page, search_query, split_page
+
+async def find_link(db: AsyncSession, short_code: str):
+    result = await db.execute(select(Link).where(Link.short_code == short_code))
+    return result.scalars().first()
+
+async def get_link(db: AsyncSession, short_code: str, count_click: bool = True):
+    link = await find_link(db, short_code)
+    if link and link.expires_at and link.expires_at < datetime.utcnow():
+        # Expired rows are removed by the background sweeper, the read path never writes
+        return None
+    if link and count_click:
+        link.clicks += 1
+        link.last_used = datetime.utcnow()
+        await db.commit()
+        await db.refresh(link)
+    return link
+
+async def get_stats(db: AsyncSession, short_code: str):
+    link = await find_link(db, short_code)
+    if link:
+        pending_delta, pending_last_used = await async_pending_clicks(short_code)
+        return {
+            "original_url": link.original_url,
+            "short_code": link.short_code,
+            "clicks": link.clicks + pending_delta,
+            "created_at": link.created_at,
+            "expires_at": link.expires_at,
+            "last_used": pending_last_used or link.last_used
+        }
+    return None
+
+async def search_links(db: AsyncSession, limit: int, cursor: Optional[str] = None, original_url: Optional[str] = None, domain: Optional[str] = None, prefix: Optional[str] = None, user_id: Optional[int] = None):
+    query = search_query(original_url, domain, prefix)
+    if user_id is not None:
+        query = query.where(Link.user_id == user_id)
+    query = keyset_page(query, limit, cursor)
+    return split_page(await async_fan_out(db, query, keyset_key), limit)
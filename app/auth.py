@@ -1,9 +1,21 @@
+import asyncio
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
 from fastapi import Depends, HTTPException, status
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
-from passlib.context import CryptContext
 from datetime import datetime, timedelta
 from typing import Optional
+from app.cache import LocalCache, invalidation_listener, publish_invalidation
+from app.config import (
+    BCRYPT_ROUNDS,
+    PASSWORD_HASH_QUEUE_SIZE,
+    PASSWORD_HASH_WORKERS,
+    USER_CACHE_MAX_SIZE,
+    USER_CACHE_TTL_SECONDS,
+)
 from app.database import SessionLocal 
 from app.models import User 
 import os
@@ -12,14 +24,76 @@ SECRET_KEY = os.getenv("SECRET_KEY")
 ALGORITHM = "HS256"
 TOKEN_EXPIRATION_MINUTES = 30
 
-password_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+password_context = None
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
+# Authenticated principals by user id, shared invalidation with the link cache
+user_cache = LocalCache(USER_CACHE_MAX_SIZE, USER_CACHE_TTL_SECONDS)
+invalidation_listener.caches.append(user_cache)
+
+
+@dataclass(frozen=True)
+class CurrentUser:
+    id: int
+    username: str
+    token_version: int
+
+
+def get_password_context():
+    # passlib and bcrypt load on first use: workers that only serve redirects never import them
+    global password_context
+    if password_context is None:
+        from passlib.context import CryptContext
+        password_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+    return password_context
+
 def check_password(plain_password, hashed_password):
-    return password_context.verify(plain_password, hashed_password)
+    return get_password_context().verify(plain_password, hashed_password)
 
 def hash_password(password):
-    return password_context.hash(password)
+    return get_password_context().hash(password)
+
+def verify_and_update_password(plain_password, hashed_password):
+    # Returns (verified, new_hash); new_hash is set when the stored hash uses outdated parameters
+    return get_password_context().verify_and_update(plain_password, hashed_password)
+
+# bcrypt runs in its own bounded process pool so a burst of logins can't starve the
+# request threadpool; at most PASSWORD_HASH_WORKERS + PASSWORD_HASH_QUEUE_SIZE calls are in flight.
+password_pool = None
+password_pool_slots = threading.BoundedSemaphore(PASSWORD_HASH_WORKERS + PASSWORD_HASH_QUEUE_SIZE)
+
+def get_password_pool():
+    global password_pool
+    if password_pool is None and PASSWORD_HASH_WORKERS > 0:
+        password_pool = ProcessPoolExecutor(max_workers=PASSWORD_HASH_WORKERS)
+    return password_pool
+
+def shutdown_password_pool():
+    global password_pool
+    if password_pool is not None:
+        password_pool.shutdown(wait=False, cancel_futures=True)
+        password_pool = None
+
+async def run_password_task(func, *args):
+    if not password_pool_slots.acquire(blocking=False):
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many authentication requests, try again later",
+            headers={"Retry-After": "1"},
+        )
+    try:
+        pool = get_password_pool()
+        if pool is None:
+            return await run_in_threadpool(func, *args)
+        return await asyncio.get_running_loop().run_in_executor(pool, func, *args)
+    finally:
+        password_pool_slots.release()
+
+async def hash_password_async(password):
+    return await run_password_task(hash_password, password)
+
+async def verify_password_async(plain_password, hashed_password):
+    return await run_password_task(verify_and_update_password, plain_password, hashed_password)
 
 def generate_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     payload = data.copy()
@@ -27,6 +101,34 @@ def generate_access_token(data: dict, expires_delta: Optional[timedelta] = None)
     payload.update({"exp": expiration})
     return jwt.encode(payload, SECRET_KEY, algorithm=ALGORITHM)
 
+def generate_user_token(user: User):
+    # uid/ver let fetch_current_user resolve the caller from the user cache without a query
+    return generate_access_token({"sub": user.username, "uid": user.id, "ver": user.token_version or 0})
+
+def user_cache_key(user_id: int) -> str:
+    return f"user:{user_id}"
+
+def load_current_user(*criteria):
+    db_session = SessionLocal()
+    try:
+        user_record = db_session.query(User).filter(*criteria).first()
+    finally:
+        db_session.close()
+    if not user_record:
+        return None
+    current_user = CurrentUser(user_record.id, user_record.username, user_record.token_version or 0)
+    user_cache.set(user_cache_key(current_user.id), current_user)
+    return current_user
+
+def revoke_tokens(db_session, user_id: int):
+    # Bumping the version invalidates every token issued so far for this user
+    user_record = db_session.query(User).filter(User.id == user_id).first()
+    user_record.token_version = (user_record.token_version or 0) + 1
+    db_session.commit()
+    user_cache.delete(user_cache_key(user_id))
+    publish_invalidation(user_cache_key(user_id), namespace="user")
+    return user_record.token_version
+
 def fetch_current_user(token: str = Depends(oauth2_scheme)):
     exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -40,9 +142,16 @@ def fetch_current_user(token: str = Depends(oauth2_scheme)):
             raise exception
     except JWTError:
         raise exception
-    db_session = SessionLocal()
-    user_record = db_session.query(User).filter(User.username == username).first()
-    db_session.close()
+    user_id = decoded_payload.get("uid")
+    if user_id is None:
+        # Tokens issued before uid/ver claims were added carry no version: valid only until the first revocation
+        user_record = load_current_user(User.username == username)
+        if user_record and user_record.token_version != 0:
+            raise exception
+    else:
+        user_record = user_cache.get(user_cache_key(user_id)) or load_current_user(User.id == user_id)
+        if user_record and user_record.token_version != decoded_payload.get("ver"):
+            raise exception
     if not user_record:
         raise exception
-    return user_record
\ No newline at end of file
+    return user_record
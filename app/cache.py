@@ -1,16 +1,547 @@
+import asyncio
+import logging
+import math
+import os
+import random
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Future
+from datetime import datetime, timedelta
+from typing import NamedTuple, Optional
+import msgpack
 import redis
-from app.config import REDIS_URL, CACHE_EXPIRE_SECONDS 
+import redis.asyncio
+from app.config import (
+    REDIS_URL,
+    CACHE_EXPIRE_SECONDS,
+    L1_CACHE_MAX_SIZE,
+    L1_CACHE_TTL_SECONDS,
+    CACHE_INVALIDATION_CHANNEL,
+    CACHE_FILL_LOCK_SECONDS,
+    CACHE_FILL_POLL_SECONDS,
+    CACHE_EARLY_REFRESH_BETA,
+    CACHE_TOMBSTONE_SECONDS,
+)
+from app.metrics import REDIS_CACHE_EARLY_REFRESH, REDIS_CACHE_HIT, REDIS_CACHE_MISS, REDIS_GET_LATENCY, REDIS_SET_LATENCY
+
+logger = logging.getLogger(__name__)
 
 redis_client = redis.from_url(REDIS_URL)
+async_redis_client = redis.asyncio.from_url(REDIS_URL)
+
+# Identifies this process on the invalidation channel so it can skip its own messages
+WORKER_ID = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+# Invalidations are tagged with what the key names; only link keys are short codes
+LINK_NAMESPACE = "link"
+
+
+EPOCH = datetime(1970, 1, 1)
+
+
+class LinkEntry(NamedTuple):
+    """What the redirect path needs to know about a link, cached per short code."""
+
+    id: int
+    original_url: str
+    expires_at: Optional[datetime]
+    user_id: Optional[int]
+    version: int
+
+    @classmethod
+    def from_link(cls, link) -> "LinkEntry":
+        return cls(link.id, link.original_url, link.expires_at, link.user_id, link.version)
+
+    def expired(self) -> bool:
+        return self.expires_at is not None and self.expires_at < datetime.utcnow()
+
+    def pack(self) -> bytes:
+        # expires_at in whole seconds, truncated, so a cached entry never outlives the row
+        expires_at = None if self.expires_at is None else int((self.expires_at - EPOCH).total_seconds())
+        return msgpack.packb((self.id, self.original_url, expires_at, self.user_id, self.version))
+
+    @classmethod
+    def unpack(cls, data: bytes) -> Optional["LinkEntry"]:
+        try:
+            link_id, original_url, expires_at, user_id, version = msgpack.unpackb(data)
+        except (ValueError, TypeError):
+            # Not a packed entry (e.g. a bare URL cached by an older release): treat it as a miss
+            return None
+        return cls(link_id, original_url, None if expires_at is None else EPOCH + timedelta(seconds=expires_at), user_id, version)
+
+
+class LocalCache:
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl: float = None):
+        if self.max_size <= 0:
+            return
+        expires_at = time.monotonic() + (self.ttl if ttl is None else min(ttl, self.ttl))
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+
+class InvalidationListener:
+    RECONNECT_DELAY_SECONDS = 1.0
+
+    def __init__(self, client, channel: str, caches):
+        self.client = client
+        self.channel = channel
+        self.caches = caches
+        # Non-cache subscribers: called with each invalidated short code, and after every (re)subscribe.
+        # Keys of other namespaces (users) only evict the caches
+        self.key_callbacks = []
+        self.resync_callbacks = []
+        # Called with the short codes this worker changes itself (handle() skips its own messages) and the
+        # caller's pipeline, if any, for the callback to queue its Redis writes on
+        self.local_callbacks = []
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="cache-invalidation", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        self._stopped.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def changed_locally(self, keys: list, namespace: str = LINK_NAMESPACE, pipe=None):
+        if namespace != LINK_NAMESPACE or not keys:
+            return
+        for callback in self.local_callbacks:
+            callback(keys, pipe)
+
+    def handle(self, message: bytes):
+        sender, _, tagged_key = message.decode("utf-8").partition(":")
+        if sender == WORKER_ID:
+            return
+        namespace, _, key = tagged_key.partition(":")
+        for cache in self.caches:
+            cache.delete(key)
+        if namespace != LINK_NAMESPACE:
+            return
+        for callback in self.key_callbacks:
+            callback(key)
+
+    def _run(self):
+        while not self._stopped.is_set():
+            pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+            try:
+                pubsub.subscribe(self.channel)
+                # Messages published while we were disconnected are lost, so start from a clean slate
+                for cache in self.caches:
+                    cache.clear()
+                for callback in self.resync_callbacks:
+                    callback()
+                while not self._stopped.is_set():
+                    message = pubsub.get_message(timeout=1.0)
+                    if message and message["type"] == "message":
+                        self.handle(message["data"])
+            except redis.RedisError:
+                logger.warning("Cache invalidation channel unavailable, retrying")
+                self._stopped.wait(self.RECONNECT_DELAY_SECONDS)
+            finally:
+                pubsub.close()
+
+
+class SingleFlight:
+    """Runs one call per key at a time; threads asking for the same key meanwhile share its result."""
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, function):
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+        if not leader:
+            return future.result()
+        try:
+            result = function()
+        except BaseException as error:
+            future.set_exception(error)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+
+class AsyncSingleFlight:
+    """SingleFlight for coroutines on one event loop."""
+
+    def __init__(self):
+        self._calls = {}
+
+    async def do(self, key, coroutine_function):
+        future = self._calls.get(key)
+        if future is not None:
+            return await asyncio.shield(future)
+        future = self._calls[key] = asyncio.get_running_loop().create_future()
+        try:
+            result = await coroutine_function()
+        except BaseException as error:
+            future.set_exception(error)
+            # Mark it retrieved, so a call nobody else was waiting on doesn't log "exception never retrieved"
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            del self._calls[key]
+
+
+local_cache = LocalCache(L1_CACHE_MAX_SIZE, L1_CACHE_TTL_SECONDS)
+invalidation_listener = InvalidationListener(redis_client, CACHE_INVALIDATION_CHANNEL, [local_cache])
+fill_flight = SingleFlight()
+async_fill_flight = AsyncSingleFlight()
+# Running estimate of how long a fill takes, the "delta" of the early refresh below
+fill_seconds = 0.005
+
+# Deletes the fill lock only if we still hold it, so an expired lease never releases someone else's
+RELEASE_LOCK_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+release_lock_script = redis_client.register_script(RELEASE_LOCK_SCRIPT)
+async_release_lock_script = async_redis_client.register_script(RELEASE_LOCK_SCRIPT)
+
+# Stores a filled entry unless Redis already holds a newer version of it: a fill that read the row
+# before an update committed must not overwrite what the update cached. Nor may one that read it before
+# a delete: KEYS[2] is the tombstone, "<id>:<version>" of the deleted row, and ARGV[4] the filled row's id
+STORE_IF_NEWER_SCRIPT = """
+local tombstone = redis.call("get", KEYS[2])
+if tombstone then
+    local id, version = string.match(tombstone, "^(%d+):(%d+)$")
+    if id == ARGV[4] and tonumber(version) >= tonumber(ARGV[2]) then
+        return 0
+    end
+end
+local current = redis.call("get", KEYS[1])
+if current then
+    local ok, entry = pcall(cmsgpack.unpack, current)
+    if ok and type(entry) == "table" and tonumber(entry[5]) and tonumber(entry[5]) > tonumber(ARGV[2]) then
+        return 0
+    end
+end
+redis.call("set", KEYS[1], ARGV[1], "EX", ARGV[3])
+return 1
+"""
+store_if_newer_script = redis_client.register_script(STORE_IF_NEWER_SCRIPT)
+async_store_if_newer_script = async_redis_client.register_script(STORE_IF_NEWER_SCRIPT)
+
+
+def cache_ttl(expires_at: datetime = None) -> int:
+    # Cached entries never outlive the link itself
+    if expires_at is None:
+        return CACHE_EXPIRE_SECONDS
+    remaining = math.ceil((expires_at - datetime.utcnow()).total_seconds())
+    return max(0, min(CACHE_EXPIRE_SECONDS, remaining))
+
+
+def invalidation_message(key: str, namespace: str = LINK_NAMESPACE) -> str:
+    return f"{WORKER_ID}:{namespace}:{key}"
+
+
+def publish_invalidation(key: str, namespace: str = LINK_NAMESPACE, created: bool = False):
+    # created: a code that didn't exist before, so this worker has nothing stale to record
+    redis_client.publish(CACHE_INVALIDATION_CHANNEL, invalidation_message(key, namespace))
+    if not created:
+        invalidation_listener.changed_locally([key], namespace)
+
+
+def refresh_early(ttl_milliseconds: int) -> bool:
+    # XFetch: refresh with a probability that rises as the entry nears expiry, scaled by the cost of a fill
+    if ttl_milliseconds < 0 or CACHE_EARLY_REFRESH_BETA <= 0:
+        return False
+    return -fill_seconds * CACHE_EARLY_REFRESH_BETA * math.log(1.0 - random.random()) * 1000 >= ttl_milliseconds
+
+
+def record_fill(duration: float):
+    global fill_seconds
+    fill_seconds += 0.1 * (duration - fill_seconds)
+
+
+def fill_lock_key(key: str) -> str:
+    return f"fill-lock:{key}"
+
+
+def tombstone_key(key: str) -> str:
+    return f"tombstone:{key}"
+
+
+def tombstone(entry: LinkEntry) -> str:
+    return f"{entry.id}:{entry.version}"
+
+
+def cache_get(key: str) -> Optional[LinkEntry]:
+    entry = local_cache.get(key)
+    if entry is not None:
+        return entry
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.get(key)
+    pipe.pttl(key)
+    with REDIS_GET_LATENCY.time():
+        result, ttl = pipe.execute()
+    entry = LinkEntry.unpack(result) if result else None
+    if entry and refresh_early(ttl):
+        # Reported as a miss to this caller only, the entry keeps serving everyone else until the refill
+        REDIS_CACHE_EARLY_REFRESH.inc()
+        return None
+    if entry:
+        REDIS_CACHE_HIT.inc()
+        local_cache.set(key, entry)
+        return entry
+    REDIS_CACHE_MISS.inc()
+    return None
+
+
+def wait_for_fill(key: str, lock_key: str):
+    # Another worker holds the lease: poll Redis until it has stored the value or given up the lease
+    deadline = time.monotonic() + CACHE_FILL_LOCK_SECONDS
+    while time.monotonic() < deadline:
+        result = redis_client.get(key)
+        if result:
+            return LinkEntry.unpack(result)
+        if not redis_client.exists(lock_key):
+            return None
+        time.sleep(CACHE_FILL_POLL_SECONDS)
+    return None
+
+
+def store_fill(key: str, entry: LinkEntry):
+    ttl = cache_ttl(entry.expires_at)
+    if ttl <= 0:
+        return
+    with REDIS_SET_LATENCY.time():
+        stored = store_if_newer_script(keys=[key, tombstone_key(key)], args=[entry.pack(), entry.version, ttl, entry.id])
+    if stored:
+        local_cache.set(key, entry, ttl)
+
+
+def fill(key: str, load):
+    lock_key = fill_lock_key(key)
+    token = uuid.uuid4().hex
+    if not redis_client.set(lock_key, token, nx=True, px=int(CACHE_FILL_LOCK_SECONDS * 1000)):
+        entry = wait_for_fill(key, lock_key)
+        if entry is not None:
+            return entry
+        token = None
+    try:
+        start = time.perf_counter()
+        entry = load()
+        record_fill(time.perf_counter() - start)
+        if entry is not None:
+            store_fill(key, entry)
+        return entry
+    finally:
+        if token:
+            release_lock_script(keys=[lock_key], args=[token])
+
+
+def cache_fill(key: str, load) -> Optional[LinkEntry]:
+    """Resolves a cache miss with at most one load per key in this process and one across workers.
+
+    load() returns the LinkEntry to cache, or None when there is nothing to cache; the entry is
+    stored unless Redis already holds a newer version, and returned to every caller waiting on the key.
+    """
+    return fill_flight.do(key, lambda: fill(key, load))
+
+
+def cache_set(key: str, entry: LinkEntry, created: bool = False):
+    ttl = cache_ttl(entry.expires_at)
+    if ttl <= 0:
+        cache_delete(key)
+        return
+    with REDIS_SET_LATENCY.time():
+        redis_client.setex(key, ttl, entry.pack())
+    local_cache.set(key, entry, ttl)
+    publish_invalidation(key, created=created)
+
+
+def cache_set_many(entries, created: bool = False):
+    # entries: iterable of (key, LinkEntry)
+    pipe = redis_client.pipeline(transaction=False)
+    cached = []
+    for key, entry in entries:
+        ttl = cache_ttl(entry.expires_at)
+        if ttl > 0:
+            pipe.setex(key, ttl, entry.pack())
+            pipe.publish(CACHE_INVALIDATION_CHANNEL, invalidation_message(key))
+            cached.append((key, entry, ttl))
+    if not cached:
+        return
+    if not created:
+        invalidation_listener.changed_locally([key for key, _, _ in cached], pipe=pipe)
+    pipe.execute()
+    for key, entry, ttl in cached:
+        local_cache.set(key, entry, ttl)
+
+
+def cache_warm(entries):
+    # entries: iterable of (key, LinkEntry). Only fills keys Redis doesn't have, so nothing newer is
+    # overwritten and no other worker needs to be told
+    pipe = redis_client.pipeline(transaction=False)
+    queued = 0
+    for key, entry in entries:
+        ttl = cache_ttl(entry.expires_at)
+        if ttl > 0:
+            pipe.set(key, entry.pack(), ex=ttl, nx=True)
+            queued += 1
+    if queued:
+        pipe.execute()
+    return queued
+
+
+def cache_delete(key: str, deleted: Optional[LinkEntry] = None):
+    # deleted: the removed row, tombstoned before the key goes so an in-flight fill can't bring it back
+    if deleted is not None:
+        redis_client.set(tombstone_key(key), tombstone(deleted), ex=CACHE_TOMBSTONE_SECONDS)
+    redis_client.delete(key)
+    local_cache.delete(key)
+    publish_invalidation(key)
+
+
+def cache_delete_many(keys):
+    if not keys:
+        return
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.delete(*keys)
+    for key in keys:
+        pipe.publish(CACHE_INVALIDATION_CHANNEL, invalidation_message(key))
+        local_cache.delete(key)
+    invalidation_listener.changed_locally(list(keys), pipe=pipe)
+    pipe.execute()
+
+
+async def async_cache_get(key: str) -> Optional[LinkEntry]:
+    entry = local_cache.get(key)
+    if entry is not None:
+        return entry
+    pipe = async_redis_client.pipeline(transaction=False)
+    pipe.get(key)
+    pipe.pttl(key)
+    with REDIS_GET_LATENCY.time():
+        result, ttl = await pipe.execute()
+    entry = LinkEntry.unpack(result) if result else None
+    if entry and refresh_early(ttl):
+        REDIS_CACHE_EARLY_REFRESH.inc()
+        return None
+    if entry:
+        REDIS_CACHE_HIT.inc()
+        local_cache.set(key, entry)
+        return entry
+    REDIS_CACHE_MISS.inc()
+    return None
+
+
+async def async_wait_for_fill(key: str, lock_key: str):
+    deadline = time.monotonic() + CACHE_FILL_LOCK_SECONDS
+    while time.monotonic() < deadline:
+        result = await async_redis_client.get(key)
+        if result:
+            return LinkEntry.unpack(result)
+        if not await async_redis_client.exists(lock_key):
+            return None
+        await asyncio.sleep(CACHE_FILL_POLL_SECONDS)
+    return None
+
+
+async def async_store_fill(key: str, entry: LinkEntry):
+    ttl = cache_ttl(entry.expires_at)
+    if ttl <= 0:
+        return
+    with REDIS_SET_LATENCY.time():
+        stored = await async_store_if_newer_script(keys=[key, tombstone_key(key)], args=[entry.pack(), entry.version, ttl, entry.id])
+    if stored:
+        local_cache.set(key, entry, ttl)
+
 
-def cache_get(key: str) -> str:
-    result = redis_client.get(key)
-    return result.decode("utf-8") if result else None
+async def async_fill(key: str, load):
+    lock_key = fill_lock_key(key)
+    token = uuid.uuid4().hex
+    if not await async_redis_client.set(lock_key, token, nx=True, px=int(CACHE_FILL_LOCK_SECONDS * 1000)):
+        entry = await async_wait_for_fill(key, lock_key)
+        if entry is not None:
+            return entry
+        token = None
+    try:
+        start = time.perf_counter()
+        entry = await load()
+        record_fill(time.perf_counter() - start)
+        if entry is not None:
+            await async_store_fill(key, entry)
+        return entry
+    finally:
+        if token:
+            await async_release_lock_script(keys=[lock_key], args=[token])
 
 
-def cache_set(key: str, value: str):
-    redis_client.setex(key, CACHE_EXPIRE_SECONDS, value)
+async def async_cache_fill(key: str, load) -> Optional[LinkEntry]:
+    # cache_fill for the event loop; load is a coroutine function
+    return await async_fill_flight.do(key, lambda: async_fill(key, load))
 
 
-def cache_delete(key: str):
-    redis_client.delete(key)
\ No newline at end of file
+def cache_stats() -> dict:
+    return local_cache.stats()
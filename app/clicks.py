@@ -0,0 +1,182 @@
+import logging
+import threading
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+from sqlalchemy import bindparam, update
+from app.cache import async_redis_client, redis_client
+from app.config import CLICK_BUFFER_BACKEND, CLICK_FLUSH_INTERVAL_SECONDS, CLICK_FLUSH_THRESHOLD
+from app.database import SessionLocal
+from app.models import Link
+from app.sharding import shard_arguments, shard_map
+from app.tasks import PeriodicTask
+
+logger = logging.getLogger(__name__)
+
+# short_code -> (unflushed click delta, latest last_used)
+PendingClicks = Dict[str, Tuple[int, Optional[datetime]]]
+
+
+class MemoryClickBuffer:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending: PendingClicks = {}
+
+    def add(self, short_code: str, used_at: datetime) -> int:
+        with self._lock:
+            delta, _ = self._pending.get(short_code, (0, None))
+            self._pending[short_code] = (delta + 1, used_at)
+            return len(self._pending)
+
+    async def async_add(self, short_code: str, used_at: datetime) -> int:
+        return self.add(short_code, used_at)
+
+    def peek(self, short_code: str) -> Tuple[int, Optional[datetime]]:
+        with self._lock:
+            return self._pending.get(short_code, (0, None))
+
+    async def async_peek(self, short_code: str) -> Tuple[int, Optional[datetime]]:
+        return self.peek(short_code)
+
+    def drain(self) -> PendingClicks:
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            return pending
+
+    def restore(self, pending: PendingClicks):
+        with self._lock:
+            for short_code, (delta, used_at) in pending.items():
+                current_delta, current_used_at = self._pending.get(short_code, (0, None))
+                latest = max(filter(None, (used_at, current_used_at)), default=None)
+                self._pending[short_code] = (current_delta + delta, latest)
+
+    def clear(self):
+        with self._lock:
+            self._pending = {}
+
+
+class RedisClickBuffer:
+    COUNTS_KEY = "clicks:pending"
+    LAST_USED_KEY = "clicks:last_used"
+
+    def __init__(self, client, async_client=None):
+        self.client = client
+        self.async_client = async_client
+
+    def queue_add(self, pipe, short_code: str, used_at: datetime):
+        pipe.hincrby(self.COUNTS_KEY, short_code, 1)
+        pipe.hset(self.LAST_USED_KEY, short_code, used_at.timestamp())
+        pipe.hlen(self.COUNTS_KEY)
+
+    def add(self, short_code: str, used_at: datetime) -> int:
+        pipe = self.client.pipeline(transaction=False)
+        self.queue_add(pipe, short_code, used_at)
+        return pipe.execute()[-1]
+
+    async def async_add(self, short_code: str, used_at: datetime) -> int:
+        pipe = self.async_client.pipeline(transaction=False)
+        self.queue_add(pipe, short_code, used_at)
+        return (await pipe.execute())[-1]
+
+    def queue_peek(self, pipe, short_code: str):
+        pipe.hget(self.COUNTS_KEY, short_code)
+        pipe.hget(self.LAST_USED_KEY, short_code)
+
+    @staticmethod
+    def parse_peek(delta, used_at) -> Tuple[int, Optional[datetime]]:
+        return int(delta or 0), datetime.utcfromtimestamp(float(used_at)) if used_at else None
+
+    def peek(self, short_code: str) -> Tuple[int, Optional[datetime]]:
+        pipe = self.client.pipeline(transaction=False)
+        self.queue_peek(pipe, short_code)
+        return self.parse_peek(*pipe.execute())
+
+    async def async_peek(self, short_code: str) -> Tuple[int, Optional[datetime]]:
+        pipe = self.async_client.pipeline(transaction=False)
+        self.queue_peek(pipe, short_code)
+        return self.parse_peek(*await pipe.execute())
+
+    def drain(self) -> PendingClicks:
+        # HGETALL + DEL inside MULTI so clicks recorded concurrently land in the next batch
+        pipe = self.client.pipeline(transaction=True)
+        pipe.hgetall(self.COUNTS_KEY)
+        pipe.hgetall(self.LAST_USED_KEY)
+        pipe.delete(self.COUNTS_KEY, self.LAST_USED_KEY)
+        counts, last_used, _ = pipe.execute()
+        pending = {}
+        for short_code, delta in counts.items():
+            used_at = last_used.get(short_code)
+            pending[short_code.decode("utf-8")] = (
+                int(delta),
+                datetime.utcfromtimestamp(float(used_at)) if used_at else None,
+            )
+        return pending
+
+    def restore(self, pending: PendingClicks):
+        pipe = self.client.pipeline(transaction=False)
+        for short_code, (delta, used_at) in pending.items():
+            pipe.hincrby(self.COUNTS_KEY, short_code, delta)
+            if used_at:
+                pipe.hset(self.LAST_USED_KEY, short_code, used_at.timestamp())
+        pipe.execute()
+
+    def clear(self):
+        self.client.delete(self.COUNTS_KEY, self.LAST_USED_KEY)
+
+
+click_buffer = RedisClickBuffer(redis_client, async_redis_client) if CLICK_BUFFER_BACKEND == "redis" else MemoryClickBuffer()
+
+links_table = Link.__table__
+flush_statement = (
+    update(links_table)
+    .where(links_table.c.short_code == bindparam("b_short_code"))
+    .values(
+        clicks=links_table.c.clicks + bindparam("b_delta"),
+        last_used=bindparam("b_last_used"),
+    )
+)
+
+
+def record_click(short_code: str):
+    if click_buffer.add(short_code, datetime.utcnow()) >= CLICK_FLUSH_THRESHOLD:
+        click_flusher.trigger()
+
+
+async def async_record_click(short_code: str):
+    # record_click for the event loop, so the Redis buffer doesn't block it
+    if await click_buffer.async_add(short_code, datetime.utcnow()) >= CLICK_FLUSH_THRESHOLD:
+        click_flusher.trigger()
+
+
+def pending_clicks(short_code: str) -> Tuple[int, Optional[datetime]]:
+    return click_buffer.peek(short_code)
+
+
+async def async_pending_clicks(short_code: str) -> Tuple[int, Optional[datetime]]:
+    return await click_buffer.async_peek(short_code)
+
+
+def flush_clicks(db=None) -> int:
+    pending = click_buffer.drain()
+    if not pending:
+        return 0
+    session = db or SessionLocal()
+    rows = [
+        {"b_short_code": short_code, "b_delta": delta, "b_last_used": used_at}
+        for short_code, (delta, used_at) in pending.items()
+    ]
+    try:
+        # One executemany per shard holding the codes, committed together
+        for shard, shard_rows in shard_map.group_by_shard(rows, lambda row: row["b_short_code"], every_candidate=True).items():
+            session.execute(flush_statement, shard_rows, bind_arguments=shard_arguments(shard))
+        session.commit()
+    except Exception:
+        session.rollback()
+        click_buffer.restore(pending)
+        raise
+    finally:
+        if db is None:
+            session.close()
+    return len(pending)
+
+
+click_flusher = PeriodicTask("click-flusher", CLICK_FLUSH_INTERVAL_SECONDS, flush_clicks)
@@ -0,0 +1,196 @@
+import os
+import random
+import string
+import threading
+import time
+from app.cache import redis_client
+from app.config import (
+    CODE_GENERATOR,
+    CODE_LENGTH,
+    CODE_BLOCK_SIZE,
+    CODE_POOL_KEY,
+    CODE_POOL_REFILL_SIZE,
+    CODE_SEQUENCE_KEY,
+    SNOWFLAKE_WORKER_ID,
+)
+from app.tasks import PeriodicTask
+
+BASE62_ALPHABET = string.digits + string.ascii_letters
+BASE62_INDEX = {char: index for index, char in enumerate(BASE62_ALPHABET)}
+
+
+def base62_encode(number: int, width: int = 0) -> str:
+    if number < 0:
+        raise ValueError("Cannot encode negative numbers")
+    chars = []
+    while number:
+        number, remainder = divmod(number, 62)
+        chars.append(BASE62_ALPHABET[remainder])
+    return "".join(reversed(chars)).rjust(max(width, 1), BASE62_ALPHABET[0])
+
+
+def base62_decode(code: str) -> int:
+    number = 0
+    for char in code:
+        number = number * 62 + BASE62_INDEX[char]
+    return number
+
+
+class RandomCodeGenerator:
+    """Legacy generator: random characters, collisions are only caught by the unique index."""
+
+    collision_free = False
+
+    def __init__(self, length: int = CODE_LENGTH):
+        self.length = length
+        self._choices = BASE62_ALPHABET
+
+    def next_code(self) -> str:
+        return "".join(random.choices(self._choices, k=self.length))
+
+
+class SnowflakeCodeGenerator:
+    """41-bit millisecond timestamp | 10-bit worker id | 12-bit sequence, base62 encoded (up to 11 chars)."""
+
+    collision_free = True
+    EPOCH_MS = 1704067200000  # 2024-01-01T00:00:00Z
+    WORKER_BITS = 10
+    SEQUENCE_BITS = 12
+
+    def __init__(self, worker_id: int):
+        if not 0 <= worker_id < (1 << self.WORKER_BITS):
+            raise ValueError("Snowflake worker id must fit in 10 bits")
+        self.worker_id = worker_id
+        self._lock = threading.Lock()
+        self._last_ms = -1
+        self._sequence = 0
+
+    def next_id(self) -> int:
+        with self._lock:
+            now_ms = int(time.time() * 1000)
+            if now_ms < self._last_ms:
+                # Clock moved backwards: keep issuing ids from the last seen millisecond
+                now_ms = self._last_ms
+            if now_ms == self._last_ms:
+                self._sequence = (self._sequence + 1) & ((1 << self.SEQUENCE_BITS) - 1)
+                if self._sequence == 0:
+                    while now_ms <= self._last_ms:
+                        now_ms = int(time.time() * 1000)
+            else:
+                self._sequence = 0
+            self._last_ms = now_ms
+            return (
+                ((now_ms - self.EPOCH_MS) << (self.WORKER_BITS + self.SEQUENCE_BITS))
+                | (self.worker_id << self.SEQUENCE_BITS)
+                | self._sequence
+            )
+
+    def next_code(self) -> str:
+        return base62_encode(self.next_id())
+
+
+class BlockCodeGenerator:
+    """Hands out ids from blocks leased from a shared counter and maps them onto fixed-width codes.
+
+    The id -> code mapping is an affine permutation of [0, 62**length), so distinct ids always
+    give distinct codes while consecutive ids don't give guessable consecutive codes.
+    """
+
+    collision_free = True
+    MULTIPLIER = 1580030173  # coprime with 62
+    OFFSET = 11400714819
+
+    def __init__(self, allocate_block, length: int = CODE_LENGTH, block_size: int = CODE_BLOCK_SIZE):
+        self.allocate_block = allocate_block
+        self.length = length
+        self.block_size = block_size
+        self.space = 62 ** length
+        self._lock = threading.Lock()
+        self._next = 0
+        self._end = 0
+
+    def next_id(self) -> int:
+        with self._lock:
+            if self._next >= self._end:
+                self._next = self.allocate_block(self.block_size)
+                self._end = self._next + self.block_size
+            value = self._next
+            self._next += 1
+        if value >= self.space:
+            raise RuntimeError("Short code space exhausted, increase CODE_LENGTH")
+        return value
+
+    def encode(self, value: int) -> str:
+        return base62_encode((value * self.MULTIPLIER + self.OFFSET) % self.space, self.length)
+
+    def next_code(self) -> str:
+        return self.encode(self.next_id())
+
+
+class PoolCodeGenerator:
+    """Pops pre-generated codes from a Redis list that is refilled from a collision-free source."""
+
+    collision_free = True
+
+    def __init__(self, client, source, key: str = CODE_POOL_KEY, refill_size: int = CODE_POOL_REFILL_SIZE):
+        self.client = client
+        self.source = source
+        self.key = key
+        self.refill_size = refill_size
+
+    def refill(self, low_water: int = None) -> int:
+        low_water = self.refill_size // 2 if low_water is None else low_water
+        if self.client.llen(self.key) >= low_water:
+            return 0
+        codes = [self.source.next_code() for _ in range(self.refill_size)]
+        self.client.rpush(self.key, *codes)
+        return len(codes)
+
+    def next_code(self) -> str:
+        code = self.client.lpop(self.key)
+        if code is None:
+            # Pool drained faster than the refill task tops it up: fall back to the source directly
+            return self.source.next_code()
+        return code.decode("utf-8")
+
+
+def memory_block_allocator(start: int = 0):
+    # Process-local counter, only collision-free within a single process (tests, benchmarks)
+    next_start = start
+    lock = threading.Lock()
+
+    def allocate(size: int) -> int:
+        nonlocal next_start
+        with lock:
+            first = next_start
+            next_start += size
+            return first
+    return allocate
+
+
+def redis_block_allocator(client, key: str = CODE_SEQUENCE_KEY):
+    def allocate(size: int) -> int:
+        return client.incrby(key, size) - size
+    return allocate
+
+
+def build_code_generator(strategy: str = CODE_GENERATOR):
+    if strategy == "random":
+        return RandomCodeGenerator()
+    if strategy == "snowflake":
+        # Uniqueness across processes requires a distinct SNOWFLAKE_WORKER_ID per worker
+        worker_id = SNOWFLAKE_WORKER_ID if SNOWFLAKE_WORKER_ID is not None else os.getpid() % 1024
+        return SnowflakeCodeGenerator(worker_id)
+    block_generator = BlockCodeGenerator(redis_block_allocator(redis_client))
+    if strategy == "block":
+        return block_generator
+    if strategy == "pool":
+        return PoolCodeGenerator(redis_client, block_generator)
+    raise ValueError(f"Unknown code generator strategy: {strategy}")
+
+
+code_generator = build_code_generator()
+code_pool_refiller = (
+    PeriodicTask("code-pool-refill", 1.0, code_generator.refill)
+    if isinstance(code_generator, PoolCodeGenerator) else None
+)
@@ -1,6 +1,163 @@
 import os
+import socket
 
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///:memory:")
+# Optional read replica (same driver conventions as DATABASE_URL) for read-only lookups: stats, search
+# and cache-miss resolution of redirects. Writes and anything that must see them stay on the primary
+DATABASE_REPLICA_URL = os.getenv("DATABASE_REPLICA_URL")
+
+# Connection pool per engine and process (ignored by SQLite's single-connection pools)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT_SECONDS = float(os.getenv("DB_POOL_TIMEOUT_SECONDS", "5"))
+DB_POOL_RECYCLE_SECONDS = int(os.getenv("DB_POOL_RECYCLE_SECONDS", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+# Compiled-SQL cache entries per engine, and asyncpg's prepared statements per connection
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "500"))
+
+# Optional sharding of the links table: comma-separated URLs, one database (or SQLite file) per shard. A link lives
+# on the shard its short code hashes to on a consistent-hash ring; users and click rollups stay on DATABASE_URL.
+# To add shards append their URLs and set SHARD_PREVIOUS_COUNT to the old number of shards until
+# `python -m app.rebalance` has moved the links whose owner changed
+DATABASE_SHARD_URLS = [url.strip() for url in os.getenv("DATABASE_SHARD_URLS", "").split(",") if url.strip()]
+SHARD_PREVIOUS_COUNT = int(os.getenv("SHARD_PREVIOUS_COUNT", "0"))
+SHARD_VIRTUAL_NODES = int(os.getenv("SHARD_VIRTUAL_NODES", "128"))
+# Threads querying shards in parallel for listings and searches that can't be routed by short code
+SHARD_FAN_OUT_WORKERS = int(os.getenv("SHARD_FAN_OUT_WORKERS", "16"))
+SHARD_REBALANCE_BATCH_SIZE = int(os.getenv("SHARD_REBALANCE_BATCH_SIZE", "1000"))
+# Rows converted per transaction by data migrations in python -m app.migrate
+MIGRATION_BATCH_SIZE = int(os.getenv("MIGRATION_BATCH_SIZE", "10000"))
 REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
 CACHE_EXPIRE_SECONDS = 3600
-DEFAULT_LINK_EXPIRY_DAYS = 30
\ No newline at end of file
+DEFAULT_LINK_EXPIRY_DAYS = 30
+
+# Click counters are buffered ("memory" or "redis") and flushed to the links table in batches. A memory buffer
+# is per process, so app.server switches to "redis" when it runs several workers and the variable is unset;
+# with "memory" set explicitly /stats lags behind by the clicks other workers haven't flushed yet
+CLICK_BUFFER_BACKEND = os.getenv("CLICK_BUFFER_BACKEND", "memory")
+CLICK_FLUSH_INTERVAL_SECONDS = float(os.getenv("CLICK_FLUSH_INTERVAL_SECONDS", "5"))
+CLICK_FLUSH_THRESHOLD = int(os.getenv("CLICK_FLUSH_THRESHOLD", "1000"))
+
+# In-process L1 cache in front of Redis, invalidated across workers over pub/sub
+L1_CACHE_MAX_SIZE = int(os.getenv("L1_CACHE_MAX_SIZE", "10000"))
+L1_CACHE_TTL_SECONDS = float(os.getenv("L1_CACHE_TTL_SECONDS", "5"))
+CACHE_INVALIDATION_CHANNEL = "cache:invalidate"
+
+# Cold codes are resolved once per process (single flight) and once across workers (a Redis lease on the key);
+# other workers wait for the leaseholder to fill Redis. Hot entries are refreshed early at random (XFetch),
+# more eagerly for a larger beta, so an expiry never sends every reader to the database at once (0 disables)
+CACHE_FILL_LOCK_SECONDS = float(os.getenv("CACHE_FILL_LOCK_SECONDS", "2"))
+CACHE_FILL_POLL_SECONDS = float(os.getenv("CACHE_FILL_POLL_SECONDS", "0.02"))
+CACHE_EARLY_REFRESH_BETA = float(os.getenv("CACHE_EARLY_REFRESH_BETA", "1"))
+# A deleted link's tombstone, which turns away fills that read the row before the delete; must outlast a fill
+CACHE_TOMBSTONE_SECONDS = int(os.getenv("CACHE_TOMBSTONE_SECONDS", "60"))
+
+# GET /links/{short_code}: "json" answers {"original_url": ...}, "301", "302" or "307" redirect with Location.
+# Redirects may be cached by browsers and CDNs for up to REDIRECT_MAX_AGE_SECONDS (never past the link's expiry);
+# clicks answered by such a cache never reach us and are not counted
+REDIRECT_MODE = os.getenv("REDIRECT_MODE", "json")
+REDIRECT_MAX_AGE_SECONDS = int(os.getenv("REDIRECT_MAX_AGE_SECONDS", "300"))
+
+# Memory-mapped snapshot of long-lived links (app/snapshot.py), consulted by GET /links/{short_code} before Redis.
+# One worker rebuilds it every SNAPSHOT_REBUILD_INTERVAL_SECONDS (or run python -m app.snapshot), every worker
+# reopens it when the file changes. Links expiring within SNAPSHOT_MIN_TTL_SECONDS are left out. Unset disables it
+SNAPSHOT_PATH = os.getenv("SNAPSHOT_PATH")
+SNAPSHOT_MIN_TTL_SECONDS = float(os.getenv("SNAPSHOT_MIN_TTL_SECONDS", "86400"))
+SNAPSHOT_REBUILD_INTERVAL_SECONDS = float(os.getenv("SNAPSHOT_REBUILD_INTERVAL_SECONDS", "3600"))
+SNAPSHOT_RELOAD_INTERVAL_SECONDS = float(os.getenv("SNAPSHOT_RELOAD_INTERVAL_SECONDS", "30"))
+SNAPSHOT_LOCK_KEY = "snapshot:build"
+# Sorted set of codes changed since (score) a given time; a loaded snapshot never answers for those
+SNAPSHOT_CHANGES_KEY = "snapshot:changed"
+
+# Short code generation strategy: "random" (legacy), "snowflake", "block" or "pool"
+CODE_GENERATOR = os.getenv("CODE_GENERATOR", "random")
+CODE_LENGTH = int(os.getenv("CODE_LENGTH", "6"))
+CODE_BLOCK_SIZE = int(os.getenv("CODE_BLOCK_SIZE", "1000"))
+CODE_SEQUENCE_KEY = "codegen:sequence"
+CODE_POOL_KEY = "codegen:pool"
+CODE_POOL_REFILL_SIZE = int(os.getenv("CODE_POOL_REFILL_SIZE", "10000"))
+SNOWFLAKE_WORKER_ID = int(os.environ["SNOWFLAKE_WORKER_ID"]) if "SNOWFLAKE_WORKER_ID" in os.environ else None
+SHORT_CODE_MAX_ATTEMPTS = 5
+# Width of the short_code column, and so the longest custom alias accepted (generated codes are at most 11)
+SHORT_CODE_MAX_LENGTH = 32
+
+# Return the existing link when the same user (or anyone, for anonymous links) shortens an identical URL again
+DEDUPLICATE_LINKS = os.getenv("DEDUPLICATE_LINKS", "false").lower() in ("1", "true", "yes")
+
+# Links are inserted (multi-row INSERT ... RETURNING) and cached in batches of this size by POST /links/bulk
+BULK_BATCH_SIZE = int(os.getenv("BULK_BATCH_SIZE", "1000"))
+
+# Link export (GET /links/export, python -m app.export): rows per read transaction, and rows per server-side
+# cursor fetch
+EXPORT_PAGE_SIZE = int(os.getenv("EXPORT_PAGE_SIZE", "50000"))
+EXPORT_FETCH_SIZE = int(os.getenv("EXPORT_FETCH_SIZE", "1000"))
+
+# Background deletion of expired links
+EXPIRY_SWEEP_INTERVAL_SECONDS = float(os.getenv("EXPIRY_SWEEP_INTERVAL_SECONDS", "60"))
+EXPIRY_SWEEP_BATCH_SIZE = int(os.getenv("EXPIRY_SWEEP_BATCH_SIZE", "1000"))
+EXPIRY_SWEEP_MAX_BATCHES = int(os.getenv("EXPIRY_SWEEP_MAX_BATCHES", "100"))
+
+# Short-lived cache of authenticated users so token checks skip the users table
+USER_CACHE_MAX_SIZE = int(os.getenv("USER_CACHE_MAX_SIZE", "10000"))
+USER_CACHE_TTL_SECONDS = float(os.getenv("USER_CACHE_TTL_SECONDS", "60"))
+
+# Password hashing: bcrypt cost and the dedicated process pool it runs on (0 workers = request threadpool)
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+PASSWORD_HASH_QUEUE_SIZE = int(os.getenv("PASSWORD_HASH_QUEUE_SIZE", "16"))
+
+# Rate limits, "<requests>/<seconds>" per client and route ("0/..." disables one): link creation and bulk
+# requests (each up to any number of links) per user, registration and login per IP. RATE_LIMIT_USER_OVERRIDES
+# ("<user id>=<requests>/<seconds>,...") replaces the per-user limits for given users. Counters live in Redis; each worker leases RATE_LIMIT_LOCAL_SHARE of a limit
+# at a time into an in-process bucket of at most RATE_LIMIT_LOCAL_MAX_KEYS clients
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() in ("1", "true", "yes")
+RATE_LIMIT_SHORTEN = os.getenv("RATE_LIMIT_SHORTEN", "120/60")
+RATE_LIMIT_BULK = os.getenv("RATE_LIMIT_BULK", "10/60")
+RATE_LIMIT_REGISTER = os.getenv("RATE_LIMIT_REGISTER", "10/3600")
+RATE_LIMIT_LOGIN = os.getenv("RATE_LIMIT_LOGIN", "20/60")
+RATE_LIMIT_USER_OVERRIDES = os.getenv("RATE_LIMIT_USER_OVERRIDES", "")
+RATE_LIMIT_LOCAL_SHARE = float(os.getenv("RATE_LIMIT_LOCAL_SHARE", "0.1"))
+RATE_LIMIT_LOCAL_MAX_KEYS = int(os.getenv("RATE_LIMIT_LOCAL_MAX_KEYS", "100000"))
+# Take the client address from the first X-Forwarded-For entry (only behind a proxy that sets it)
+RATE_LIMIT_TRUST_FORWARDED_FOR = os.getenv("RATE_LIMIT_TRUST_FORWARDED_FOR", "false").lower() in ("1", "true", "yes")
+
+# Click analytics: events are buffered ("memory" or a "redis" stream) and rolled up per minute/hour/day
+ANALYTICS_BACKEND = os.getenv("ANALYTICS_BACKEND", "memory")
+ANALYTICS_STREAM_KEY = "clicks:events"
+ANALYTICS_STREAM_MAX_LENGTH = int(os.getenv("ANALYTICS_STREAM_MAX_LENGTH", "1000000"))
+ANALYTICS_FLUSH_INTERVAL_SECONDS = float(os.getenv("ANALYTICS_FLUSH_INTERVAL_SECONDS", "10"))
+ANALYTICS_BATCH_SIZE = int(os.getenv("ANALYTICS_BATCH_SIZE", "10000"))
+# Consumer name in the stream's group, kept across restarts so a worker re-reads what it never acknowledged.
+# Must differ between workers: defaults to the host name and SNOWFLAKE_WORKER_ID, or the pid without one
+ANALYTICS_CONSUMER_NAME = os.getenv("ANALYTICS_CONSUMER_NAME") or f"{socket.gethostname()}-{os.getenv('SNOWFLAKE_WORKER_ID', os.getpid())}"
+# Entries left pending this long by another consumer (a worker that is gone) are claimed and rolled up
+ANALYTICS_CLAIM_IDLE_SECONDS = float(os.getenv("ANALYTICS_CLAIM_IDLE_SECONDS", "300"))
+
+# Statements slower than this are logged and counted in /metrics
+SLOW_QUERY_SECONDS = float(os.getenv("SLOW_QUERY_SECONDS", "0.1"))
+
+# Unknown short codes: Bloom filter over live codes plus a short-lived negative cache, so 404s skip the DB
+CODE_FILTER_CAPACITY = int(os.getenv("CODE_FILTER_CAPACITY", "1000000"))
+CODE_FILTER_ERROR_RATE = float(os.getenv("CODE_FILTER_ERROR_RATE", "0.01"))
+CODE_FILTER_REBUILD_INTERVAL_SECONDS = float(os.getenv("CODE_FILTER_REBUILD_INTERVAL_SECONDS", "3600"))
+# Rebuilds read the replica: codes added this recently are replayed in case it hadn't caught up with them yet
+CODE_FILTER_REPLAY_SECONDS = float(os.getenv("CODE_FILTER_REPLAY_SECONDS", "60"))
+NEGATIVE_CACHE_MAX_SIZE = int(os.getenv("NEGATIVE_CACHE_MAX_SIZE", "100000"))
+NEGATIVE_CACHE_TTL_SECONDS = float(os.getenv("NEGATIVE_CACHE_TTL_SECONDS", "30"))
+
+# Production server (python -m app.server); schema changes run separately with python -m app.migrate
+SERVER_HOST = os.getenv("SERVER_HOST", "0.0.0.0")
+SERVER_PORT = int(os.getenv("SERVER_PORT", "8000"))
+SERVER_WORKERS = int(os.getenv("WEB_CONCURRENCY", str(os.cpu_count() or 1)))
+SERVER_LOOP = os.getenv("SERVER_LOOP", "uvloop")
+SERVER_HTTP = os.getenv("SERVER_HTTP", "httptools")
+SERVER_BACKLOG = int(os.getenv("SERVER_BACKLOG", "2048"))
+SERVER_KEEPALIVE_SECONDS = int(os.getenv("SERVER_KEEPALIVE_SECONDS", "5"))
+SERVER_ACCESS_LOG = os.getenv("SERVER_ACCESS_LOG", "false").lower() in ("1", "true", "yes")
+
+# Warm-up before /ready reports ready: fill the connection pools and, once per deploy, load the most
+# clicked links into Redis (0 skips the preload)
+WARMUP_LINKS = int(os.getenv("WARMUP_LINKS", "1000"))
+WARMUP_RETRY_INTERVAL_SECONDS = float(os.getenv("WARMUP_RETRY_INTERVAL_SECONDS", "5"))
+WARMUP_LOCK_KEY = "warmup:links"
+WARMUP_LOCK_SECONDS = 300
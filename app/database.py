@@ -1,15 +1,177 @@
+import asyncio
+import heapq
+from concurrent.futures import ThreadPoolExecutor
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
-from app.config import DATABASE_URL 
+from sqlalchemy.ext.horizontal_shard import ShardedSession
+from sqlalchemy.orm import Session, sessionmaker
+from app.config import (
+    DATABASE_URL,
+    DATABASE_REPLICA_URL,
+    DATABASE_SHARD_URLS,
+    DB_MAX_OVERFLOW,
+    DB_POOL_PRE_PING,
+    DB_POOL_RECYCLE_SECONDS,
+    DB_POOL_SIZE,
+    DB_POOL_TIMEOUT_SECONDS,
+    DB_STATEMENT_CACHE_SIZE,
+    SHARD_FAN_OUT_WORKERS,
+)
+from app.sharding import PRIMARY_SHARD, shard_map
 
-engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Async DBAPI drivers and the sync driver used alongside them for schema setup and sync routes
+ASYNC_DRIVERS = {
+    "asyncpg": "psycopg2",
+    "psycopg_async": "psycopg",
+    "aiosqlite": "pysqlite",
+    "aiomysql": "pymysql",
+}
+
+
+def is_async_url(url: str) -> bool:
+    return make_url(url).get_driver_name() in ASYNC_DRIVERS
+
+
+def to_sync_url(url: str):
+    parsed = make_url(url)
+    sync_driver = ASYNC_DRIVERS.get(parsed.get_driver_name())
+    if sync_driver:
+        return parsed.set(drivername=f"{parsed.get_backend_name()}+{sync_driver}")
+    return url
+
+
+def is_memory_url(url) -> bool:
+    parsed = make_url(url)
+    return parsed.get_backend_name() == "sqlite" and parsed.database in (None, "", ":memory:")
+
+
+def engine_options(url) -> dict:
+    parsed = make_url(url)
+    options = {"query_cache_size": DB_STATEMENT_CACHE_SIZE}
+    if parsed.get_backend_name() == "sqlite":
+        # SQLite gets a singleton/static pool that takes none of the sizing options
+        return options
+    options.update(
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT_SECONDS,
+        pool_recycle=DB_POOL_RECYCLE_SECONDS,
+        pool_pre_ping=DB_POOL_PRE_PING,
+    )
+    if parsed.get_driver_name() == "asyncpg":
+        options["connect_args"] = {"prepared_statement_cache_size": DB_STATEMENT_CACHE_SIZE}
+    return options
+
+
+def build_engine(url):
+    url = to_sync_url(url)
+    return create_engine(url, **engine_options(url))
+
+
+ASYNC_MODE = is_async_url(DATABASE_URL)
+
+def sharded_session_options(primary, shards: dict) -> dict:
+    # Routes the links table across shards (see app.sharding) and every other table to the primary
+    return {
+        "shards": {PRIMARY_SHARD: primary, **shards},
+        "shard_chooser": shard_map.choose_shard,
+        "identity_chooser": shard_map.choose_identity_shards,
+        "execute_chooser": shard_map.choose_execute_shards,
+    }
+
+
+engine = build_engine(DATABASE_URL)
+shard_engines = {shard: build_engine(url) for shard, url in zip(shard_map.shard_ids, DATABASE_SHARD_URLS)}
+if shard_engines:
+    SessionLocal = sessionmaker(
+        autocommit=False, autoflush=False, class_=ShardedSession, **sharded_session_options(engine, shard_engines)
+    )
+else:
+    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
+# Without a replica, reads share the primary engine. Shards have no replicas: with shards, reads go to them
+replica_engine = build_engine(DATABASE_REPLICA_URL) if DATABASE_REPLICA_URL and not shard_engines else None
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=replica_engine) if replica_engine else SessionLocal
+
+async_engine = create_async_engine(DATABASE_URL, **engine_options(DATABASE_URL)) if ASYNC_MODE else None
+async_shard_engines = {
+    shard: create_async_engine(url, **engine_options(url)) for shard, url in zip(shard_map.shard_ids, DATABASE_SHARD_URLS)
+} if ASYNC_MODE else {}
+if async_shard_engines:
+    AsyncSessionLocal = async_sessionmaker(
+        class_=AsyncSession, expire_on_commit=False, sync_session_class=ShardedSession,
+        **sharded_session_options(
+            async_engine.sync_engine,
+            {shard: shard_engine.sync_engine for shard, shard_engine in async_shard_engines.items()},
+        ),
+    )
+else:
+    AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, expire_on_commit=False) if ASYNC_MODE else None
+
+async_replica_engine = (
+    create_async_engine(DATABASE_REPLICA_URL, **engine_options(DATABASE_REPLICA_URL))
+    if ASYNC_MODE and DATABASE_REPLICA_URL and not async_shard_engines else None
+)
+AsyncReadSessionLocal = (
+    async_sessionmaker(async_replica_engine, class_=AsyncSession, expire_on_commit=False)
+    if async_replica_engine else AsyncSessionLocal
+)
+
 def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+def get_read_db():
+    db = ReadSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+async def get_async_read_db():
+    async with AsyncReadSessionLocal() as db:
+        yield db
+
+
+# Listings and searches that can't be routed by short code query every shard at once
+fan_out_pool = ThreadPoolExecutor(max_workers=SHARD_FAN_OUT_WORKERS, thread_name_prefix="shard-fan-out")
+
+
+def fetch_from_shard(shard_engine, statement) -> list:
+    with Session(bind=shard_engine) as db:
+        return db.scalars(statement).all()
+
+
+def fan_out(db, statement, key) -> list:
+    # Runs a newest-first (or any key-ordered, descending) statement on every shard and merges the results
+    if not shard_map.sharded:
+        return db.scalars(statement).all()
+    futures = [
+        fan_out_pool.submit(fetch_from_shard, db.get_bind(shard_id=shard), statement)
+        for shard in shard_map.shard_ids
+    ]
+    return list(heapq.merge(*(future.result() for future in futures), key=key, reverse=True))
+
+
+async def fetch_from_async_shard(shard_engine, statement) -> list:
+    async with AsyncSession(shard_engine) as db:
+        return (await db.execute(statement)).scalars().all()
+
+
+async def async_fan_out(db, statement, key) -> list:
+    if not shard_map.sharded:
+        return (await db.execute(statement)).scalars().all()
+    results = await asyncio.gather(*(
+        fetch_from_async_shard(async_shard_engines[shard], statement) for shard in shard_map.shard_ids
+    ))
+    return list(heapq.merge(*results, key=key, reverse=True))
@@ -0,0 +1,123 @@
+"""Streaming export of links and their click counts as CSV or NDJSON: GET /links/export, python -m app.export.
+
+Rows are read in keyset pages of EXPORT_PAGE_SIZE ids, each page in a transaction of its own on the read database
+and fetched through a server-side cursor (yield_per) EXPORT_FETCH_SIZE rows at a time, so memory stays flat and no
+transaction outlives a page. Clicks are the flushed counters; clicks still buffered are not included.
+"""
+import argparse
+import csv
+import io
+import itertools
+import json
+import sys
+import zlib
+from datetime import datetime
+from typing import Iterable, Iterator, Optional
+from sqlalchemy import select
+from app.config import EXPORT_FETCH_SIZE, EXPORT_PAGE_SIZE
+from app.database import ReadSessionLocal
+from app.models import Link
+from app.sharding import shard_arguments, shard_map
+
+EXPORT_COLUMNS = ("id", "short_code", "original_url", "created_at", "expires_at", "last_used", "clicks", "user_id")
+EXPORT_MEDIA_TYPES = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+EXPORT_CHUNK_BYTES = 65536
+
+
+def export_query(user_id: Optional[int] = None, created_from: Optional[datetime] = None, created_to: Optional[datetime] = None):
+    query = select(*(getattr(Link, name) for name in EXPORT_COLUMNS)).order_by(Link.id)
+    if user_id is not None:
+        query = query.where(Link.user_id == user_id)
+    if created_from is not None:
+        query = query.where(Link.created_at >= created_from)
+    if created_to is not None:
+        query = query.where(Link.created_at < created_to)
+    return query
+
+
+def iter_link_rows(db, query, page_size: int = EXPORT_PAGE_SIZE, fetch_size: int = EXPORT_FETCH_SIZE) -> Iterator:
+    # Link ids are only unique within a shard, so each shard is paged on its own
+    for shard in shard_map.link_shards():
+        bind_arguments = shard_arguments(shard)
+        last_id = 0
+        while True:
+            page = query.where(Link.id > last_id).limit(page_size).execution_options(yield_per=fetch_size)
+            fetched = 0
+            for row in db.execute(page, bind_arguments=bind_arguments):
+                fetched += 1
+                last_id = row.id
+                yield row
+            db.commit()
+            if fetched < page_size:
+                break
+
+
+def export_value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def csv_lines(rows: Iterable) -> Iterator[str]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    for values in itertools.chain([EXPORT_COLUMNS], rows):
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerow([export_value(value) for value in values])
+        yield buffer.getvalue()
+
+
+def ndjson_lines(rows: Iterable) -> Iterator[str]:
+    for row in rows:
+        yield json.dumps({name: export_value(value) for name, value in zip(EXPORT_COLUMNS, row)}) + "\n"
+
+
+ENCODERS = {"csv": csv_lines, "ndjson": ndjson_lines}
+
+
+def export_chunks(rows: Iterable, export_format: str = "csv", compress: bool = False, chunk_size: int = EXPORT_CHUNK_BYTES) -> Iterator[bytes]:
+    # Lines are joined into chunks of about chunk_size bytes; with compress the chunks form one gzip stream
+    compressor = zlib.compressobj(wbits=31) if compress else None
+    parts, size = [], 0
+    for text in ENCODERS[export_format](rows):
+        parts.append(text.encode("utf-8"))
+        size += len(parts[-1])
+        if size < chunk_size:
+            continue
+        chunk = b"".join(parts)
+        parts, size = [], 0
+        chunk = compressor.compress(chunk) if compressor else chunk
+        if chunk:
+            yield chunk
+    chunk = b"".join(parts)
+    if compressor:
+        chunk = compressor.compress(chunk) + compressor.flush()
+    if chunk:
+        yield chunk
+
+
+def export_filename(export_format: str, compress: bool) -> str:
+    return f"links.{export_format}" + (".gz" if compress else "")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export links and their click counts")
+    parser.add_argument("--format", choices=sorted(ENCODERS), default="csv")
+    parser.add_argument("--gzip", action="store_true")
+    parser.add_argument("--user-id", type=int)
+    parser.add_argument("--created-from", type=datetime.fromisoformat, help="ISO date or datetime, inclusive")
+    parser.add_argument("--created-to", type=datetime.fromisoformat, help="ISO date or datetime, exclusive")
+    parser.add_argument("--output", "-o", help="file to write, stdout by default")
+    args = parser.parse_args(argv)
+    query = export_query(args.user_id, args.created_from, args.created_to)
+    output = open(args.output, "wb") if args.output else sys.stdout.buffer
+    try:
+        with ReadSessionLocal() as db:
+            for chunk in export_chunks(iter_link_rows(db, query), args.format, args.gzip):
+                output.write(chunk)
+    finally:
+        if args.output:
+            output.close()
+
+
+if __name__ == "__main__":
+    main()
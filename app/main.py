@@ -1,10 +1,107 @@
-from fastapi import FastAPI
-from app.routers import links, users 
-from app.database import Base, engine 
+import os
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Response
+from fastapi.responses import JSONResponse
+from app.routers import links, users
+from app.database import (
+    ASYNC_MODE,
+    async_engine,
+    async_replica_engine,
+    async_shard_engines,
+    engine,
+    is_memory_url,
+    replica_engine,
+    shard_engines,
+)
+from app.analytics import aggregate_events, analytics_aggregator
+from app.auth import shutdown_password_pool, user_cache
+from app.cache import invalidation_listener, local_cache
+from app.clicks import click_flusher, flush_clicks
+from app.membership import code_filter_rebuilder, negative_cache
+from app.config import CODE_GENERATOR, SNAPSHOT_PATH
+from app.sweeper import expiry_sweeper
+from app.metrics import LocalCacheCollector, MetricsMiddleware, instrument_engine, register_process_collector, render_metrics
+from app.warmup import ready, warmer
 
-app = FastAPI()
 
-Base.metadata.create_all(bind=engine)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # /ready answers 503 until the pools and cache are warm
+    warmer.start()
+    warmer.trigger()
+    invalidation_listener.start()
+    code_filter_rebuilder.start()
+    # Built in the background; until then unknown codes fall through to the database
+    code_filter_rebuilder.trigger()
+    click_flusher.start()
+    expiry_sweeper.start()
+    analytics_aggregator.start()
+    # Optional subsystems are only imported when their setting turns them on
+    if CODE_GENERATOR == "pool":
+        from app.codegen import code_pool_refiller
+        code_pool_refiller.start()
+    if SNAPSHOT_PATH:
+        from app.snapshot import snapshot_builder, snapshot_reloader
+        snapshot_reloader.start()
+        snapshot_reloader.trigger()
+        snapshot_builder.start()
+        if not os.path.exists(SNAPSHOT_PATH):
+            # First deploy: don't wait a whole rebuild interval for the first snapshot
+            snapshot_builder.trigger()
+    yield
+    if SNAPSHOT_PATH:
+        snapshot_builder.stop()
+        snapshot_reloader.stop()
+    if CODE_GENERATOR == "pool":
+        code_pool_refiller.stop()
+    analytics_aggregator.stop()
+    expiry_sweeper.stop()
+    click_flusher.stop()
+    code_filter_rebuilder.stop()
+    invalidation_listener.stop()
+    warmer.stop()
+    shutdown_password_pool()
+    flush_clicks()
+    aggregate_events()
+
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(MetricsMiddleware)
+
+instrument_engine(engine)
+if replica_engine:
+    instrument_engine(replica_engine, "replica")
+if ASYNC_MODE:
+    instrument_engine(async_engine.sync_engine, "async")
+if async_replica_engine:
+    instrument_engine(async_replica_engine.sync_engine, "async_replica")
+for shard, shard_engine in shard_engines.items():
+    instrument_engine(shard_engine, f"shard_{shard}")
+for shard, shard_engine in async_shard_engines.items():
+    instrument_engine(shard_engine.sync_engine, f"async_shard_{shard}")
+if is_memory_url(engine.url):
+    # An in-memory database lives and dies with this process, so no migration step can have run
+    from app.migrate import migrate
+    migrate()
+
+register_process_collector(LocalCacheCollector({"links": local_cache, "users": user_cache, "negative": negative_cache}))
 
 app.include_router(users.router, prefix="")
-app.include_router(links.router, prefix="/links")
\ No newline at end of file
+if ASYNC_MODE:
+    # Only imported when used. Registered first so the async read handlers take precedence over the sync ones
+    from app.routers import links_async
+    app.include_router(links_async.router, prefix="/links")
+app.include_router(links.router, prefix="/links")
+
+
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    content, content_type = render_metrics()
+    return Response(content=content, media_type=content_type)
+
+
+@app.get("/ready", include_in_schema=False)
+def readiness():
+    if not ready.is_set():
+        return JSONResponse({"status": "warming up"}, status_code=503)
+    return {"status": "ready"}
@@ -0,0 +1,155 @@
+import hashlib
+import math
+import threading
+import time
+from collections import deque
+from sqlalchemy import func, select
+from app.cache import LocalCache, invalidation_listener
+from app.config import (
+    CODE_FILTER_CAPACITY,
+    CODE_FILTER_ERROR_RATE,
+    CODE_FILTER_REBUILD_INTERVAL_SECONDS,
+    CODE_FILTER_REPLAY_SECONDS,
+    NEGATIVE_CACHE_MAX_SIZE,
+    NEGATIVE_CACHE_TTL_SECONDS,
+)
+from app.database import ReadSessionLocal
+from app.metrics import FILTER_REJECTIONS, NEGATIVE_CACHE_REJECTIONS
+from app.models import Link
+from app.tasks import PeriodicTask
+
+REBUILD_BATCH_SIZE = 10000
+
+
+class BloomFilter:
+    def __init__(self, capacity: int, error_rate: float):
+        capacity = max(capacity, 1)
+        self.size = max(64, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.count = 0
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, key: str):
+        # Double hashing: k probe positions derived from one 128-bit digest
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        step = int.from_bytes(digest[8:], "little") | 1
+        return [(first + index * step) % self.size for index in range(self.hash_count)]
+
+    def add(self, key: str):
+        for position in self._positions(key):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key: str) -> bool:
+        bits = self._bits
+        return all(bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+
+class ShortCodeFilter:
+    """Bloom filter over every stored short code.
+
+    Until the first rebuild finishes the filter answers "maybe" for everything, so lookups
+    fall through to the database. Deleted codes stay in the filter until the next rebuild.
+    """
+
+    def __init__(self, capacity: int = CODE_FILTER_CAPACITY, error_rate: float = CODE_FILTER_ERROR_RATE, replay_seconds: float = CODE_FILTER_REPLAY_SECONDS):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.replay_seconds = replay_seconds
+        self._bloom = None
+        self._pending = None
+        # (added at, code) for the last replay_seconds
+        self._recent = deque()
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self) -> bool:
+        return self._bloom is not None
+
+    def might_contain(self, short_code: str) -> bool:
+        bloom = self._bloom
+        return bloom is None or short_code in bloom
+
+    def add(self, short_code: str):
+        now = time.monotonic()
+        with self._lock:
+            if self._bloom is not None:
+                self._bloom.add(short_code)
+            if self._pending is not None:
+                self._pending.append(short_code)
+            self._recent.append((now, short_code))
+            while self._recent and self._recent[0][0] < now - self.replay_seconds:
+                self._recent.popleft()
+
+    def rebuild(self, codes, expected_items: int) -> int:
+        # Codes added while the snapshot is being read, or shortly before, are replayed into the new filter
+        # before the swap
+        fresh = BloomFilter(max(self.capacity, expected_items * 2), self.error_rate)
+        with self._lock:
+            horizon = time.monotonic() - self.replay_seconds
+            self._pending = [code for added_at, code in self._recent if added_at >= horizon]
+        try:
+            for code in codes:
+                fresh.add(code)
+        finally:
+            with self._lock:
+                pending, self._pending = self._pending, None
+        # The codes read; replayed ones may be among them
+        loaded = fresh.count
+        with self._lock:
+            for code in pending:
+                fresh.add(code)
+            self._bloom = fresh
+        return loaded
+
+    def reset(self):
+        with self._lock:
+            self._bloom = None
+            self._pending = None
+            self._recent.clear()
+
+
+code_filter = ShortCodeFilter()
+negative_cache = LocalCache(NEGATIVE_CACHE_MAX_SIZE, NEGATIVE_CACHE_TTL_SECONDS)
+
+
+def rebuild_code_filter(db=None) -> int:
+    session = db or ReadSessionLocal()
+    try:
+        # One count per shard
+        expected = sum(session.scalars(select(func.count(Link.id))))
+        codes = session.scalars(select(Link.short_code).execution_options(yield_per=REBUILD_BATCH_SIZE))
+        return code_filter.rebuild(codes, expected)
+    finally:
+        if db is None:
+            session.close()
+
+
+code_filter_rebuilder = PeriodicTask("code-filter-rebuild", CODE_FILTER_REBUILD_INTERVAL_SECONDS, rebuild_code_filter)
+
+
+def known_missing(short_code: str) -> bool:
+    if not code_filter.might_contain(short_code):
+        FILTER_REJECTIONS.inc()
+        return True
+    if negative_cache.get(short_code):
+        NEGATIVE_CACHE_REJECTIONS.inc()
+        return True
+    return False
+
+
+def remember_missing(short_code: str):
+    negative_cache.set(short_code, True)
+
+
+def remember_code(short_code: str):
+    code_filter.add(short_code)
+    negative_cache.delete(short_code)
+
+
+# Another worker created (or changed) this code: it may exist now. Invalidations can be lost while
+# the channel is down, so every resubscribe schedules a full rebuild.
+invalidation_listener.caches.append(negative_cache)
+invalidation_listener.key_callbacks.append(code_filter.add)
+invalidation_listener.resync_callbacks.append(code_filter_rebuilder.trigger)
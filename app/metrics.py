@@ -0,0 +1,217 @@
+import logging
+import os
+import time
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Histogram, REGISTRY, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from sqlalchemy import event, exc
+from sqlalchemy.orm import Session
+from app.config import SLOW_QUERY_SECONDS
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+REQUEST_LATENCY = Histogram(
+    "shortlink_http_request_duration_seconds", "HTTP request latency by route template",
+    ["method", "route", "status"], buckets=LATENCY_BUCKETS,
+)
+CACHE_REQUESTS = Counter("shortlink_redis_cache_requests_total", "Redis cache lookups by result", ["result"])
+REDIS_LATENCY = Histogram(
+    "shortlink_redis_command_duration_seconds", "Redis command latency", ["operation"], buckets=LATENCY_BUCKETS,
+)
+DB_QUERY_LATENCY = Histogram(
+    "shortlink_db_query_duration_seconds", "SQL statement latency", ["statement"], buckets=LATENCY_BUCKETS,
+)
+DB_COMMIT_LATENCY = Histogram("shortlink_db_commit_duration_seconds", "Session commit latency", buckets=LATENCY_BUCKETS)
+DB_POOL_CHECKOUT_WAIT = Histogram(
+    "shortlink_db_pool_checkout_wait_seconds", "Time spent waiting for a pooled connection", ["pool"], buckets=LATENCY_BUCKETS,
+)
+DB_POOL_TIMEOUTS = Counter(
+    "shortlink_db_pool_timeouts_total", "Checkouts that gave up after DB_POOL_TIMEOUT_SECONDS", ["pool"],
+)
+SLOW_QUERIES = Counter("shortlink_db_slow_queries_total", "Statements slower than SLOW_QUERY_SECONDS")
+UNKNOWN_CODE_REJECTIONS = Counter(
+    "shortlink_unknown_code_rejections_total", "Lookups of unknown short codes answered without the DB", ["source"],
+)
+RATE_LIMIT_DECISIONS = Counter(
+    "shortlink_rate_limit_decisions_total", "Rate limit decisions by route, result and where they were made",
+    ["route", "result", "source"],
+)
+
+# Children resolved once so the hot path doesn't pay for label lookups
+REDIS_CACHE_HIT = CACHE_REQUESTS.labels("hit")
+REDIS_CACHE_MISS = CACHE_REQUESTS.labels("miss")
+REDIS_CACHE_EARLY_REFRESH = CACHE_REQUESTS.labels("early_refresh")
+SNAPSHOT_HIT = CACHE_REQUESTS.labels("snapshot")
+REDIS_GET_LATENCY = REDIS_LATENCY.labels("get")
+REDIS_SET_LATENCY = REDIS_LATENCY.labels("setex")
+FILTER_REJECTIONS = UNKNOWN_CODE_REJECTIONS.labels("bloom")
+NEGATIVE_CACHE_REJECTIONS = UNKNOWN_CODE_REJECTIONS.labels("negative_cache")
+QUERY_LATENCY_BY_KIND = {kind: DB_QUERY_LATENCY.labels(kind) for kind in ("SELECT", "INSERT", "UPDATE", "DELETE", "OTHER")}
+
+
+def route_template(scope) -> str:
+    # Newer FastAPI keeps included routes unprefixed and records the mounted path separately
+    context = scope.get("fastapi", {}).get("effective_route_context")
+    if context is not None:
+        return context.path
+    route = scope.get("route")
+    return route.path if route else "unmatched"
+
+
+class MetricsMiddleware:
+    # Plain ASGI middleware: cheaper than BaseHTTPMiddleware and doesn't buffer streaming responses
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status_code = 500
+        start = time.perf_counter()
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            # Route templates only, raw paths would explode label cardinality
+            REQUEST_LATENCY.labels(
+                scope["method"], route_template(scope), str(status_code)
+            ).observe(time.perf_counter() - start)
+
+
+class LocalCacheCollector:
+    def __init__(self, caches: dict):
+        self.caches = caches
+
+    def collect(self):
+        counters = {
+            name: CounterMetricFamily(f"shortlink_local_cache_{name}", f"In-process cache {name}", labels=["cache"])
+            for name in ("hits", "misses", "evictions", "expirations")
+        }
+        size = GaugeMetricFamily("shortlink_local_cache_size", "Entries in the in-process cache", labels=["cache"])
+        for cache_name, cache in self.caches.items():
+            stats = cache.stats()
+            for name, family in counters.items():
+                family.add_metric([cache_name], stats[name])
+            size.add_metric([cache_name], stats["size"])
+        yield from counters.values()
+        yield size
+
+
+class PoolCollector:
+    def __init__(self, pools: dict):
+        self.pools = pools
+
+    def collect(self):
+        families = {
+            "checkedout": GaugeMetricFamily("shortlink_db_pool_checked_out", "Connections currently checked out", labels=["pool"]),
+            "checkedin": GaugeMetricFamily("shortlink_db_pool_checked_in", "Idle connections in the pool", labels=["pool"]),
+            "overflow": GaugeMetricFamily("shortlink_db_pool_overflow", "Connections opened beyond pool_size", labels=["pool"]),
+            "size": GaugeMetricFamily("shortlink_db_pool_size", "Configured pool size", labels=["pool"]),
+        }
+        for name, pool in self.pools.items():
+            for reader, family in families.items():
+                # Only QueuePool exposes these as methods; SQLite's singleton/static pools don't
+                read = getattr(pool, reader, None)
+                if callable(read):
+                    family.add_metric([name], read())
+        yield from families.values()
+
+
+class PidLabelledCollector:
+    """Another collector's metrics with this process's pid added, for the registry shared by several workers."""
+
+    def __init__(self, collector):
+        self.collector = collector
+
+    def collect(self):
+        pid = str(os.getpid())
+        for family in self.collector.collect():
+            family.samples = [sample._replace(labels={**sample.labels, "pid": pid}) for sample in family.samples]
+            yield family
+
+
+# Collectors that read this process's state at scrape time, so the multiprocess files never see them
+process_collectors = []
+
+
+def register_process_collector(collector):
+    REGISTRY.register(collector)
+    process_collectors.append(collector)
+
+
+instrumented_pools = {}
+register_process_collector(PoolCollector(instrumented_pools))
+
+
+def statement_kind(statement: str) -> str:
+    kind = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "OTHER"
+    return kind if kind in ("SELECT", "INSERT", "UPDATE", "DELETE") else "OTHER"
+
+
+def instrument_engine(engine, name: str = "primary"):
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_start"].pop()
+        QUERY_LATENCY_BY_KIND[statement_kind(statement)].observe(elapsed)
+        if elapsed >= SLOW_QUERY_SECONDS:
+            SLOW_QUERIES.inc()
+            logger.warning("Slow query (%.1f ms): %s", elapsed * 1000, statement[:500])
+
+    pool = engine.pool
+    pool_connect = pool.connect
+    checkout_wait = DB_POOL_CHECKOUT_WAIT.labels(name)
+    checkout_timeouts = DB_POOL_TIMEOUTS.labels(name)
+
+    def timed_connect():
+        start = time.perf_counter()
+        try:
+            return pool_connect()
+        except exc.TimeoutError:
+            checkout_timeouts.inc()
+            raise
+        finally:
+            checkout_wait.observe(time.perf_counter() - start)
+
+    pool.connect = timed_connect
+    instrumented_pools[name] = pool
+
+
+@event.listens_for(Session, "before_commit")
+def before_commit(session):
+    session.info["commit_start"] = time.perf_counter()
+
+
+@event.listens_for(Session, "after_commit")
+def after_commit(session):
+    start = session.info.pop("commit_start", None)
+    if start is not None:
+        DB_COMMIT_LATENCY.observe(time.perf_counter() - start)
+
+
+def metrics_registry():
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        # Several worker processes: aggregate the per-process files they write
+        from prometheus_client import multiprocess
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        # Only the worker answering the scrape can report its caches and pools, labelled with its pid
+        for collector in process_collectors:
+            registry.register(PidLabelledCollector(collector))
+        return registry
+    return REGISTRY
+
+
+def render_metrics():
+    return generate_latest(metrics_registry()), CONTENT_TYPE_LATEST
@@ -0,0 +1,120 @@
+"""One-shot schema setup, run once per deploy before the workers start: python -m app.migrate"""
+import logging
+from sqlalchemy import bindparam, inspect, literal, select, text, update
+from sqlalchemy.schema import CreateTable
+from app.config import MIGRATION_BATCH_SIZE
+from app.database import Base, engine, shard_engines
+from app.models import Link, create_trigram_extension  # also registers every table on Base.metadata
+from app.services import url_fields
+
+logger = logging.getLogger(__name__)
+
+
+def add_missing_columns(connection, table) -> list:
+    # create_all never alters a table that exists: columns added to the model since are added here, with their
+    # scalar default so existing rows satisfy NOT NULL
+    dialect = connection.dialect
+    existing = {column["name"] for column in inspect(connection).get_columns(table.name)}
+    added = []
+    for column in table.columns:
+        if column.name in existing:
+            continue
+        ddl = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(dialect=dialect)}"
+        if column.default is not None and column.default.is_scalar:
+            default = literal(column.default.arg, column.type).compile(dialect=dialect, compile_kwargs={"literal_binds": True})
+            ddl += f" DEFAULT {default}"
+        if not column.nullable:
+            ddl += " NOT NULL"
+        connection.execute(text(ddl))
+        added.append(column.name)
+    if added:
+        logger.info("Added columns %s to %s", ", ".join(added), table.name)
+    return added
+
+
+def index_names(connection, table) -> set:
+    if connection.dialect.name == "sqlite":
+        # SQLite reflection leaves out expression indexes such as uq_links_url_digest_owner
+        query = text("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = :table")
+        return set(connection.scalars(query, {"table": table.name}))
+    return {index["name"] for index in inspect(connection).get_indexes(table.name)}
+
+
+def upgrade_table(bind, table):
+    with bind.begin() as connection:
+        add_missing_columns(connection, table)
+        existing = index_names(connection, table)
+        for index in table.indexes:
+            if index.name not in existing:
+                # Honours ddl_if (the trigram index is Postgres only)
+                index.create(connection)
+
+
+def migrate_shard(bind):
+    # A shard holds only the links table, without the foreign key to users that live on the primary
+    links = Link.__table__
+    with bind.begin() as connection:
+        create_trigram_extension(links, connection)
+        connection.execute(CreateTable(links, include_foreign_key_constraints=[], if_not_exists=True))
+    upgrade_table(bind, links)
+
+
+# Indexes of older schemas: the btree on original_url and duplicates of the primary keys
+LEGACY_INDEXES = ("ix_links_original_url", "ix_links_id", "ix_users_id")
+
+
+def backfill_url_fields(bind, batch_size: int = MIGRATION_BATCH_SIZE) -> int:
+    # Links created before url_digest and netloc existed get them from their URL, which was already stored
+    # normalized. Each batch commits on its own, so no long transaction holds the table
+    links = Link.__table__
+    pending = (
+        select(links.c.id, links.c.original_url)
+        .where(links.c.url_digest.is_(None), links.c.original_url.isnot(None))
+        .limit(batch_size)
+    )
+    backfill = (
+        update(links)
+        .where(links.c.id == bindparam("link_id"))
+        .values(url_digest=bindparam("digest"), netloc=bindparam("link_netloc"))
+    )
+    filled = 0
+    while True:
+        with bind.begin() as connection:
+            rows = connection.execute(pending).all()
+            if not rows:
+                break
+            values = []
+            for row in rows:
+                fields = url_fields(row.original_url)
+                values.append({"link_id": row.id, "digest": fields["url_digest"], "link_netloc": fields["netloc"]})
+            connection.execute(backfill, values)
+        filled += len(rows)
+        logger.info("Backfilled URL fields of %d links", filled)
+    return filled
+
+
+def drop_legacy_indexes(connection):
+    for name in LEGACY_INDEXES:
+        connection.execute(text(f"DROP INDEX IF EXISTS {name}"))
+
+
+def migrate(bind=engine, shards=shard_engines):
+    # With shards the primary keeps users and click rollups only
+    tables = [table for table in Base.metadata.sorted_tables if not shards or table is not Link.__table__]
+    Base.metadata.create_all(bind=bind, tables=tables)
+    for table in tables:
+        upgrade_table(bind, table)
+    if not shards:
+        backfill_url_fields(bind)
+    for shard_engine in shards.values():
+        migrate_shard(shard_engine)
+        backfill_url_fields(shard_engine)
+    for links_bind in [bind, *shards.values()]:
+        with links_bind.begin() as connection:
+            drop_legacy_indexes(connection)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    migrate()
+    logger.info("Schema is up to date")
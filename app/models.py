@@ -1,23 +1,62 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey
+from sqlalchemy import Boolean, Column, DDL, Integer, LargeBinary, String, DateTime, ForeignKey, Index, UniqueConstraint, event, func, text
 from sqlalchemy.orm import relationship
+from app.config import SHORT_CODE_MAX_LENGTH
 from app.database import Base
 from datetime import datetime
 
 class User(Base):
     __tablename__ = "users"
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True)
     username = Column(String, unique=True, index=True)
     hashed_password = Column(String)
+    token_version = Column(Integer, default=0, nullable=False)
     links = relationship("Link", back_populates="user")
 
 class Link(Base):
     __tablename__ = "links"
-    id = Column(Integer, primary_key=True, index=True)
-    original_url = Column(String, index=True)
-    short_code = Column(String, unique=True, index=True)
+    __table_args__ = (
+        # Serves GET /links: one user's links newest first, paginated by (created_at, id)
+        Index("ix_links_user_created_id", "user_id", "created_at", "id"),
+        # Serves domain search in the same newest-first order
+        Index("ix_links_netloc_created_id", "netloc", "created_at", "id"),
+        # Serves prefix search (LIKE 'prefix%') on Postgres; elsewhere it falls back to the netloc index
+        Index(
+            "ix_links_original_url_trgm", "original_url",
+            postgresql_using="gin", postgresql_ops={"original_url": "gin_trgm_ops"},
+        ).ddl_if(dialect="postgresql"),
+        # One deduplicated link per (URL, owner); anonymous links share owner 0. Partial, so links created
+        # with a custom alias or with deduplication switched off may repeat a URL
+        Index(
+            "uq_links_url_digest_owner", "url_digest", func.coalesce(text("user_id"), 0),
+            unique=True, postgresql_where=text("deduplicated"), sqlite_where=text("deduplicated"),
+        ),
+    )
+    id = Column(Integer, primary_key=True)
+    original_url = Column(String)
+    # Raw 32-byte sha256 of the normalized URL: exact lookups go through this fixed-width index
+    url_digest = Column(LargeBinary(32), index=True)
+    netloc = Column(String)
+    deduplicated = Column(Boolean, nullable=False, default=False)
+    short_code = Column(String(SHORT_CODE_MAX_LENGTH), unique=True, index=True)
     created_at = Column(DateTime, default=datetime.utcnow)
-    expires_at = Column(DateTime, nullable=True)
+    expires_at = Column(DateTime, nullable=True, index=True)
     last_used = Column(DateTime, nullable=True)
     clicks = Column(Integer, default=0)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=True)
-    user = relationship("User", back_populates="links")
\ No newline at end of file
+    # Bumped by every update, so stale cache fills can't overwrite a newer cached entry
+    version = Column(Integer, nullable=False, default=0)
+    user = relationship("User", back_populates="links")
+
+create_trigram_extension = DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(dialect="postgresql")
+event.listen(Base.metadata, "before_create", create_trigram_extension)
+
+class ClickRollup(Base):
+    __tablename__ = "click_rollups"
+    __table_args__ = (
+        UniqueConstraint("short_code", "granularity", "bucket_start", name="uq_click_rollups_bucket"),
+    )
+    id = Column(Integer, primary_key=True)
+    short_code = Column(String(SHORT_CODE_MAX_LENGTH), nullable=False)
+    granularity = Column(String(8), nullable=False)
+    bucket_start = Column(DateTime, nullable=False)
+    clicks = Column(Integer, nullable=False, default=0)
@@ -0,0 +1,187 @@
+"""Rate limits for link creation, bulk requests, registration and login, as FastAPI dependencies.
+
+Each limit is a GCRA in Redis, one key per route and client, advanced by an atomic Lua script, so every worker
+enforces the same budget. A worker takes a share of a client's budget at a time into an in-process bucket and
+remembers a rejection until its Retry-After, so most decisions, allowed or rejected, make no round trip. Tokens
+held by one worker can't be spent on another, so a client may be turned away slightly early, never late.
+"""
+import logging
+import math
+import time
+from collections import OrderedDict
+from typing import Dict, NamedTuple, Optional
+import redis
+from fastapi import Depends, HTTPException, Request, status
+from app.auth import CurrentUser, fetch_current_user
+from app.cache import async_redis_client
+from app.config import (
+    RATE_LIMIT_BULK,
+    RATE_LIMIT_ENABLED,
+    RATE_LIMIT_LOCAL_MAX_KEYS,
+    RATE_LIMIT_LOCAL_SHARE,
+    RATE_LIMIT_LOGIN,
+    RATE_LIMIT_REGISTER,
+    RATE_LIMIT_SHORTEN,
+    RATE_LIMIT_TRUST_FORWARDED_FOR,
+    RATE_LIMIT_USER_OVERRIDES,
+)
+from app.metrics import RATE_LIMIT_DECISIONS
+
+logger = logging.getLogger(__name__)
+
+# GCRA taking up to ARGV[3] tokens at once. KEYS[1] holds the theoretical arrival time in milliseconds,
+# ARGV[1] is the interval between requests and ARGV[2] the burst tolerance (the whole period), both in ms.
+# Returns {tokens granted, ms until the next token when none were}
+TAKE_TOKENS_SCRIPT = """
+local clock = redis.call("time")
+local now = clock[1] * 1000 + math.floor(clock[2] / 1000)
+local interval = tonumber(ARGV[1])
+local tolerance = tonumber(ARGV[2])
+local tat = math.max(tonumber(redis.call("get", KEYS[1])) or now, now)
+local granted = math.min(tonumber(ARGV[3]), math.floor((now + tolerance - tat) / interval))
+if granted < 1 then
+    return {0, tat + interval - tolerance - now}
+end
+tat = tat + granted * interval
+redis.call("set", KEYS[1], tat, "PX", math.ceil(tat - now))
+return {granted, 0}
+"""
+async_take_tokens_script = async_redis_client.register_script(TAKE_TOKENS_SCRIPT)
+
+
+class Limit(NamedTuple):
+    requests: int
+    seconds: float
+
+    @classmethod
+    def parse(cls, value: str) -> "Limit":
+        requests, _, seconds = value.partition("/")
+        limit = cls(int(requests), float(seconds or 1))
+        if limit.seconds <= 0:
+            raise ValueError(f"Rate limit period must be positive: {value}")
+        return limit
+
+    @property
+    def enabled(self) -> bool:
+        return self.requests > 0
+
+
+def parse_user_limits(value: str) -> Dict[int, Limit]:
+    overrides = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        user_id, _, limit = item.partition("=")
+        overrides[int(user_id)] = Limit.parse(limit)
+    return overrides
+
+
+class LocalBucket:
+    __slots__ = ("tokens", "expires_at", "blocked_until")
+
+    def __init__(self):
+        self.tokens = 0
+        self.expires_at = 0.0
+        self.blocked_until = 0.0
+
+
+class RateLimiter:
+    """One route's limit. Used from the event loop only, so the local buckets need no lock."""
+
+    def __init__(self, route: str, limit: Limit, overrides: Optional[Dict] = None, max_keys: int = RATE_LIMIT_LOCAL_MAX_KEYS):
+        self.route = route
+        self.limit = limit
+        self.overrides = overrides or {}
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        # Children resolved once so the hot path doesn't pay for label lookups
+        self._allowed_local = RATE_LIMIT_DECISIONS.labels(route, "allowed", "local")
+        self._allowed_redis = RATE_LIMIT_DECISIONS.labels(route, "allowed", "redis")
+        self._allowed_unavailable = RATE_LIMIT_DECISIONS.labels(route, "allowed", "unavailable")
+        self._rejected_local = RATE_LIMIT_DECISIONS.labels(route, "rejected", "local")
+        self._rejected_redis = RATE_LIMIT_DECISIONS.labels(route, "rejected", "redis")
+
+    def bucket(self, client: str) -> LocalBucket:
+        bucket = self._buckets.get(client)
+        if bucket is None:
+            bucket = self._buckets[client] = LocalBucket()
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(client)
+        return bucket
+
+    def clear(self):
+        self._buckets.clear()
+
+    def reject(self, retry_after: float, counter):
+        counter.inc()
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many requests",
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+        )
+
+    async def check(self, client: str, override_key=None):
+        limit = self.overrides.get(override_key, self.limit)
+        if not RATE_LIMIT_ENABLED or not limit.enabled:
+            return
+        bucket = self.bucket(client)
+        now = time.monotonic()
+        if bucket.blocked_until > now:
+            self.reject(bucket.blocked_until - now, self._rejected_local)
+        if bucket.tokens > 0 and bucket.expires_at > now:
+            bucket.tokens -= 1
+            self._allowed_local.inc()
+            return
+        interval_ms = limit.seconds * 1000 / limit.requests
+        wanted = max(1, int(limit.requests * RATE_LIMIT_LOCAL_SHARE))
+        try:
+            granted, retry_ms = await async_take_tokens_script(
+                keys=[f"ratelimit:{self.route}:{client}"], args=[interval_ms, int(limit.seconds * 1000), wanted],
+            )
+        except redis.RedisError:
+            # Fails open: an unreachable Redis must not take registration and login down with it
+            logger.warning("Rate limiter for %s unavailable, allowing the request", self.route, exc_info=True)
+            self._allowed_unavailable.inc()
+            return
+        if not granted:
+            bucket.tokens = 0
+            bucket.blocked_until = now + retry_ms / 1000
+            self.reject(retry_ms / 1000, self._rejected_redis)
+        # Leased tokens were charged in Redis already, and are dropped once a period has passed
+        bucket.tokens = int(granted) - 1
+        bucket.expires_at = now + limit.seconds
+        self._allowed_redis.inc()
+
+
+def client_address(request: Request) -> str:
+    if RATE_LIMIT_TRUST_FORWARDED_FOR:
+        forwarded_for = request.headers.get("x-forwarded-for")
+        if forwarded_for:
+            return forwarded_for.split(",")[0].strip()
+    return request.client.host if request.client else "unknown"
+
+
+def limit_per_ip(route: str, limit: str):
+    limiter = RateLimiter(route, Limit.parse(limit))
+
+    async def dependency(request: Request):
+        await limiter.check(f"ip:{client_address(request)}")
+
+    dependency.limiter = limiter
+    return dependency
+
+
+def limit_per_user(route: str, limit: str, overrides: str = RATE_LIMIT_USER_OVERRIDES):
+    limiter = RateLimiter(route, Limit.parse(limit), parse_user_limits(overrides))
+
+    async def dependency(user: CurrentUser = Depends(fetch_current_user)):
+        await limiter.check(f"user:{user.id}", user.id)
+
+    dependency.limiter = limiter
+    return dependency
+
+
+shorten_rate_limit = limit_per_user("shorten", RATE_LIMIT_SHORTEN)
+bulk_rate_limit = limit_per_user("bulk", RATE_LIMIT_BULK)
+register_rate_limit = limit_per_ip("register", RATE_LIMIT_REGISTER)
+login_rate_limit = limit_per_ip("login", RATE_LIMIT_LOGIN)
@@ -0,0 +1,114 @@
+"""Moves links onto shards added to DATABASE_SHARD_URLS: python -m app.rebalance
+
+Append the new shard URLs, set SHARD_PREVIOUS_COUNT to the number of shards before the change and deploy
+(the app then also looks a code up on its previous owner), run `python -m app.migrate` and this tool, then
+unset SHARD_PREVIOUS_COUNT. The app keeps serving throughout: a link is copied to its new owner before it
+is deleted from the old one, and a link updated after its copy was taken stays behind for the next pass.
+Meanwhile new codes are checked against their previous owner too, and deletes remove every copy.
+"""
+import logging
+from sqlalchemy import bindparam, delete, func, insert, select
+from app.config import SHARD_REBALANCE_BATCH_SIZE
+from app.database import SessionLocal
+from app.models import Link
+from app.sharding import shard_arguments, shard_map
+
+logger = logging.getLogger(__name__)
+
+links_table = Link.__table__
+copy_columns = [column for column in links_table.c if column.name != "id"]
+# A copy on the new shard has its own id; these never change, so they tell the copy from a different link
+# that happens to have the same code there
+identity_columns = ("short_code", "created_at", "user_id")
+delete_moved_statement = (
+    delete(links_table)
+    .where(links_table.c.id == bindparam("b_id"), links_table.c.version == bindparam("b_version"))
+)
+
+
+def is_copy(target_row, row) -> bool:
+    return all(target_row[name] == row[name] for name in identity_columns)
+
+
+def move_links(db, source: str, target: str, rows: list) -> int:
+    source_arguments = shard_arguments(source)
+    target_arguments = shard_arguments(target)
+    # Re-read (and on Postgres lock until the copy commits) the batch, so links deleted or changed since the
+    # batch was selected are neither resurrected on the target nor copied stale
+    rows = db.execute(
+        select(links_table).where(links_table.c.id.in_([row["id"] for row in rows])).with_for_update(),
+        bind_arguments=source_arguments,
+    ).mappings().all()
+    existing = {
+        target_row["short_code"]: target_row
+        for target_row in db.execute(
+            select(links_table.c.id, links_table.c.version, *(links_table.c[name] for name in identity_columns))
+            .where(links_table.c.short_code.in_([row["short_code"] for row in rows])),
+            bind_arguments=target_arguments,
+        ).mappings()
+    }
+    copies, stale, moving = [], [], []
+    for row in rows:
+        target_row = existing.get(row["short_code"])
+        if target_row is not None and not is_copy(target_row, row):
+            # Another link got the same code on the new shard; both stay until an operator resolves it
+            logger.warning("Short code %s exists on shards %s and %s, not moved", row["short_code"], source, target)
+            continue
+        moving.append(row)
+        if target_row is None or target_row["version"] < row["version"]:
+            # Not copied yet, or the copy left by an earlier pass is older than the link
+            copies.append({column.name: row[column.name] for column in copy_columns})
+            if target_row is not None:
+                stale.append(target_row["id"])
+    if stale:
+        db.execute(delete(links_table).where(links_table.c.id.in_(stale)), bind_arguments=target_arguments)
+    if copies:
+        db.execute(insert(links_table), copies, bind_arguments=target_arguments)
+    db.commit()
+    if not moving:
+        return 0
+    # Only links unchanged since they were copied leave the source
+    ids = [row["id"] for row in moving]
+    db.execute(delete_moved_statement, [{"b_id": row["id"], "b_version": row["version"]} for row in moving], bind_arguments=source_arguments)
+    db.commit()
+    # executemany rowcounts aren't reliable across drivers, so count what stayed behind instead
+    left = db.scalar(
+        select(func.count()).select_from(links_table).where(links_table.c.id.in_(ids)), bind_arguments=source_arguments
+    )
+    return len(moving) - left
+
+
+def rebalance_shard(db, shard: str, batch_size: int = SHARD_REBALANCE_BATCH_SIZE) -> int:
+    # Walks the shard by id; every link whose code now hashes to another shard is moved there
+    moved, last_id = 0, 0
+    while True:
+        rows = db.execute(
+            select(links_table).where(links_table.c.id > last_id).order_by(links_table.c.id).limit(batch_size),
+            bind_arguments=shard_arguments(shard),
+        ).mappings().all()
+        if not rows:
+            return moved
+        last_id = rows[-1]["id"]
+        for target, leaving in shard_map.group_by_shard(rows, lambda row: row["short_code"]).items():
+            if target != shard:
+                moved += move_links(db, shard, target, leaving)
+
+
+def rebalance(db=None) -> int:
+    # Passes over every shard until one moves nothing (links updated mid-move wait for the next pass)
+    session = db or SessionLocal()
+    total = 0
+    try:
+        while True:
+            moved = sum(rebalance_shard(session, shard) for shard in shard_map.link_shards() if shard is not None)
+            total += moved
+            if not moved:
+                return total
+    finally:
+        if db is None:
+            session.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    logger.info("%d links moved, SHARD_PREVIOUS_COUNT can be unset", rebalance())
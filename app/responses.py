@@ -0,0 +1,52 @@
+import math
+from datetime import datetime
+from fastapi import Request
+from fastapi.responses import JSONResponse, Response
+from app.cache import LinkEntry
+from app.config import REDIRECT_MAX_AGE_SECONDS, REDIRECT_MODE
+
+REDIRECT_STATUSES = {"301": 301, "302": 302, "307": 307}
+
+
+class LinkRedirect(Response):
+    """Bodyless redirect to a stored URL.
+
+    Unlike starlette's RedirectResponse the Location is not re-quoted: stored URLs were
+    validated and normalized on the way in.
+    """
+
+    def __init__(self, location: str, status_code: int, headers: dict):
+        super().__init__(status_code=status_code, headers={"location": location, **headers})
+
+
+def cache_control(expires_at: datetime = None) -> str:
+    max_age = REDIRECT_MAX_AGE_SECONDS
+    if expires_at is not None:
+        max_age = min(max_age, math.floor((expires_at - datetime.utcnow()).total_seconds()))
+    return f"public, max-age={max_age}" if max_age > 0 else "no-store"
+
+
+def entity_tag(entry: LinkEntry) -> str:
+    # Changes whenever the link is updated, which bumps its version
+    return f'"{entry.id}-{entry.version}"'
+
+
+def build_link_response(mode: str):
+    if mode == "json":
+        # Returned as a Response, so FastAPI skips validating and re-encoding it
+        return lambda entry, request: JSONResponse({"original_url": entry.original_url})
+    if mode not in REDIRECT_STATUSES:
+        raise ValueError(f"Unknown redirect mode: {mode}")
+    status_code = REDIRECT_STATUSES[mode]
+
+    def redirect(entry: LinkEntry, request: Request) -> Response:
+        etag = entity_tag(entry)
+        headers = {"cache-control": cache_control(entry.expires_at), "etag": etag}
+        if request.headers.get("if-none-match") == etag:
+            return Response(status_code=304, headers=headers)
+        return LinkRedirect(entry.original_url, status_code, headers)
+
+    return redirect
+
+
+link_response = build_link_response(REDIRECT_MODE)
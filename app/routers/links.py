@@ -1,67 +1,222 @@
-from fastapi import APIRouter, Depends, HTTPException
-from app.auth import fetch_current_user
-from app.database import SessionLocal, get_db
-from app.models import Link, User
-from app.schemas import LinkCreate, Link as LinkSchema
-from app.services import create_link, get_link, delete_link, update_link, get_stats, search_by_url
-from app.cache import cache_get, cache_set, cache_delete
+import json
 from datetime import datetime
+from typing import List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from pydantic import ValidationError
+from app.auth import CurrentUser, fetch_current_user
+from app.database import SessionLocal, get_db, get_read_db, replica_engine
+from app.models import Link
+from app.schemas import LinkCreate, LinkPage, Link as LinkSchema
+from app.services import create_link, create_links_bulk, get_link, delete_link, update_link, get_stats, list_user_links, search_links
+from app.cache import LinkEntry, cache_fill, cache_get, cache_set, cache_set_many, cache_delete
+from app.analytics import GRANULARITIES, emit_click, get_timeseries
+from app.clicks import record_click
+from app.config import BULK_BATCH_SIZE, SNAPSHOT_PATH
+from app.membership import known_missing, remember_missing
+from app.ratelimit import bulk_rate_limit, shorten_rate_limit
+from app.responses import link_response
+
+if SNAPSHOT_PATH:
+    # Only imported when enabled: the snapshot module registers its change callbacks on import
+    from app.snapshot import link_snapshot
+else:
+    link_snapshot = None
 
 router = APIRouter()
 
-@router.get("/search")
-def search_link(original_url: str, db: SessionLocal = Depends(get_db)):
-    found_link = search_by_url(db, original_url)
-    if found_link:
-        return [{"short_code": found_link.short_code}]
-    raise HTTPException(status_code=404, detail="Link not found")
+@router.get("", response_model=LinkPage)
+def list_links(
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = None,
+    expired: Optional[bool] = None,
+    min_clicks: Optional[int] = Query(None, ge=0),
+    user: CurrentUser = Depends(fetch_current_user),
+    db: SessionLocal = Depends(get_db),
+):
+    # clicks are the flushed counters; buffered clicks show up in /stats but not in filters here
+    try:
+        links, next_cursor = list_user_links(db, user.id, limit, cursor, expired, min_clicks)
+    except ValueError as error:
+        raise HTTPException(status_code=400, detail=str(error))
+    return {"items": links, "next_cursor": next_cursor}
+
+@router.get("/search", response_model=List[LinkSchema])
+def search_link(
+    response: Response,
+    original_url: Optional[str] = None,
+    domain: Optional[str] = None,
+    prefix: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = None,
+    user: CurrentUser = Depends(fetch_current_user),
+    db: SessionLocal = Depends(get_read_db),
+):
+    # The caller's links by exact URL, domain or URL prefix; the cursor for the next page is returned in X-Next-Cursor
+    if sum(1 for term in (original_url, domain, prefix) if term) != 1:
+        raise HTTPException(status_code=422, detail="Pass exactly one of original_url, domain or prefix")
+    try:
+        links, next_cursor = search_links(db, limit, cursor, original_url, domain, prefix, user.id)
+    except ValueError as error:
+        raise HTTPException(status_code=400, detail=str(error))
+    if not links and not cursor:
+        raise HTTPException(status_code=404, detail="Link not found")
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return links
+
+@router.get("/export")
+def export_links(
+    format: str = Query("csv", pattern="^(csv|ndjson)$"),
+    gzip: bool = False,
+    created_from: Optional[datetime] = None,
+    created_to: Optional[datetime] = None,
+    user: CurrentUser = Depends(fetch_current_user),
+    db: SessionLocal = Depends(get_read_db),
+):
+    # The caller's links with click counts, streamed; operators export any user or time range with python -m app.export.
+    # Imported on first use, workers that never export don't load it
+    from app.export import EXPORT_MEDIA_TYPES, export_chunks, export_filename, export_query, iter_link_rows
+    query = export_query(user.id, created_from, created_to)
+    return StreamingResponse(
+        export_chunks(iter_link_rows(db, query), format, gzip),
+        media_type="application/gzip" if gzip else EXPORT_MEDIA_TYPES[format],
+        headers={"content-disposition": f'attachment; filename="{export_filename(format, gzip)}"'},
+    )
+
+def track_click(short_code: str, request: Request):
+    record_click(short_code)
+    emit_click(short_code, request.headers.get("referer"), request.headers.get("user-agent"))
 
 @router.get("/{short_code}")
-def read_link(short_code: str, db: SessionLocal = Depends(get_db)):
-    cached_data = cache_get(short_code)
-    if cached_data:
-        link_record = db.query(Link).filter(Link.short_code == short_code).first()
-        if link_record:
-            link_record.clicks += 1
-            link_record.last_used = datetime.utcnow()
-            db.commit()
-        return {"original_url": cached_data}
-    link_record = get_link(db, short_code)
-    if link_record:
-        cache_set(link_record.short_code, link_record.original_url)
-        return {"original_url": link_record.original_url}
-    raise HTTPException(status_code=404, detail="Link not found")
+def read_link(short_code: str, request: Request, db: SessionLocal = Depends(get_read_db)):
+    if known_missing(short_code):
+        raise HTTPException(status_code=404, detail="Link not found")
 
-@router.post("/shorten", response_model=LinkSchema)
-def shorten_link(link: LinkCreate, user: User = Depends(fetch_current_user), db: SessionLocal = Depends(get_db)):
-    created_link = create_link(db, link.original_url, link.custom_alias, link.expires_at, user.id)
-    cache_set(created_link.short_code, created_link.original_url)
+    def load():
+        link_record = get_link(db, short_code, count_click=False)
+        if link_record is None and replica_engine is not None:
+            # A link created moments ago may not have reached the replica yet
+            with SessionLocal() as primary:
+                link_record = get_link(primary, short_code, count_click=False)
+        return LinkEntry.from_link(link_record) if link_record else None
+
+    # Served entirely from the snapshot or the cached entry; concurrent misses for the same code share one database lookup
+    entry = (link_snapshot and link_snapshot.get(short_code)) or cache_get(short_code) or cache_fill(short_code, load)
+    if entry is None or entry.expired():
+        remember_missing(short_code)
+        raise HTTPException(status_code=404, detail="Link not found")
+    track_click(short_code, request)
+    return link_response(entry, request)
+
+@router.post("/shorten", response_model=LinkSchema, dependencies=[Depends(shorten_rate_limit)])
+def shorten_link(link: LinkCreate, user: CurrentUser = Depends(fetch_current_user), db: SessionLocal = Depends(get_db)):
+    created_link = create_link(db, str(link.original_url), link.custom_alias, link.expires_at, user.id)
+    cache_set(created_link.short_code, LinkEntry.from_link(created_link), created=True)
     return created_link
 
+def parse_ndjson_line(line: bytes):
+    try:
+        return json.loads(line)
+    except ValueError:
+        return None
+
+async def iter_bulk_items(request: Request):
+    if request.headers.get("content-type", "").startswith("application/x-ndjson"):
+        buffer = b""
+        async for chunk in request.stream():
+            buffer += chunk
+            *lines, buffer = buffer.split(b"\n")
+            for line in lines:
+                if line.strip():
+                    yield parse_ndjson_line(line)
+        if buffer.strip():
+            yield parse_ndjson_line(buffer)
+        return
+    try:
+        items = await request.json()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid JSON body")
+    if not isinstance(items, list):
+        raise HTTPException(status_code=422, detail="Expected a JSON array of links")
+    for item in items:
+        yield item
+
+def shorten_batch(db: SessionLocal, batch: list, user_id: int, first_index: int):
+    results = [None] * len(batch)
+    valid_items, valid_positions = [], []
+    for position, item in enumerate(batch):
+        if not isinstance(item, (dict, str)):
+            results[position] = {"error": "Expected a link object or URL string"}
+            continue
+        try:
+            link = LinkCreate(**item) if isinstance(item, dict) else LinkCreate(original_url=item)
+        except (TypeError, ValidationError) as error:
+            results[position] = {"error": str(error)}
+            continue
+        valid_items.append({"original_url": str(link.original_url), "short_code": link.custom_alias, "expires_at": link.expires_at})
+        valid_positions.append(position)
+    for position, result in zip(valid_positions, create_links_bulk(db, valid_items, user_id)):
+        results[position] = result
+    created = [
+        (result["short_code"], LinkEntry(result["id"], result["original_url"], result["expires_at"], user_id, 0))
+        for result in results if "short_code" in result
+    ]
+    cache_set_many(created, created=True)
+    lines = []
+    for position, result in enumerate(results):
+        if "expires_at" in result:
+            result["expires_at"] = result["expires_at"].isoformat()
+        lines.append(json.dumps({"index": first_index + position, **result}))
+    return "\n".join(lines) + "\n"
+
+@router.post("/bulk", dependencies=[Depends(bulk_rate_limit)])
+async def bulk_shorten(request: Request, user: CurrentUser = Depends(fetch_current_user), db: SessionLocal = Depends(get_db)):
+    # Accepts a JSON array or an NDJSON stream and streams one NDJSON result line per item
+    items = iter_bulk_items(request)
+    first_item = await anext(items, None)
+
+    async def results():
+        batch, index = [], 0
+        if first_item is not None:
+            batch.append(first_item)
+        async for item in items:
+            batch.append(item)
+            if len(batch) >= BULK_BATCH_SIZE:
+                yield await run_in_threadpool(shorten_batch, db, batch, user.id, index)
+                index += len(batch)
+                batch = []
+        if batch:
+            yield await run_in_threadpool(shorten_batch, db, batch, user.id, index)
+
+    return StreamingResponse(results(), media_type="application/x-ndjson")
+
 @router.delete("/{short_code}")
-def remove_link(short_code: str, user: User = Depends(fetch_current_user), db: SessionLocal = Depends(get_db)):
+def remove_link(short_code: str, user: CurrentUser = Depends(fetch_current_user), db: SessionLocal = Depends(get_db)):
     link_to_delete = db.query(Link).filter(Link.short_code == short_code).first()
     if not link_to_delete:
         raise HTTPException(status_code=404, detail="Link not found")
     if link_to_delete.user_id != user.id:
         raise HTTPException(status_code=403, detail="Not authorized to delete this link")
+    deleted = LinkEntry.from_link(link_to_delete)
     delete_link(db, short_code)
-    cache_delete(short_code)
+    cache_delete(short_code, deleted)
     return {"message": "Link deleted"}
 
 @router.put("/{short_code}", response_model=LinkSchema)
-def modify_link(short_code: str, link: LinkCreate, user: User = Depends(fetch_current_user), db: SessionLocal = Depends(get_db)):
+def modify_link(short_code: str, link: LinkCreate, user: CurrentUser = Depends(fetch_current_user), db: SessionLocal = Depends(get_db)):
     existing_link = db.query(Link).filter(Link.short_code == short_code).first()
     if not existing_link:
         raise HTTPException(status_code=404, detail="Link not found")
     if existing_link.user_id != user.id:
         raise HTTPException(status_code=403, detail="Not authorized to update this link")
-    updated_link = update_link(db, short_code, link.original_url)
-    cache_set(short_code, updated_link.original_url)
+    updated_link = update_link(db, short_code, str(link.original_url))
+    cache_set(short_code, LinkEntry.from_link(updated_link))
     return updated_link
 
 @router.get("/{short_code}/stats")
-def link_stats(short_code: str, db: SessionLocal = Depends(get_db)):
+def link_stats(short_code: str, db: SessionLocal = Depends(get_read_db)):
     link_statistics = get_stats(db, short_code)
     if link_statistics:
         return {
@@ -70,4 +225,19 @@ def link_stats(short_code: str, db: SessionLocal = Depends(get_db)):
             "clicks": link_statistics["clicks"],
             "last_used": link_statistics["last_used"].isoformat() if link_statistics["last_used"] else None
         }
-    raise HTTPException(status_code=404, detail="Link not found")
\ No newline at end of file
+    raise HTTPException(status_code=404, detail="Link not found")
+
+@router.get("/{short_code}/stats/timeseries")
+def link_timeseries(short_code: str, granularity: str = "hour", start: Optional[datetime] = None, end: Optional[datetime] = None, db: SessionLocal = Depends(get_db)):
+    if granularity not in GRANULARITIES:
+        raise HTTPException(status_code=422, detail=f"granularity must be one of {', '.join(GRANULARITIES)}")
+    end = end or datetime.utcnow()
+    start = start or end - GRANULARITIES[granularity] * 24
+    return {
+        "short_code": short_code,
+        "granularity": granularity,
+        "buckets": [
+            {"bucket": point["bucket"].isoformat(), "clicks": point["clicks"]}
+            for point in get_timeseries(db, short_code, granularity, start, end)
+        ],
+    }
@@ -0,0 +1,80 @@
+from typing import List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.async_services import get_link, get_stats, search_links
+from app.cache import LinkEntry, async_cache_fill, async_cache_get
+from app.analytics import async_emit_click
+from app.auth import CurrentUser, fetch_current_user
+from app.clicks import async_record_click
+from app.database import AsyncSessionLocal, async_replica_engine, get_async_read_db
+from app.membership import known_missing, remember_missing
+from app.responses import link_response
+from app.routers.links import export_links, link_snapshot
+from app.schemas import Link as LinkSchema
+
+# Read-only hot paths served on the event loop when DATABASE_URL uses an async driver.
+# Write endpoints stay on the sync router in app/routers/links.py.
+router = APIRouter()
+
+@router.get("/search", response_model=List[LinkSchema])
+async def search_link(
+    response: Response,
+    original_url: Optional[str] = None,
+    domain: Optional[str] = None,
+    prefix: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = None,
+    user: CurrentUser = Depends(fetch_current_user),
+    db: AsyncSession = Depends(get_async_read_db),
+):
+    if sum(1 for term in (original_url, domain, prefix) if term) != 1:
+        raise HTTPException(status_code=422, detail="Pass exactly one of original_url, domain or prefix")
+    try:
+        links, next_cursor = await search_links(db, limit, cursor, original_url, domain, prefix, user.id)
+    except ValueError as error:
+        raise HTTPException(status_code=400, detail=str(error))
+    if not links and not cursor:
+        raise HTTPException(status_code=404, detail="Link not found")
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return links
+
+# Streams from a sync session, but is registered here too so /{short_code} below doesn't shadow it
+router.add_api_route("/export", export_links, methods=["GET"])
+
+async def track_click(short_code: str, request: Request):
+    # The Redis click buffer and event stream are written with the async client, off the blocking one
+    await async_record_click(short_code)
+    await async_emit_click(short_code, request.headers.get("referer"), request.headers.get("user-agent"))
+
+@router.get("/{short_code}")
+async def read_link(short_code: str, request: Request, db: AsyncSession = Depends(get_async_read_db)):
+    if known_missing(short_code):
+        raise HTTPException(status_code=404, detail="Link not found")
+
+    async def load():
+        link_record = await get_link(db, short_code, count_click=False)
+        if link_record is None and async_replica_engine is not None:
+            # A link created moments ago may not have reached the replica yet
+            async with AsyncSessionLocal() as primary:
+                link_record = await get_link(primary, short_code, count_click=False)
+        return LinkEntry.from_link(link_record) if link_record else None
+
+    entry = (link_snapshot and link_snapshot.get(short_code)) or await async_cache_get(short_code) or await async_cache_fill(short_code, load)
+    if entry is None or entry.expired():
+        remember_missing(short_code)
+        raise HTTPException(status_code=404, detail="Link not found")
+    await track_click(short_code, request)
+    return link_response(entry, request)
+
+@router.get("/{short_code}/stats")
+async def link_stats(short_code: str, db: AsyncSession = Depends(get_async_read_db)):
+    link_statistics = await get_stats(db, short_code)
+    if link_statistics:
+        return {
+            "original_url": link_statistics["original_url"],
+            "created_at": link_statistics["created_at"].isoformat(),
+            "clicks": link_statistics["clicks"],
+            "last_used": link_statistics["last_used"].isoformat() if link_statistics["last_used"] else None
+        }
+    raise HTTPException(status_code=404, detail="Link not found")
@@ -1,34 +1,58 @@
 from fastapi import APIRouter, HTTPException, status, Depends
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.orm import Session
-from app.auth import generate_access_token, hash_password, check_password
+from app.auth import CurrentUser, fetch_current_user, generate_user_token, hash_password_async, verify_password_async, revoke_tokens
 from app.database import get_db
 from app.models import User
+from app.ratelimit import login_rate_limit, register_rate_limit
 from app.schemas import UserCreate, Token
 
 router = APIRouter()
 
-@router.post("/register", response_model=Token)
-def register_user(user_data: UserCreate, db_session: Session = Depends(get_db)):
-    existing_user = db_session.query(User).filter(User.username == user_data.username).first()
+# The handlers are async so that bcrypt can be awaited on the password pool;
+# the sync session work is pushed to the threadpool.
+
+def find_user(db_session: Session, username: str):
+    return db_session.query(User).filter(User.username == username).first()
+
+def save_user(db_session: Session, user: User):
+    db_session.add(user)
+    db_session.commit()
+    db_session.refresh(user)
+    return user
+
+@router.post("/register", response_model=Token, dependencies=[Depends(register_rate_limit)])
+async def register_user(user_data: UserCreate, db_session: Session = Depends(get_db)):
+    existing_user = await run_in_threadpool(find_user, db_session, user_data.username)
     if existing_user:
         raise HTTPException(status_code=400, detail="Username already exists")
-    hashed_pwd = hash_password(user_data.password)
+    hashed_pwd = await hash_password_async(user_data.password)
     new_user_entry = User(username=user_data.username, hashed_password=hashed_pwd)
-    db_session.add(new_user_entry)
-    db_session.commit()
-    db_session.refresh(new_user_entry)
-    token = generate_access_token(data={"sub": new_user_entry.username})
+    await run_in_threadpool(save_user, db_session, new_user_entry)
+    token = generate_user_token(new_user_entry)
     return {"access_token": token, "token_type": "bearer"}
 
-@router.post("/token", response_model=Token)
-def login_user(credentials: OAuth2PasswordRequestForm = Depends(), db_session: Session = Depends(get_db)):
-    user_record = db_session.query(User).filter(User.username == credentials.username).first()
-    if not user_record or not check_password(credentials.password, user_record.hashed_password):
+@router.post("/token", response_model=Token, dependencies=[Depends(login_rate_limit)])
+async def login_user(credentials: OAuth2PasswordRequestForm = Depends(), db_session: Session = Depends(get_db)):
+    user_record = await run_in_threadpool(find_user, db_session, credentials.username)
+    verified, new_hash = (False, None)
+    if user_record:
+        verified, new_hash = await verify_password_async(credentials.password, user_record.hashed_password)
+    if not verified:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    token = generate_access_token(data={"sub": user_record.username})
-    return {"access_token": token, "token_type": "bearer"}
\ No newline at end of file
+    if new_hash:
+        # Stored hash predates the current BCRYPT_ROUNDS: upgrade it transparently
+        user_record.hashed_password = new_hash
+        await run_in_threadpool(save_user, db_session, user_record)
+    token = generate_user_token(user_record)
+    return {"access_token": token, "token_type": "bearer"}
+
+@router.post("/token/revoke")
+def revoke_user_tokens(user: CurrentUser = Depends(fetch_current_user), db_session: Session = Depends(get_db)):
+    revoke_tokens(db_session, user.id)
+    return {"message": "Tokens revoked"}
@@ -1,6 +1,7 @@
-from pydantic import BaseModel, AnyHttpUrl
+from pydantic import BaseModel, AnyHttpUrl, Field
 from datetime import datetime
-from typing import Optional
+from typing import List, Optional
+from app.config import SHORT_CODE_MAX_LENGTH
 
 class UserCreate(BaseModel):
     username: str
@@ -19,7 +20,7 @@ class Token(BaseModel):
 
 class LinkCreate(BaseModel):
     original_url: AnyHttpUrl
-    custom_alias: Optional[str] = None
+    custom_alias: Optional[str] = Field(None, max_length=SHORT_CODE_MAX_LENGTH)
     expires_at: Optional[datetime] = None
 
 class Link(BaseModel):
@@ -33,4 +34,8 @@ class Link(BaseModel):
     user_id: Optional[int] = None
 
     class Config:
-        orm_mode = True
\ No newline at end of file
+        orm_mode = True
+
+class LinkPage(BaseModel):
+    items: List[Link]
+    next_cursor: Optional[str] = None
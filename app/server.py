@@ -0,0 +1,40 @@
+"""Production entry point: python -m app.server"""
+import os
+import tempfile
+import uvicorn
+from app.config import (
+    SERVER_ACCESS_LOG,
+    SERVER_BACKLOG,
+    SERVER_HOST,
+    SERVER_HTTP,
+    SERVER_KEEPALIVE_SECONDS,
+    SERVER_LOOP,
+    SERVER_PORT,
+    SERVER_WORKERS,
+)
+
+
+def main():
+    if SERVER_WORKERS > 1 and "PROMETHEUS_MULTIPROC_DIR" not in os.environ:
+        # Each worker writes its metrics to files in here, /metrics aggregates them (see app.metrics)
+        os.environ["PROMETHEUS_MULTIPROC_DIR"] = tempfile.mkdtemp(prefix="shortlink-metrics-")
+    if SERVER_WORKERS > 1:
+        # In-memory click buffers are per worker, so /stats would depend on which worker answers
+        os.environ.setdefault("CLICK_BUFFER_BACKEND", "redis")
+    # The app is imported by the workers only, the supervisor process stays small
+    uvicorn.run(
+        "app.main:app",
+        host=SERVER_HOST,
+        port=SERVER_PORT,
+        workers=SERVER_WORKERS,
+        loop=SERVER_LOOP,
+        http=SERVER_HTTP,
+        backlog=SERVER_BACKLOG,
+        timeout_keep_alive=SERVER_KEEPALIVE_SECONDS,
+        access_log=SERVER_ACCESS_LOG,
+        proxy_headers=True,
+    )
+
+
+if __name__ == "__main__":
+    main()
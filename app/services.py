@@ -1,10 +1,19 @@
+import base64
+import hashlib
 from datetime import datetime, timedelta
 from typing import Optional
+from sqlalchemy import func, insert, literal_column, or_, select, tuple_
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 from urllib.parse import urlparse, urlunparse
+from app.database import fan_out
 from app.models import Link
-from app.utils import generate_short_code
-from app.config import DEFAULT_LINK_EXPIRY_DAYS 
+from app.codegen import code_generator
+from app.config import DEDUPLICATE_LINKS, DEFAULT_LINK_EXPIRY_DAYS, SHORT_CODE_MAX_ATTEMPTS
+from app.clicks import pending_clicks
+from app.membership import remember_code, remember_missing
+from app.sharding import shard_arguments, shard_map
 
 def normalize_url(url: str) -> str:
     parsed = urlparse(url)
@@ -12,36 +21,198 @@ def normalize_url(url: str) -> str:
     scheme = parsed.scheme if parsed.scheme else 'https'
     return urlunparse((scheme, parsed.netloc, path, '', '', ''))
 
+def hash_url(normalized_url: str) -> bytes:
+    return hashlib.sha256(normalized_url.encode("utf-8")).digest()
+
+def url_fields(original_url: str) -> dict:
+    # Column values derived from a link's URL; every write of original_url goes through here
+    normalized_url = normalize_url(original_url)
+    return {
+        "original_url": normalized_url,
+        "url_digest": hash_url(normalized_url),
+        "netloc": urlparse(normalized_url).netloc.lower(),
+    }
+
+# Dialects with INSERT ... ON CONFLICT, used to create deduplicated links
+UPSERT_INSERTS = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+# The uq_links_url_digest_owner index expression; the 0 must be a literal for Postgres to match the index
+LINK_OWNER = func.coalesce(Link.user_id, literal_column("0"))
+
+def deduplicates(short_code: Optional[str], expires_at: Optional[datetime]) -> bool:
+    # A custom alias or an explicit expiry asks for a link of its own
+    return DEDUPLICATE_LINKS and not short_code and not expires_at
+
+def deduplicated_query(url_digest: bytes, user_id: Optional[int]):
+    # A single probe of the uq_links_url_digest_owner index
+    return select(Link).where(Link.url_digest == url_digest, LINK_OWNER == (user_id or 0), Link.deduplicated)
+
+def deduplicated_insert(dialect_name: str, values: dict):
+    upsert = UPSERT_INSERTS.get(dialect_name)
+    if upsert is None:
+        # No ON CONFLICT: a concurrent duplicate surfaces as IntegrityError and the lookup is retried
+        return insert(Link).values(**values).returning(Link.id)
+    return upsert(Link).values(**values).on_conflict_do_nothing(
+        index_elements=[Link.url_digest, LINK_OWNER],
+        index_where=Link.deduplicated,
+    ).returning(Link.id)
+
+def taken_on_previous_owner(db: Session, short_code: str) -> bool:
+    # While links are rebalanced (SHARD_PREVIOUS_COUNT) a code may still live on its previous owner,
+    # which the new owner's unique index doesn't cover
+    shards = shard_map.shards_for_code(short_code)
+    if len(shards) < 2:
+        return False
+    return db.scalar(select(Link.id).where(Link.short_code == short_code), bind_arguments=shard_arguments(shards[1])) is not None
+
+def generate_code(db: Session) -> str:
+    short_code = code_generator.next_code()
+    while taken_on_previous_owner(db, short_code):
+        short_code = code_generator.next_code()
+    return short_code
+
+def is_expired(link: Link) -> bool:
+    return bool(link.expires_at and link.expires_at < datetime.utcnow())
+
+def create_deduplicated_link(db: Session, fields: dict, expires_at: datetime, user_id: Optional[int]):
+    # Repeat shortens cost one indexed lookup. A miss inserts with ON CONFLICT DO NOTHING, so when a
+    # concurrent request wins the race no row comes back and the next lookup returns the winner's link.
+    for _ in range(SHORT_CODE_MAX_ATTEMPTS):
+        existing = db.scalars(deduplicated_query(fields["url_digest"], user_id)).first()
+        if existing and not is_expired(existing):
+            return existing
+        if existing:
+            # Not swept yet, but it would block the insert: drop it the way the sweeper would
+            db.delete(existing)
+            db.commit()
+            remember_missing(existing.short_code)
+        values = dict(fields, short_code=generate_code(db), expires_at=expires_at, user_id=user_id, deduplicated=True)
+        # With shards the duplicate check only holds within the code's shard; the lookup above still spans them all
+        shard = shard_map.shard_for_code(values["short_code"])
+        bind_arguments = shard_arguments(shard)
+        try:
+            statement = deduplicated_insert(db.get_bind(**bind_arguments).dialect.name, values)
+            link_id = db.execute(statement, bind_arguments=bind_arguments).scalar()
+            db.commit()
+        except IntegrityError:
+            # Short code clash (or a lost race without ON CONFLICT): retry with a fresh code
+            db.rollback()
+            continue
+        if link_id is not None:
+            remember_code(values["short_code"])
+            return db.get(Link, link_id, identity_token=shard)
+    raise RuntimeError("Could not allocate a unique short code")
+
 def create_link(db: Session, original_url: str, short_code: Optional[str] = None, expires_at: Optional[datetime] = None, user_id: Optional[int] = None):
-    if not short_code:
-        short_code = generate_short_code()
-    else:
+    custom_alias = bool(short_code)
+    if custom_alias:
         existing_link = db.query(Link).filter(Link.short_code == short_code).first()
         if existing_link:
             raise ValueError("Short code already exists")
 
+    deduplicate = deduplicates(short_code, expires_at)
     if not expires_at:
         expires_at = datetime.utcnow() + timedelta(days=DEFAULT_LINK_EXPIRY_DAYS)
 
-    original_url = normalize_url(original_url)
-    link = Link(
-        original_url=original_url,
-        short_code=short_code,
-        expires_at=expires_at,
-        user_id=user_id
+    fields = url_fields(original_url)
+    if deduplicate:
+        return create_deduplicated_link(db, fields, expires_at, user_id)
+    # Generated codes are inserted without a uniqueness SELECT; a clash with an existing
+    # (e.g. custom) code is caught by the unique index and retried with a fresh code.
+    for _ in range(SHORT_CODE_MAX_ATTEMPTS):
+        link = Link(
+            **fields,
+            short_code=short_code if custom_alias else generate_code(db),
+            expires_at=expires_at,
+            user_id=user_id
+        )
+        db.add(link)
+        try:
+            db.commit()
+        except IntegrityError:
+            db.rollback()
+            if custom_alias:
+                raise ValueError("Short code already exists")
+            continue
+        remember_code(link.short_code)
+        db.refresh(link)
+        return link
+    raise RuntimeError("Could not allocate a unique short code")
+
+def create_links_bulk(db: Session, items: list, user_id: Optional[int] = None):
+    # items: dicts with original_url and optional short_code/expires_at.
+    # Returns one result dict per item, in order, with either the created link fields or an "error".
+    results = [None] * len(items)
+    aliases = [item["short_code"] for item in items if item.get("short_code")]
+    taken = set(db.scalars(select(Link.short_code).where(Link.short_code.in_(aliases)))) if aliases else set()
+    default_expiry = datetime.utcnow() + timedelta(days=DEFAULT_LINK_EXPIRY_DAYS)
+
+    pending = []
+    for index, item in enumerate(items):
+        alias = item.get("short_code")
+        if alias:
+            if alias in taken:
+                results[index] = {"error": "Short code already exists"}
+                continue
+            taken.add(alias)
+        pending.append((index, {
+            **url_fields(item["original_url"]),
+            "short_code": alias,
+            "expires_at": item.get("expires_at") or default_expiry,
+            "user_id": user_id,
+        }))
+    if not pending:
+        return results
+
+    statement = insert(Link.__table__).returning(
+        Link.__table__.c.id,
+        Link.__table__.c.short_code,
+        Link.__table__.c.original_url,
+        Link.__table__.c.expires_at,
+        sort_by_parameter_order=True,
     )
-    db.add(link)
-    db.commit()
-    db.refresh(link)
-    return link
+    for _ in range(SHORT_CODE_MAX_ATTEMPTS):
+        params = [
+            dict(row, short_code=row["short_code"] or generate_code(db))
+            for _, row in pending
+        ]
+        inserted = [None] * len(params)
+        try:
+            # One multi-row INSERT per shard (a single one without sharding), committed together
+            shards = shard_map.group_by_shard(range(len(params)), lambda position: params[position]["short_code"])
+            for shard, positions in shards.items():
+                rows = db.execute(statement, [params[position] for position in positions], bind_arguments=shard_arguments(shard))
+                for position, row in zip(positions, rows.all()):
+                    inserted[position] = row
+            db.commit()
+            break
+        except IntegrityError:
+            # An alias taken concurrently fails only its own item; otherwise a generated code
+            # clashed and the batch is retried with fresh codes
+            db.rollback()
+            aliases = [row["short_code"] for _, row in pending if row["short_code"]]
+            taken = set(db.scalars(select(Link.short_code).where(Link.short_code.in_(aliases)))) if aliases else set()
+            for index, row in pending:
+                if row["short_code"] in taken:
+                    results[index] = {"error": "Short code already exists"}
+            pending = [(index, row) for index, row in pending if row["short_code"] not in taken]
+            if not pending:
+                return results
+    else:
+        for index, _ in pending:
+            results[index] = {"error": "Could not allocate a unique short code"}
+        return results
+
+    for (index, _), row in zip(pending, inserted):
+        results[index] = dict(row._mapping)
+        remember_code(row.short_code)
+    return results
 
-def get_link(db: Session, short_code: str):
+def get_link(db: Session, short_code: str, count_click: bool = True):
     link = db.query(Link).filter(Link.short_code == short_code).first()
     if link and link.expires_at and link.expires_at < datetime.utcnow():
-        db.delete(link)
-        db.commit()
+        # Expired rows are removed by the background sweeper, the read path never writes
         return None
-    if link:
+    if link and count_click:
         link.clicks += 1
         link.last_used = datetime.utcnow()
         db.commit()
@@ -49,10 +220,13 @@ def get_link(db: Session, short_code: str):
     return link
 
 def delete_link(db: Session, short_code: str):
-    link = db.query(Link).filter(Link.short_code == short_code).first()
-    if link:
-        db.delete(link)
+    # Mid-rebalance the link may exist on both its previous and its new shard; every copy goes
+    links = db.query(Link).filter(Link.short_code == short_code).all()
+    if links:
+        for link in links:
+            db.delete(link)
         db.commit()
+        remember_missing(short_code)
         return True
     return False
 
@@ -60,9 +234,11 @@ def update_link(db: Session, short_code: str, original_url: Optional[str] = None
     link = db.query(Link).filter(Link.short_code == short_code).first()
     if link:
         if original_url:
-            link.original_url = normalize_url(original_url)
+            for column, value in url_fields(original_url).items():
+                setattr(link, column, value)
         if expires_at:
             link.expires_at = expires_at
+        link.version += 1
         db.commit()
         db.refresh(link)
         return link
@@ -71,16 +247,79 @@ def update_link(db: Session, short_code: str, original_url: Optional[str] = None
 def get_stats(db: Session, short_code: str):
     link = db.query(Link).filter(Link.short_code == short_code).first()
     if link:
+        pending_delta, pending_last_used = pending_clicks(short_code)
         return {
             "original_url": link.original_url,
             "short_code": link.short_code,
-            "clicks": link.clicks,
+            "clicks": link.clicks + pending_delta,
             "created_at": link.created_at,
             "expires_at": link.expires_at,
-            "last_used": link.last_used
+            "last_used": pending_last_used or link.last_used
         }
     return None
 
 def search_by_url(db: Session, original_url: str):
-    normalized_url = normalize_url(original_url)
-    return db.query(Link).filter(Link.original_url == normalized_url).first()
\ No newline at end of file
+    return db.scalars(search_query(original_url=original_url)).first()
+
+def encode_cursor(link: Link) -> str:
+    raw = f"{link.created_at.isoformat()}|{link.id}".encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+def decode_cursor(cursor: str):
+    try:
+        created_at, link_id = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8").split("|")
+        return datetime.fromisoformat(created_at), int(link_id)
+    except (ValueError, UnicodeError):
+        raise ValueError("Invalid cursor")
+
+def keyset_key(link: Link):
+    return link.created_at, link.id
+
+def keyset_page(query, limit: int, cursor: Optional[str] = None):
+    # Newest first, one extra row to tell whether there is a next page (see split_page)
+    if cursor:
+        query = query.where(tuple_(Link.created_at, Link.id) < decode_cursor(cursor))
+    return query.order_by(Link.created_at.desc(), Link.id.desc()).limit(limit + 1)
+
+def split_page(links: list, limit: int):
+    next_cursor = encode_cursor(links[limit - 1]) if len(links) > limit else None
+    return links[:limit], next_cursor
+
+def escape_like(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+def prefix_netloc(prefix: str) -> Optional[str]:
+    # The host is only known once the prefix reaches the path, "https://exam" may still be any host
+    parsed = urlparse(prefix)
+    return parsed.netloc.lower() if parsed.netloc and parsed.path else None
+
+def search_query(original_url: Optional[str] = None, domain: Optional[str] = None, prefix: Optional[str] = None):
+    query = select(Link)
+    if original_url:
+        # The hash index finds the candidates, comparing the URL itself rules out digest collisions
+        fields = url_fields(original_url)
+        return query.where(Link.url_digest == fields["url_digest"], Link.original_url == fields["original_url"])
+    if domain:
+        return query.where(Link.netloc == (urlparse(domain).netloc or domain).strip().lower())
+    # Backed by the trigram index on Postgres; elsewhere a prefix that names its host is narrowed by the netloc index
+    query = query.where(Link.original_url.like(escape_like(prefix) + "%", escape="\\"))
+    netloc = prefix_netloc(prefix)
+    return query.where(Link.netloc == netloc) if netloc else query
+
+def search_links(db: Session, limit: int, cursor: Optional[str] = None, original_url: Optional[str] = None, domain: Optional[str] = None, prefix: Optional[str] = None, user_id: Optional[int] = None):
+    query = search_query(original_url, domain, prefix)
+    if user_id is not None:
+        query = query.where(Link.user_id == user_id)
+    query = keyset_page(query, limit, cursor)
+    return split_page(fan_out(db, query, keyset_key), limit)
+
+def list_user_links(db: Session, user_id: int, limit: int, cursor: Optional[str] = None, expired: Optional[bool] = None, min_clicks: Optional[int] = None):
+    # Keyset pagination over the (user_id, created_at, id) index, newest first: every page is an
+    # index range scan from the cursor, so its cost doesn't grow with the page number or the user's link count
+    query = select(Link).where(Link.user_id == user_id)
+    if expired is not None:
+        now = datetime.utcnow()
+        query = query.where(Link.expires_at < now if expired else or_(Link.expires_at.is_(None), Link.expires_at >= now))
+    if min_clicks:
+        query = query.where(Link.clicks >= min_clicks)
+    return split_page(fan_out(db, keyset_page(query, limit, cursor), keyset_key), limit)
@@ -0,0 +1,126 @@
+import bisect
+import hashlib
+from collections import defaultdict
+from sqlalchemy.sql import operators, visitors
+from sqlalchemy.sql.elements import BinaryExpression, BindParameter
+from app.config import DATABASE_SHARD_URLS, SHARD_PREVIOUS_COUNT, SHARD_VIRTUAL_NODES
+
+# Shard id of DATABASE_URL, which keeps every table except links
+PRIMARY_SHARD = "primary"
+LINKS_TABLE = "links"
+
+
+def ring_point(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """Consistent hashing over shard ids: adding a shard only moves the keys the new shard takes over."""
+
+    def __init__(self, nodes, virtual_nodes: int = SHARD_VIRTUAL_NODES):
+        points = sorted((ring_point(f"{node}#{replica}"), node) for node in nodes for replica in range(virtual_nodes))
+        self._points = [point for point, _ in points]
+        self._nodes = [node for _, node in points]
+
+    def owner(self, key: str):
+        index = bisect.bisect(self._points, ring_point(key))
+        return self._nodes[index % len(self._nodes)]
+
+
+def statement_table(statement):
+    table = getattr(statement, "table", None)
+    if table is not None:
+        return table.name
+    froms = statement.get_final_froms() if hasattr(statement, "get_final_froms") else ()
+    names = {getattr(table, "name", None) for table in froms}
+    return LINKS_TABLE if LINKS_TABLE in names else None
+
+
+def short_code_criteria(statement):
+    # Short codes the statement is restricted to (short_code = x / IN (...) under AND), None when unrestricted
+    whereclause = getattr(statement, "whereclause", None)
+    if whereclause is None:
+        return None
+    codes = None
+    for element in visitors.iterate(whereclause):
+        if getattr(element, "operator", None) is operators.or_:
+            return None
+        if not (isinstance(element, BinaryExpression) and isinstance(element.right, BindParameter)):
+            continue
+        if getattr(element.left, "name", None) != "short_code":
+            continue
+        value = element.right.effective_value
+        if element.operator is operators.eq and value is not None:
+            codes = (codes or set()) | {value}
+        elif element.operator is operators.in_op and value is not None:
+            codes = (codes or set()) | set(value)
+    return codes
+
+
+class ShardMap:
+    """Where links live. Every placement decision is a function of the short code alone, so resolving a
+    code needs no directory lookup. Without shards every helper answers None ("the only database")."""
+
+    def __init__(self, shard_ids, previous_count: int = 0):
+        self.shard_ids = list(shard_ids)
+        self.ring = HashRing(self.shard_ids) if self.shard_ids else None
+        # While links are being rebalanced onto new shards, a code may still sit on its previous owner
+        rebalancing = 0 < previous_count < len(self.shard_ids)
+        self.previous_ring = HashRing(self.shard_ids[:previous_count]) if rebalancing else None
+
+    @property
+    def sharded(self) -> bool:
+        return self.ring is not None
+
+    def shard_for_code(self, short_code: str):
+        return self.ring.owner(short_code) if self.ring else None
+
+    def shards_for_code(self, short_code: str) -> list:
+        if not self.ring:
+            return [None]
+        owner = self.ring.owner(short_code)
+        previous = self.previous_ring.owner(short_code) if self.previous_ring else owner
+        return [owner] if previous == owner else [owner, previous]
+
+    def link_shards(self) -> list:
+        return self.shard_ids or [None]
+
+    def group_by_shard(self, items, short_code_of, every_candidate: bool = False) -> dict:
+        # Writes go to the owner; updates by code also reach a previous owner that may still hold the row
+        groups = defaultdict(list)
+        for item in items:
+            code = short_code_of(item)
+            for shard in (self.shards_for_code(code) if every_candidate else [self.shard_for_code(code)]):
+                groups[shard].append(item)
+        return groups
+
+    # Choosers for sqlalchemy.ext.horizontal_shard.ShardedSession
+
+    def choose_shard(self, mapper, instance, clause=None, **kw):
+        if mapper is not None and mapper.local_table.name == LINKS_TABLE and instance is not None:
+            return self.shard_for_code(instance.short_code)
+        return PRIMARY_SHARD
+
+    def choose_identity_shards(self, mapper, primary_key, **kw):
+        # Link ids are only unique per shard
+        return self.shard_ids if mapper.local_table.name == LINKS_TABLE else [PRIMARY_SHARD]
+
+    def choose_execute_shards(self, orm_context):
+        statement = orm_context.statement
+        if statement_table(statement) != LINKS_TABLE:
+            return [PRIMARY_SHARD]
+        codes = short_code_criteria(statement)
+        if not codes:
+            return self.shard_ids
+        shards = []
+        for code in codes:
+            shards += [shard for shard in self.shards_for_code(code) if shard not in shards]
+        return shards
+
+
+def shard_arguments(shard) -> dict:
+    # bind_arguments pinning a statement to one shard; empty (the session's own bind) without sharding
+    return {"shard_id": shard} if shard is not None else {}
+
+
+shard_map = ShardMap([str(index) for index in range(len(DATABASE_SHARD_URLS))], SHARD_PREVIOUS_COUNT)
@@ -0,0 +1,239 @@
+"""Immutable, memory-mapped index of long-lived links for the redirect path: python -m app.snapshot builds it.
+
+Layout, big-endian: a header, one fixed-size record per link sorted by the 8-byte hash of its code, then a blob
+holding each link's code followed by its URL. A lookup is a binary search over the records. Every worker maps the
+same file read-only, so the page cache holds it once per host, and a rebuild replaces it with os.replace.
+"""
+import hashlib
+import logging
+import mmap
+import os
+import shutil
+import struct
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Optional
+from sqlalchemy import or_, select
+from app.cache import EPOCH, LinkEntry, invalidation_listener, redis_client
+from app.config import (
+    SNAPSHOT_CHANGES_KEY,
+    SNAPSHOT_LOCK_KEY,
+    SNAPSHOT_MIN_TTL_SECONDS,
+    SNAPSHOT_PATH,
+    SNAPSHOT_REBUILD_INTERVAL_SECONDS,
+    SNAPSHOT_RELOAD_INTERVAL_SECONDS,
+)
+from app.database import ReadSessionLocal
+from app.metrics import SNAPSHOT_HIT
+from app.models import Link
+from app.tasks import PeriodicTask
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"SLSNAP01"
+# magic, record count, build start (epoch seconds)
+HEADER = struct.Struct(">8sQd")
+# code hash, blob offset, expires_at (epoch seconds, -1 for never), id, version, URL length, code length
+RECORD = struct.Struct(">8sQqqIIH6x")
+NEVER = -1
+EXPORT_BATCH_SIZE = 10000
+# Changes are timestamped by the writing worker, the build start by the building one
+CLOCK_SKEW_SECONDS = 60
+
+
+def code_hash(code: bytes) -> bytes:
+    # Big-endian digest bytes compare like the numbers, so records sort and search as raw bytes
+    return hashlib.blake2b(code, digest_size=8).digest()
+
+
+class SnapshotIndex:
+    def __init__(self, path: str):
+        with open(path, "rb") as file:
+            self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count, self.built_at = HEADER.unpack_from(self._map)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a link snapshot")
+
+    def _hash_at(self, index: int) -> bytes:
+        position = HEADER.size + index * RECORD.size
+        return self._map[position:position + 8]
+
+    def get(self, short_code: str) -> Optional[LinkEntry]:
+        code = short_code.encode("utf-8")
+        key = code_hash(code)
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self._hash_at(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        # Codes sharing a hash sit next to each other
+        for index in range(low, self.count):
+            digest, offset, expires_at, link_id, version, url_length, code_length = RECORD.unpack_from(
+                self._map, HEADER.size + index * RECORD.size
+            )
+            if digest != key:
+                return None
+            if self._map[offset:offset + code_length] == code:
+                original_url = self._map[offset + code_length:offset + code_length + url_length].decode("utf-8")
+                expires = None if expires_at == NEVER else EPOCH + timedelta(seconds=expires_at)
+                return LinkEntry(link_id, original_url, expires, None, version)
+        return None
+
+
+class LinkSnapshot:
+    """The current SnapshotIndex of this worker, minus the codes changed since it was built.
+
+    Writers record every changed code in a Redis sorted set by time, and other workers hear of it over the
+    cache invalidation channel. A worker loading a snapshot (or resubscribing after missing messages) reads
+    the set back from the snapshot's build time on.
+    """
+
+    def __init__(self, path: Optional[str], client):
+        self.path = path
+        self.client = client
+        self._index = None
+        self._file_identity = None
+        self._changed = set()
+        self._pending = None
+        self._lock = threading.Lock()
+
+    def get(self, short_code: str) -> Optional[LinkEntry]:
+        index = self._index
+        if index is None or short_code in self._changed:
+            return None
+        entry = index.get(short_code)
+        if entry is not None:
+            SNAPSHOT_HIT.inc()
+        return entry
+
+    def changed(self, short_code: str):
+        with self._lock:
+            self._changed.add(short_code)
+            if self._pending is not None:
+                self._pending.add(short_code)
+
+    def record_changes(self, short_codes: list, pipe=None):
+        # One ZADD for the batch, on the caller's pipeline when there is one
+        for short_code in short_codes:
+            self.changed(short_code)
+        (pipe or self.client).zadd(SNAPSHOT_CHANGES_KEY, dict.fromkeys(short_codes, time.time()))
+
+    def changes_since(self, built_at: float) -> set:
+        return {code.decode("utf-8") for code in self.client.zrangebyscore(SNAPSHOT_CHANGES_KEY, built_at - CLOCK_SKEW_SECONDS, "+inf")}
+
+    def resync(self):
+        index = self._index
+        if index is not None:
+            changed = self.changes_since(index.built_at)
+            with self._lock:
+                self._changed |= changed
+
+    def reload(self) -> bool:
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return False
+        identity = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if identity == self._file_identity:
+            return False
+        index = SnapshotIndex(self.path)
+        # Changes heard while the set is being read are replayed before the swap
+        with self._lock:
+            self._pending = set()
+        try:
+            changed = self.changes_since(index.built_at)
+        finally:
+            with self._lock:
+                pending, self._pending = self._pending, None
+        with self._lock:
+            # The previous map is closed once the last reader drops it
+            self._index = index
+            self._changed = changed | pending
+            self._file_identity = identity
+        logger.info("Loaded link snapshot with %d links", index.count)
+        return True
+
+
+def export_links(path: str, db=None) -> int:
+    # Streams live links into a scratch blob, then writes header, sorted records and blob, and swaps the file in
+    built_at = time.time()
+    horizon = datetime.utcnow() + timedelta(seconds=SNAPSHOT_MIN_TTL_SECONDS)
+    query = (
+        select(Link.short_code, Link.original_url, Link.expires_at, Link.id, Link.version)
+        .where(or_(Link.expires_at.is_(None), Link.expires_at > horizon))
+        .execution_options(yield_per=EXPORT_BATCH_SIZE)
+    )
+    # Read from the replica: changes it hasn't replayed yet are within CLOCK_SKEW_SECONDS of the build start,
+    # so workers still skip them after loading the result
+    session = db or ReadSessionLocal()
+    records = []
+    blob_path, snapshot_path = f"{path}.blob.tmp", f"{path}.tmp"
+    try:
+        with open(blob_path, "w+b") as blob:
+            offset = 0
+            for row in session.execute(query):
+                code, url = row.short_code.encode("utf-8"), row.original_url.encode("utf-8")
+                expires_at = NEVER if row.expires_at is None else int((row.expires_at - EPOCH).total_seconds())
+                # Offsets are made absolute once the record count is known
+                records.append(RECORD.pack(code_hash(code), offset, expires_at, row.id, row.version, len(url), len(code)))
+                blob.write(code)
+                blob.write(url)
+                offset += len(code) + len(url)
+            records.sort()
+            blob_start = HEADER.size + len(records) * RECORD.size
+            with open(snapshot_path, "wb") as snapshot:
+                snapshot.write(HEADER.pack(MAGIC, len(records), built_at))
+                for record in records:
+                    fields = list(RECORD.unpack(record))
+                    fields[1] += blob_start
+                    snapshot.write(RECORD.pack(*fields))
+                blob.seek(0)
+                shutil.copyfileobj(blob, snapshot)
+                snapshot.flush()
+                os.fsync(snapshot.fileno())
+        os.replace(snapshot_path, path)
+    finally:
+        if db is None:
+            session.close()
+        for scratch in (blob_path, snapshot_path):
+            if os.path.exists(scratch):
+                os.remove(scratch)
+    return len(records)
+
+
+def build_snapshot(path: str = SNAPSHOT_PATH) -> int:
+    built_at = time.time()
+    exported = export_links(path)
+    # Workers still on the previous snapshot keep their own copy of older changes
+    redis_client.zremrangebyscore(SNAPSHOT_CHANGES_KEY, "-inf", built_at - CLOCK_SKEW_SECONDS)
+    return exported
+
+
+def rebuild_snapshot() -> int:
+    # Every worker runs the builder, one per interval does the export
+    if not redis_client.set(SNAPSHOT_LOCK_KEY, uuid.uuid4().hex, nx=True, ex=max(1, int(SNAPSHOT_REBUILD_INTERVAL_SECONDS))):
+        return 0
+    exported = build_snapshot()
+    link_snapshot.reload()
+    return exported
+
+
+link_snapshot = LinkSnapshot(SNAPSHOT_PATH, redis_client)
+snapshot_builder = PeriodicTask("snapshot-builder", SNAPSHOT_REBUILD_INTERVAL_SECONDS, rebuild_snapshot)
+snapshot_reloader = PeriodicTask("snapshot-reloader", SNAPSHOT_RELOAD_INTERVAL_SECONDS, link_snapshot.reload)
+
+if SNAPSHOT_PATH:
+    invalidation_listener.key_callbacks.append(link_snapshot.changed)
+    invalidation_listener.local_callbacks.append(link_snapshot.record_changes)
+    invalidation_listener.resync_callbacks.append(link_snapshot.resync)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    if not SNAPSHOT_PATH:
+        raise SystemExit("SNAPSHOT_PATH is not set")
+    logger.info("Exported %d links to %s", build_snapshot(), SNAPSHOT_PATH)
@@ -0,0 +1,45 @@
+from datetime import datetime
+from sqlalchemy import delete, select
+from app.cache import cache_delete_many
+from app.config import EXPIRY_SWEEP_BATCH_SIZE, EXPIRY_SWEEP_INTERVAL_SECONDS, EXPIRY_SWEEP_MAX_BATCHES
+from app.database import SessionLocal
+from app.models import Link
+from app.sharding import shard_arguments, shard_map
+from app.tasks import PeriodicTask
+
+
+def sweep_shard(session, shard, batch_size: int, max_batches: int) -> int:
+    # Link ids are only unique within a shard, so each batch is selected and deleted on the same one
+    bind_arguments = shard_arguments(shard)
+    deleted = 0
+    for _ in range(max_batches):
+        now = datetime.utcnow()
+        expired = session.execute(
+            select(Link.id, Link.short_code)
+            .where(Link.expires_at < now)
+            .order_by(Link.expires_at)
+            .limit(batch_size),
+            bind_arguments=bind_arguments,
+        ).all()
+        if not expired:
+            break
+        session.execute(delete(Link).where(Link.id.in_([row.id for row in expired])), bind_arguments=bind_arguments)
+        session.commit()
+        cache_delete_many([row.short_code for row in expired])
+        deleted += len(expired)
+        if len(expired) < batch_size:
+            break
+    return deleted
+
+
+def sweep_expired_links(db=None, batch_size: int = EXPIRY_SWEEP_BATCH_SIZE, max_batches: int = EXPIRY_SWEEP_MAX_BATCHES) -> int:
+    # Deletes expired links in short transactions of batch_size rows, walking the expires_at index
+    session = db or SessionLocal()
+    try:
+        return sum(sweep_shard(session, shard, batch_size, max_batches) for shard in shard_map.link_shards())
+    finally:
+        if db is None:
+            session.close()
+
+
+expiry_sweeper = PeriodicTask("expiry-sweeper", EXPIRY_SWEEP_INTERVAL_SECONDS, sweep_expired_links)
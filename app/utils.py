@@ -1,6 +0,0 @@
-import random
-import string
-
-def generate_short_code(length=6):
-    characters = string.ascii_letters + string.digits
-    return ''.join(random.choice(characters) for _ in range(length))
\ No newline at end of file
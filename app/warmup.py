@@ -0,0 +1,61 @@
+import logging
+import threading
+import uuid
+from datetime import datetime
+from sqlalchemy import or_, select
+from app.cache import LinkEntry, cache_warm, redis_client
+from app.config import WARMUP_LINKS, WARMUP_LOCK_KEY, WARMUP_LOCK_SECONDS, WARMUP_RETRY_INTERVAL_SECONDS
+from app.database import SessionLocal, engine, replica_engine, shard_engines
+from app.models import Link
+from app.tasks import PeriodicTask
+
+logger = logging.getLogger(__name__)
+
+ready = threading.Event()
+
+
+def prime_pool(pool_engine):
+    # Open the pool's steady-state connections now rather than on the first requests
+    size = getattr(pool_engine.pool, "size", None)
+    connections = []
+    try:
+        for _ in range(size() if callable(size) else 1):
+            connections.append(pool_engine.connect())
+    finally:
+        for connection in connections:
+            connection.close()
+
+
+def preload_links(db=None) -> int:
+    # Every worker warms up, but only the first one per WARMUP_LOCK_SECONDS scans for hot links
+    if WARMUP_LINKS <= 0 or not redis_client.set(WARMUP_LOCK_KEY, uuid.uuid4().hex, nx=True, ex=WARMUP_LOCK_SECONDS):
+        return 0
+    session = db or SessionLocal()
+    try:
+        links = session.scalars(
+            select(Link)
+            .where(or_(Link.expires_at.is_(None), Link.expires_at > datetime.utcnow()))
+            .order_by(Link.clicks.desc())
+            .limit(WARMUP_LINKS)
+        ).all()
+        # With shards every shard contributes its own top WARMUP_LINKS
+        links = sorted(links, key=lambda link: link.clicks, reverse=True)[:WARMUP_LINKS]
+        return cache_warm((link.short_code, LinkEntry.from_link(link)) for link in links)
+    finally:
+        if db is None:
+            session.close()
+
+
+def warm_up():
+    if ready.is_set():
+        return
+    redis_client.ping()
+    for pool_engine in (engine, replica_engine, *shard_engines.values()):
+        if pool_engine is not None:
+            prime_pool(pool_engine)
+    logger.info("Warm-up done, %d links preloaded", preload_links())
+    ready.set()
+
+
+# Retried until it succeeds (e.g. the database comes up after the app); a no-op afterwards
+warmer = PeriodicTask("warm-up", WARMUP_RETRY_INTERVAL_SECONDS, warm_up)
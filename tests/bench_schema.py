@@ -0,0 +1,155 @@
+"""Storage and lookup benchmark of the links table layout, the released baseline against the current schema.
+
+    python -m tests.bench_schema --rows 10000000
+
+Builds the same --rows links twice in SQLite files under --dir: once with the layout of the first release, the one
+app.migrate upgrades (btree index on original_url, unbounded short_code, extra index on the primary key), and once
+from the current models. Reports the size of every index (dbstat) and the mean latency of --lookups random lookups
+by short code and by URL, with SQLite's page cache capped at --cache-mb so index size shows up as pages read from
+the OS.
+"""
+import argparse
+import hashlib
+import os
+import random
+import sqlite3
+import time
+from sqlalchemy.dialects import sqlite
+from sqlalchemy.schema import CreateIndex, CreateTable
+from app.codegen import base62_encode
+from app.models import Link
+
+# As created by the first release; mirrors BASELINE_SCHEMA in tests/test_database.py
+LEGACY_SCHEMA = [
+    "CREATE TABLE links (id INTEGER NOT NULL PRIMARY KEY, original_url VARCHAR, short_code VARCHAR, created_at DATETIME, "
+    "expires_at DATETIME, last_used DATETIME, clicks INTEGER, user_id INTEGER)",
+]
+LEGACY_INDEXES = [
+    "CREATE INDEX ix_links_id ON links (id)",
+    "CREATE INDEX ix_links_original_url ON links (original_url)",
+    "CREATE UNIQUE INDEX ix_links_short_code ON links (short_code)",
+]
+CHUNK = 100_000
+
+
+def current_schema():
+    dialect = sqlite.dialect()
+    table = Link.__table__
+    indexes = [str(CreateIndex(index).compile(dialect=dialect)) for index in table.indexes if index.name != "ix_links_original_url_trgm"]
+    return [str(CreateTable(table).compile(dialect=dialect))], indexes
+
+
+def link_rows(rows, legacy, seed=1):
+    rng = random.Random(seed)
+    created_at = "2025-01-01 00:00:00.000000"
+    for link_id in range(1, rows + 1):
+        netloc = f"site{rng.randrange(50_000)}.com"
+        url = f"https://{netloc}/articles/{rng.randrange(10**9)}/{link_id}"
+        digest = hashlib.sha256(url.encode("utf-8")).digest()
+        # An affine permutation of the ids, as the block generator hands them out
+        code = base62_encode((link_id * 3_521_614_606_207 + 42) % 62 ** 7, 7)
+        user_id = rng.randrange(1, 100_000) if rng.random() < 0.5 else None
+        expires_at = "2026-01-01 00:00:00.000000"
+        if legacy:
+            yield (link_id, url, code, created_at, expires_at, None, 0, user_id)
+        else:
+            yield (link_id, url, digest, netloc, 1, code, created_at, expires_at, None, 0, user_id, 0)
+
+
+def build(path, rows, legacy):
+    if os.path.exists(path):
+        os.remove(path)
+    tables, indexes = (LEGACY_SCHEMA, LEGACY_INDEXES) if legacy else current_schema()
+    connection = sqlite3.connect(path)
+    connection.execute("PRAGMA journal_mode = OFF")
+    connection.execute("PRAGMA synchronous = OFF")
+    connection.execute("PRAGMA cache_size = -1000000")
+    for statement in tables:
+        connection.execute(statement)
+    insert = "INSERT INTO links VALUES (" + ", ".join("?" * (8 if legacy else 12)) + ")"
+    batch = []
+    for row in link_rows(rows, legacy):
+        batch.append(row)
+        if len(batch) == CHUNK:
+            connection.executemany(insert, batch)
+            batch.clear()
+    connection.executemany(insert, batch)
+    connection.commit()
+    # Indexes built after the load sort once instead of splitting pages on every insert
+    for statement in indexes:
+        connection.execute(statement)
+    connection.commit()
+    connection.execute("VACUUM")
+    connection.close()
+
+
+def sizes(path):
+    connection = sqlite3.connect(path)
+    result = dict(connection.execute("SELECT name, SUM(pgsize) FROM dbstat GROUP BY name"))
+    connection.close()
+    return result
+
+
+def lookups(path, rows, legacy, count, cache_mb):
+    rng = random.Random(2)
+    sample = [row for row in link_rows(rows, legacy) if rng.random() < count / rows][:count]
+    rng.shuffle(sample)
+    connection = sqlite3.connect(path)
+    connection.execute(f"PRAGMA cache_size = -{cache_mb * 1024}")
+    if legacy:
+        # What the first release ran: the redirect read the row by code, search compared original_url
+        by_code = "SELECT id, original_url, expires_at FROM links WHERE short_code = ?"
+        by_url = "SELECT id, short_code FROM links WHERE original_url = ?"
+        code_arguments = [(row[2],) for row in sample]
+        url_arguments = [(row[1],) for row in sample]
+    else:
+        by_code = "SELECT id, original_url, expires_at, version FROM links WHERE short_code = ?"
+        by_url = "SELECT id, short_code FROM links WHERE url_digest = ? AND original_url = ?"
+        code_arguments = [(row[5],) for row in sample]
+        url_arguments = [(row[2], row[1]) for row in sample]
+    timings = {}
+    for name, query, arguments in (("short_code", by_code, code_arguments), ("url", by_url, url_arguments)):
+        start = time.perf_counter()
+        for argument in arguments:
+            assert connection.execute(query, argument).fetchone() is not None
+        timings[name] = (time.perf_counter() - start) / len(arguments) * 1e6
+    connection.close()
+    return timings
+
+
+def mb(size):
+    return f"{size / 2**20:,.1f}"
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=10_000_000)
+    parser.add_argument("--lookups", type=int, default=100_000)
+    parser.add_argument("--cache-mb", type=int, default=64)
+    parser.add_argument("--dir", default=".")
+    args = parser.parse_args()
+    results = {}
+    for layout, legacy in (("before", True), ("after", False)):
+        path = os.path.join(args.dir, f"bench_schema_{layout}.db")
+        build(path, args.rows, legacy)
+        results[layout] = sizes(path), lookups(path, args.rows, legacy, args.lookups, args.cache_mb), os.path.getsize(path)
+        os.remove(path)
+
+    (before_sizes, before_times, before_file), (after_sizes, after_times, after_file) = results["before"], results["after"]
+    print("| object | before, MB | after, MB |")
+    print("|--------|-----------:|----------:|")
+    for name in sorted(before_sizes.keys() | after_sizes.keys()):
+        print(f"| {name} | {mb(before_sizes.get(name, 0)) if name in before_sizes else '-'} | {mb(after_sizes[name]) if name in after_sizes else '-'} |")
+    before_indexes = sum(size for name, size in before_sizes.items() if name != "links")
+    after_indexes = sum(size for name, size in after_sizes.items() if name != "links")
+    print(f"| **all indexes** | {mb(before_indexes)} | {mb(after_indexes)} |")
+    print(f"| **database file** | {mb(before_file)} | {mb(after_file)} |")
+    print()
+    print("| lookup | before, µs | after, µs |")
+    print("|--------|-----------:|----------:|")
+    for name in before_times:
+        print(f"| {name} | {before_times[name]:.1f} | {after_times[name]:.1f} |")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+"""Запись и сравнение результатов бенчмарков в формате results/benchmarks/*.json.
+
+    python -m tests.benchmarks.results micro bench.json results/benchmarks/v2.json
+    python -m tests.benchmarks.results load results/locust/mixed mixed results/benchmarks/v2.json
+    python -m tests.benchmarks.results compare results/benchmarks/baseline.json results/benchmarks/v2.json
+
+Формат файла:
+    {
+      "version": "...", "recorded_at": "...", "environment": {...},
+      "micro": {"<test>": {"p50_us": float, "p99_us": float, "ops": float}},
+      "load":  {"<scenario>": {"<endpoint>": {"p50_ms": float, "p99_ms": float, "rps": float, "failures": int}}}
+    }
+"""
+import argparse
+import csv
+import json
+import os
+import platform
+import subprocess
+import sys
+from datetime import datetime
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def as_float(value):
+    return float(value) if value not in ("", "N/A") else None
+
+
+def load_results(path):
+    if os.path.exists(path):
+        with open(path) as results_file:
+            return json.load(results_file)
+    try:
+        version = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        version = "unknown"
+    return {
+        "version": version,
+        "recorded_at": datetime.utcnow().replace(microsecond=0).isoformat() + "Z",
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+        },
+        "micro": {},
+        "load": {},
+    }
+
+
+def save_results(path, results):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w") as results_file:
+        json.dump(results, results_file, indent=2, sort_keys=True)
+        results_file.write("\n")
+
+
+def record_micro(benchmark_json, output):
+    results = load_results(output)
+    with open(benchmark_json) as benchmark_file:
+        report = json.load(benchmark_file)
+    for bench in report["benchmarks"]:
+        stats = bench["stats"]
+        # Raw timings are only present with --benchmark-save-data; fall back to the slowest round
+        samples = stats.get("data")
+        results["micro"][bench["name"]] = {
+            "p50_us": round(stats["median"] * 1e6, 3),
+            "p99_us": round((percentile(samples, 0.99) if samples else stats["max"]) * 1e6, 3),
+            "ops": round(stats["ops"], 1),
+        }
+    save_results(output, results)
+
+
+def record_load(csv_prefix, scenario, output):
+    results = load_results(output)
+    endpoints = {}
+    with open(f"{csv_prefix}_stats.csv") as stats_file:
+        for row in csv.DictReader(stats_file):
+            name = row["Name"] if row["Type"] else "Aggregated"
+            endpoints[f"{row['Type']} {name}".strip()] = {
+                "p50_ms": as_float(row["50%"]),
+                "p99_ms": as_float(row["99%"]),
+                "rps": as_float(row["Requests/s"]),
+                "failures": int(row["Failure Count"]),
+            }
+    results["load"][scenario] = endpoints
+    save_results(output, results)
+
+
+def compare(baseline_path, candidate_path, threshold):
+    with open(baseline_path) as baseline_file, open(candidate_path) as candidate_file:
+        baseline, candidate = json.load(baseline_file), json.load(candidate_file)
+    # (section, metric, higher_is_better)
+    checks = [("micro", "p50_us", False), ("micro", "p99_us", False), ("micro", "ops", True)]
+    rows = []
+    for name, metrics in candidate.get("micro", {}).items():
+        rows.append((f"micro {name}", baseline.get("micro", {}).get(name), metrics, checks))
+    for scenario, endpoints in candidate.get("load", {}).items():
+        for endpoint, metrics in endpoints.items():
+            previous = baseline.get("load", {}).get(scenario, {}).get(endpoint)
+            rows.append((f"load {scenario} {endpoint}", previous, metrics,
+                         [("load", "p50_ms", False), ("load", "p99_ms", False), ("load", "rps", True)]))
+    regressions = 0
+    print(f"{'benchmark':<60} {'metric':<8} {'baseline':>12} {'candidate':>12} {'change':>8}")
+    for name, previous, metrics, metric_checks in rows:
+        if not previous:
+            continue
+        for _, metric, higher_is_better in metric_checks:
+            old, new = previous.get(metric), metrics.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            regressed = change < -threshold if higher_is_better else change > threshold
+            regressions += regressed
+            marker = "  REGRESSION" if regressed else ""
+            print(f"{name:<60} {metric:<8} {old:>12.2f} {new:>12.2f} {change:>+8.1%}{marker}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    commands = parser.add_subparsers(dest="command", required=True)
+    micro = commands.add_parser("micro")
+    micro.add_argument("benchmark_json")
+    micro.add_argument("output")
+    load = commands.add_parser("load")
+    load.add_argument("csv_prefix")
+    load.add_argument("scenario")
+    load.add_argument("output")
+    diff = commands.add_parser("compare")
+    diff.add_argument("baseline")
+    diff.add_argument("candidate")
+    diff.add_argument("--threshold", type=float, default=0.10)
+    args = parser.parse_args()
+    if args.command == "micro":
+        record_micro(args.benchmark_json, args.output)
+    elif args.command == "load":
+        record_load(args.csv_prefix, args.scenario, args.output)
+    else:
+        sys.exit(1 if compare(args.baseline, args.candidate, args.threshold) else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -5,10 +5,10 @@ from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.pool import StaticPool
 from app.main import app
-from app.database import Base, get_db
+from app.database import Base, get_db, get_read_db
 from app.models import User
 from app.auth import hash_password
-from app import auth
+from app import analytics, auth, cache, clicks, membership, ratelimit, sweeper
 
 
 os.environ["SECRET_KEY"] = "SECRET_KEY"
@@ -22,11 +22,23 @@ engine = create_engine(
 
 TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 auth.SessionLocal = TestingSessionLocal
+clicks.SessionLocal = TestingSessionLocal
+analytics.SessionLocal = TestingSessionLocal
+sweeper.SessionLocal = TestingSessionLocal
+membership.SessionLocal = TestingSessionLocal
 
 @pytest.fixture(scope="function")
 def db_session():
     Base.metadata.drop_all(bind=engine)
     Base.metadata.create_all(bind=engine)
+    clicks.click_buffer.clear()
+    analytics.event_log.clear()
+    cache.local_cache.clear()
+    auth.user_cache.clear()
+    membership.code_filter.reset()
+    membership.negative_cache.clear()
+    for limit in (ratelimit.shorten_rate_limit, ratelimit.bulk_rate_limit, ratelimit.register_rate_limit, ratelimit.login_rate_limit):
+        limit.limiter.clear()
     db = TestingSessionLocal()
     try:
         yield db
@@ -41,10 +53,22 @@ def client(db_session, mocker):
         yield db_session 
 
     app.dependency_overrides[get_db] = override_get_db
+    app.dependency_overrides[get_read_db] = override_get_db
     # Мокаем Redis-клиент
     mocker.patch('app.cache.redis_client.get', return_value=None)
     mocker.patch('app.cache.redis_client.setex', return_value=None)
     mocker.patch('app.cache.redis_client.delete', return_value=None)
+    mocker.patch('app.cache.redis_client.publish', return_value=0)
+    mocker.patch('app.cache.redis_client.pipeline').return_value.execute.return_value = [None, -2]
+    mocker.patch('app.cache.redis_client.set', return_value=True)
+    mocker.patch('app.cache.release_lock_script')
+    mocker.patch('app.cache.store_if_newer_script')
+    # Rate limits grant every batch of tokens asked for
+    mocker.patch('app.ratelimit.async_take_tokens_script', new=mocker.AsyncMock(side_effect=lambda keys, args: [args[2], 0]))
+    mocker.patch('app.cache.invalidation_listener.start')
+    mocker.patch('app.warmup.warmer.start')
+    # The code filter stays unbuilt in endpoint tests, so every lookup reaches the (mocked) cache and DB
+    mocker.patch('app.membership.code_filter_rebuilder.trigger')
 
     with TestClient(app, raise_server_exceptions=False) as test_client:
         yield test_client
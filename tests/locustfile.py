@@ -1,109 +1,192 @@
-from locust import HttpUser, task, between, constant, tag
+"""Сценарии нагрузки для сервиса коротких ссылок.
+
+    locust -f tests/locustfile.py RedirectHeavyUser --headless -u 200 -r 20 -t 2m --csv results/locust/redirect
+    locust -f tests/locustfile.py CreateHeavyUser --headless -u 50 -r 10 -t 2m --csv results/locust/create
+    locust -f tests/locustfile.py MixedUser --headless -u 100 -r 10 -t 2m --csv results/locust/mixed
+
+Популярность коротких кодов распределена по Zipf (ZIPF_EXPONENT), как у реального
+трафика: небольшое число ссылок получает большую часть переходов. CSV-отчёты Locust
+переводятся в формат results/benchmarks командой `python -m tests.benchmarks.results`.
+"""
+import bisect
+import itertools
+import os
 import random
-import logging
+import threading
+from locust import HttpUser, between, task, tag
 from faker import Faker
 
+ZIPF_EXPONENT = float(os.getenv("ZIPF_EXPONENT", "1.1"))
+MAX_TRACKED_CODES = int(os.getenv("MAX_TRACKED_CODES", "10000"))
+SEED_LINKS_PER_USER = int(os.getenv("SEED_LINKS_PER_USER", "20"))
+
+
+class ZipfCodePool:
+    """Коды, общие для всех виртуальных пользователей; ранг 1 — самый популярный."""
+
+    def __init__(self, exponent: float, max_size: int):
+        self.exponent = exponent
+        self.max_size = max_size
+        self.codes = []
+        self._cumulative = []
+        self._lock = threading.Lock()
+
+    def add(self, code: str):
+        with self._lock:
+            if len(self.codes) < self.max_size:
+                self.codes.append(code)
+                self._cumulative = []
+
+    def discard(self, code: str):
+        with self._lock:
+            if code in self.codes:
+                self.codes.remove(code)
+                self._cumulative = []
+
+    def pick(self):
+        with self._lock:
+            if not self.codes:
+                return None
+            if len(self._cumulative) != len(self.codes):
+                weights = (1 / rank ** self.exponent for rank in range(1, len(self.codes) + 1))
+                self._cumulative = list(itertools.accumulate(weights))
+            point = random.random() * self._cumulative[-1]
+            return self.codes[bisect.bisect_left(self._cumulative, point)]
+
+
+code_pool = ZipfCodePool(ZIPF_EXPONENT, MAX_TRACKED_CODES)
+
+
 class ShortLinkUser(HttpUser):
-    # Можно использовать разные варианты wait_time в зависимости от теста
-    wait_time = between(1, 5)  # или constant(3) для фиксированного интервала
-    
+    abstract = True
+    wait_time = between(0.1, 0.5)
     host = "http://127.0.0.1:8000"
-    
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self.fake = Faker()  # Генератор случайных данных
-        self.short_codes = []  # Для хранения созданных коротких ссылок
-        self.username = f"user{random.randint(1, 10000)}"
-        self.password = self.fake.password()
 
     def on_start(self):
-        """Регистрация и аутентификация пользователя"""
-        try:
-            # Регистрация
-            resp = self.client.post("/register", 
-                                  json={
-                                      "username": self.username,
-                                      "password": self.password
-                                  })
-            resp.raise_for_status()
-            
-            # Получение токена
-            resp = self.client.post("/token", 
-                                   data={
-                                       "username": self.username,
-                                       "password": self.password
-                                   })
-            resp.raise_for_status()
-            self.token = resp.json()["access_token"]
-            self.headers = {"Authorization": f"Bearer {self.token}"}
-            
-            # Создаем несколько ссылок при старте
-            for _ in range(3):
-                self._create_short_link()
-                
-        except Exception as e:
-            logging.error(f"Error during startup: {e}")
-            self.environment.runner.quit()
-
-    def _create_short_link(self):
-        """Создание короткой ссылки"""
-        original_url = self.fake.uri()
-        data = {"original_url": original_url}
-        
-        resp = self.client.post("/links", 
-                               json=data,
-                               headers=self.headers)
-        if resp.status_code == 200:
-            short_code = resp.json().get("short_code")
-            if short_code:
-                self.short_codes.append(short_code)
-        return resp
-
-    @task(3)  # Более высокая частота выполнения
-    @tag("get_link")
-    def get_link(self):
-        """Получение существующей ссылки"""
-        if self.short_codes:
-            short_code = random.choice(self.short_codes)
-            with self.client.get(f"/links/{short_code}", 
-                                headers=self.headers,
-                                catch_response=True) as response:
-                if response.status_code == 404:
-                    response.failure("Link not found")
-                elif response.elapsed.total_seconds() > 1.0:
-                    response.failure("Response too slow")
+        """Регистрация, получение токена и начальный набор ссылок"""
+        self.fake = Faker()
+        self.own_codes = []
+        username = f"user{random.getrandbits(48)}"
+        password = self.fake.password()
+        self.client.post("/register", json={"username": username, "password": password}, name="/register")
+        response = self.client.post("/token", data={"username": username, "password": password}, name="/token")
+        self.headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+        for _ in range(SEED_LINKS_PER_USER):
+            self.shorten()
+
+    def shorten(self):
+        with self.client.post(
+            "/links/shorten",
+            json={"original_url": self.fake.uri()},
+            headers=self.headers,
+            name="/links/shorten",
+            catch_response=True,
+        ) as response:
+            if response.status_code != 200:
+                response.failure(f"Failed to create link: {response.status_code}")
+                return
+            short_code = response.json()["short_code"]
+            self.own_codes.append(short_code)
+            code_pool.add(short_code)
+
+    def redirect(self):
+        short_code = code_pool.pick()
+        if short_code:
+            with self.client.get(
+                f"/links/{short_code}",
+                name="/links/[short_code]",
+                allow_redirects=False,
+                catch_response=True,
+            ) as response:
+                # Удалённые другими пользователями коды допустимы
+                if response.status_code not in (200, 301, 302, 307, 404):
+                    response.failure(f"Unexpected status {response.status_code}")
+
+    def stats(self):
+        short_code = code_pool.pick()
+        if short_code:
+            with self.client.get(f"/links/{short_code}/stats", name="/links/[short_code]/stats", catch_response=True) as response:
+                if response.status_code not in (200, 404):
+                    response.failure(f"Unexpected status {response.status_code}")
+
+    def search(self):
+        self.client.get("/links/search", params={"original_url": self.fake.uri()}, headers=self.headers, name="/links/search")
+
+    def list_links(self):
+        """Первая страница своих ссылок и, если есть, следующая по курсору"""
+        response = self.client.get("/links", params={"limit": 20}, headers=self.headers, name="/links")
+        if response.status_code == 200 and response.json()["next_cursor"]:
+            self.client.get(
+                "/links",
+                params={"limit": 20, "cursor": response.json()["next_cursor"]},
+                headers=self.headers,
+                name="/links (cursor)",
+            )
+
+    def delete(self):
+        if self.own_codes:
+            short_code = self.own_codes.pop(0)
+            code_pool.discard(short_code)
+            self.client.delete(f"/links/{short_code}", headers=self.headers, name="/links/[short_code] (DELETE)")
+
+
+class RedirectHeavyUser(ShortLinkUser):
+    """Почти только переходы по популярным ссылкам"""
+
+    @task(95)
+    @tag("redirect")
+    def redirect_task(self):
+        self.redirect()
+
+    @task(5)
+    @tag("stats")
+    def stats_task(self):
+        self.stats()
+
+
+class CreateHeavyUser(ShortLinkUser):
+    """Массовое создание ссылок"""
+
+    @task(8)
+    @tag("create")
+    def create_task(self):
+        self.shorten()
 
     @task(2)
-    @tag("create_link")
-    def create_link(self):
-        """Создание новой короткой ссылки"""
-        response = self._create_short_link()
-        if response.status_code != 200:
-            response.failure(f"Failed to create link: {response.text}")
-
-    @task(1)
+    @tag("redirect")
+    def redirect_task(self):
+        self.redirect()
+
+
+class MixedUser(ShortLinkUser):
+    """Смешанная нагрузка"""
+
+    @task(67)
+    @tag("redirect")
+    def redirect_task(self):
+        self.redirect()
+
+    @task(3)
+    @tag("list")
+    def list_task(self):
+        self.list_links()
+
+    @task(15)
+    @tag("create")
+    def create_task(self):
+        self.shorten()
+
+    @task(8)
     @tag("stats")
-    def get_stats(self):
-        """Получение статистики"""
-        if self.short_codes:
-            short_code = random.choice(self.short_codes)
-            self.client.get(f"/links/{short_code}/stats",
-                          headers=self.headers,
-                          name="/links/[short_code]/stats")
-
-    @task(1)
-    @tag("list_links")
-    def list_links(self):
-        """Получение списка ссылок"""
-        self.client.get("/links",
-                       headers=self.headers)
-
-    @task(1)
-    @tag("delete_link")
-    def delete_link(self):
-        """Удаление ссылки"""
-        if self.short_codes:
-            short_code = self.short_codes.pop()
-            self.client.delete(f"/links/{short_code}",
-                             headers=self.headers,
-                             name="/links/[short_code] (DELETE)")
+    def stats_task(self):
+        self.stats()
+
+    @task(5)
+    @tag("search")
+    def search_task(self):
+        self.search()
+
+    @task(2)
+    @tag("delete")
+    def delete_task(self):
+        self.delete()
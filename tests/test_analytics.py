@@ -0,0 +1,129 @@
+from datetime import datetime, timedelta
+import pytest
+from app.analytics import RedisEventStream, aggregate_events, emit_click, get_timeseries, user_agent_family
+from app.models import ClickRollup
+from app.services import create_link
+
+
+def test_user_agent_family():
+    chrome = "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0 Safari/537.36"
+    edge = chrome + " Edg/120.0"
+    assert user_agent_family(chrome) == "chrome"
+    assert user_agent_family(edge) == "edge"
+    assert user_agent_family("Mozilla/5.0 (Macintosh) AppleWebKit/605.1.15 Version/17.0 Safari/605.1.15") == "safari"
+    assert user_agent_family("Googlebot/2.1") == "bot"
+    assert user_agent_family(None) == "unknown"
+
+
+def test_aggregate_events_upserts_rollups(db_session):
+    for _ in range(3):
+        emit_click("code1", "https://ref.com", "curl/8.0")
+    emit_click("code2")
+    assert aggregate_events(db_session) == 4
+    emit_click("code1")
+    assert aggregate_events(db_session) == 1
+    assert aggregate_events(db_session) == 0
+    rollups = db_session.query(ClickRollup).filter(ClickRollup.short_code == "code1").all()
+    assert {rollup.granularity for rollup in rollups} == {"minute", "hour", "day"}
+    assert all(rollup.clicks == 4 for rollup in rollups)
+
+
+def test_aggregate_events_restores_events_on_failure(db_session, mocker):
+    emit_click("code1")
+    mocker.patch.object(db_session, "execute", side_effect=RuntimeError("db down"))
+    with pytest.raises(RuntimeError):
+        aggregate_events(db_session)
+    mocker.stopall()
+    assert aggregate_events(db_session) == 1
+
+
+class FakeStreamClient:
+    """Just enough of a Redis stream with one consumer group for RedisEventStream."""
+
+    def __init__(self):
+        self.entries = []
+        self.last_delivered = 0
+        self.pending = {}
+
+    def xgroup_create(self, key, group, id, mkstream):
+        pass
+
+    def xadd(self, key, fields, maxlen, approximate):
+        entry_id = len(self.entries) + 1
+        self.entries.append((entry_id, {name.encode(): str(value).encode() for name, value in fields.items()}))
+
+    def xreadgroup(self, group, consumer, streams, count):
+        if streams[self.key(streams)] == ">":
+            entries = [entry for entry in self.entries if entry[0] > self.last_delivered][:count]
+            if entries:
+                self.last_delivered = entries[-1][0]
+        else:
+            entries = [entry for entry in self.entries if self.pending.get(entry[0], (None,))[0] == consumer][:count]
+        for entry_id, _ in entries:
+            self.pending[entry_id] = (consumer, 0)
+        return [[self.key(streams), entries]] if entries else []
+
+    def xautoclaim(self, key, group, consumer, min_idle_time, start_id, count):
+        claimed = [entry for entry in self.entries if entry[0] in self.pending and self.pending[entry[0]][1] >= min_idle_time][:count]
+        for entry_id, _ in claimed:
+            self.pending[entry_id] = (consumer, 0)
+        return [b"0-0", claimed, []]
+
+    def xack(self, key, group, *entry_ids):
+        for entry_id in entry_ids:
+            self.pending.pop(entry_id, None)
+
+    def key(self, streams):
+        return next(iter(streams))
+
+
+def test_redis_stream_rolls_up_pending_events_after_failure(db_session, mocker):
+    client = FakeStreamClient()
+    mocker.patch("app.analytics.event_log", RedisEventStream(client, consumer="web-1"))
+    emit_click("stream1")
+    emit_click("stream1")
+    mocker.patch.object(db_session, "execute", side_effect=RuntimeError("db down"))
+    with pytest.raises(RuntimeError):
+        aggregate_events(db_session)
+    mocker.stopall()
+    assert list(client.pending) == [1, 2]
+
+    # The restarted worker keeps its name and rolls up what it read but never acknowledged
+    mocker.patch("app.analytics.event_log", RedisEventStream(client, consumer="web-1"))
+    emit_click("stream1")
+    assert aggregate_events(db_session, batch_size=10) == 2
+    assert aggregate_events(db_session, batch_size=10) == 1
+    assert client.pending == {}
+    rollup = db_session.query(ClickRollup).filter(ClickRollup.short_code == "stream1", ClickRollup.granularity == "day").one()
+    assert rollup.clicks == 3
+
+
+def test_redis_stream_claims_entries_left_by_another_consumer(db_session, mocker):
+    client = FakeStreamClient()
+    dead_worker = RedisEventStream(client, consumer="web-1")
+    dead_worker.append({"code": "orphan", "ts": 0})
+    dead_worker.read(10)
+    client.pending[1] = ("web-1", 600000)
+    mocker.patch("app.analytics.event_log", RedisEventStream(client, consumer="web-2", claim_idle_seconds=300))
+    assert aggregate_events(db_session) == 1
+    assert client.pending == {}
+
+
+def test_get_timeseries_reads_range(db_session):
+    now = datetime.utcnow().replace(minute=0, second=0, microsecond=0)
+    for hours_ago, clicks in ((0, 5), (1, 2), (30, 9)):
+        db_session.add(ClickRollup(short_code="ts", granularity="hour", bucket_start=now - timedelta(hours=hours_ago), clicks=clicks))
+    db_session.commit()
+    points = get_timeseries(db_session, "ts", "hour", now - timedelta(hours=24), now)
+    assert [point["clicks"] for point in points] == [2, 5]
+
+
+def test_timeseries_endpoint(client, db_session):
+    create_link(db_session, "https://example.com", short_code="series")
+    client.get("/links/series", headers={"User-Agent": "curl/8.0"})
+    client.get("/links/series")
+    aggregate_events(db_session)
+    response = client.get("/links/series/stats/timeseries?granularity=minute")
+    assert response.status_code == 200
+    assert sum(point["clicks"] for point in response.json()["buckets"]) == 2
+    assert client.get("/links/series/stats/timeseries?granularity=week").status_code == 422
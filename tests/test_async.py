@@ -0,0 +1,118 @@
+import asyncio
+from datetime import datetime, timedelta
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.pool import StaticPool
+from app import analytics, async_services, cache, clicks
+from app.database import Base, get_async_read_db, is_async_url, to_sync_url
+from app.models import Link
+from app.routers import links_async
+from app.services import url_fields
+
+
+@pytest.fixture
+def async_session_factory():
+    async_engine = create_async_engine("sqlite+aiosqlite:///:memory:", poolclass=StaticPool)
+
+    async def create_schema():
+        async with async_engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+
+    asyncio.run(create_schema())
+    clicks.click_buffer.clear()
+    cache.local_cache.clear()
+    yield async_sessionmaker(async_engine, class_=AsyncSession, expire_on_commit=False)
+    asyncio.run(async_engine.dispose())
+
+
+async def add_link(db, original_url, short_code, expires_at=None):
+    # Links are created through the sync router; the async services only read them
+    db.add(Link(**url_fields(original_url), short_code=short_code, expires_at=expires_at))
+    await db.commit()
+
+
+def run_with_session(factory, coroutine_function):
+    async def runner():
+        async with factory() as db:
+            return await coroutine_function(db)
+    return asyncio.run(runner())
+
+
+def test_async_url_detection():
+    assert is_async_url("postgresql+asyncpg://user:password@db:5432/dbname")
+    assert not is_async_url("sqlite:///:memory:")
+    assert to_sync_url("postgresql+asyncpg://db/dbname").drivername == "postgresql+psycopg2"
+
+
+def test_async_get_link_counts_click(async_session_factory):
+    async def scenario(db):
+        await add_link(db, "https://example.com/", "async1")
+        link = await async_services.get_link(db, "async1")
+        return link.original_url, link.clicks
+
+    assert run_with_session(async_session_factory, scenario) == ("https://example.com", 1)
+
+
+def test_async_get_expired_link_returns_none(async_session_factory):
+    async def scenario(db):
+        expired = datetime.utcnow() - timedelta(days=1)
+        await add_link(db, "https://example.com", "old", expired)
+        return await async_services.get_link(db, "old")
+
+    assert run_with_session(async_session_factory, scenario) is None
+
+
+def test_async_read_link_route(async_session_factory, mocker):
+    async def seed(db):
+        await add_link(db, "https://example.com", "route")
+
+    run_with_session(async_session_factory, seed)
+
+    async def override_get_async_db():
+        async with async_session_factory() as db:
+            yield db
+
+    mocker.patch("app.cache.async_redis_client.pipeline").return_value.execute = mocker.AsyncMock(return_value=[None, -2])
+    mocker.patch("app.cache.async_redis_client.set", mocker.AsyncMock(return_value=True))
+    mocker.patch("app.cache.async_release_lock_script", mocker.AsyncMock())
+    mocker.patch("app.cache.async_store_if_newer_script", mocker.AsyncMock())
+    mocker.patch("app.cache.async_redis_client.setex", mocker.AsyncMock())
+    mocker.patch("app.cache.async_redis_client.publish", mocker.AsyncMock())
+    app = FastAPI()
+    app.include_router(links_async.router, prefix="/links")
+    app.dependency_overrides[get_async_read_db] = override_get_async_db
+    with TestClient(app) as test_client:
+        response = test_client.get("/links/route")
+        assert response.status_code == 200
+        assert response.json()["original_url"] == "https://example.com"
+        assert test_client.get("/links/missing").status_code == 404
+        assert test_client.get("/links/route/stats").json()["clicks"] == 1
+
+
+def test_async_track_click_uses_async_redis_client(mocker):
+    sync_client = mocker.Mock()
+    async_client = mocker.Mock()
+    async_client.pipeline.return_value.execute = mocker.AsyncMock(return_value=[1, True, 1])
+    async_client.xadd = mocker.AsyncMock()
+    mocker.patch("app.clicks.click_buffer", clicks.RedisClickBuffer(sync_client, async_client))
+    mocker.patch("app.analytics.event_log", analytics.RedisEventStream(sync_client, async_client))
+    asyncio.run(links_async.track_click("tracked", mocker.Mock(headers={"user-agent": "curl/8.0"})))
+    assert sync_client.mock_calls == []
+    async_client.pipeline.return_value.hincrby.assert_called_once_with("clicks:pending", "tracked", 1)
+    assert async_client.xadd.await_args.args[1]["ua"] == "curl"
+
+
+def test_async_get_stats_reads_pending_clicks_with_async_client(async_session_factory, mocker):
+    sync_client = mocker.Mock()
+    async_client = mocker.Mock()
+    async_client.pipeline.return_value.execute = mocker.AsyncMock(return_value=[b"3", None])
+    mocker.patch("app.clicks.click_buffer", clicks.RedisClickBuffer(sync_client, async_client))
+
+    async def scenario(db):
+        await add_link(db, "https://example.com", "pending")
+        return await async_services.get_stats(db, "pending")
+
+    assert run_with_session(async_session_factory, scenario)["clicks"] == 3
+    assert sync_client.mock_calls == []
@@ -1,3 +1,4 @@
+from app import auth
 from app.auth import check_password, hash_password, generate_access_token, fetch_current_user
 from datetime import timedelta
 import pytest
@@ -51,4 +52,33 @@ def test_generate_access_token():
 def test_generate_access_token(db_session, test_user):
     token = generate_access_token({"sub": test_user.username})
     user = fetch_current_user(token=token)
-    assert user.username == "admin"
\ No newline at end of file
+    assert user.username == "admin"
+
+def test_fetch_current_user_uses_cache_for_versioned_tokens(db_session, test_user, mocker):
+    token = auth.generate_user_token(test_user)
+    first = fetch_current_user(token=token)
+    session_factory = mocker.spy(auth, "SessionLocal")
+    second = fetch_current_user(token=token)
+    assert first == second
+    assert first.id == test_user.id
+    assert session_factory.call_count == 0
+
+def test_revoked_token_is_rejected(db_session, test_user, mocker):
+    mocker.patch("app.cache.redis_client.publish")
+    token = auth.generate_user_token(test_user)
+    fetch_current_user(token=token)
+    auth.revoke_tokens(db_session, test_user.id)
+    with pytest.raises(HTTPException) as exc_info:
+        fetch_current_user(token=token)
+    assert exc_info.value.status_code == status.HTTP_401_UNAUTHORIZED
+    db_session.refresh(test_user)
+    assert fetch_current_user(token=auth.generate_user_token(test_user)).id == test_user.id
+
+def test_token_without_version_is_rejected_after_revocation(db_session, test_user, mocker):
+    mocker.patch("app.cache.redis_client.publish")
+    token = generate_access_token({"sub": test_user.username})
+    assert fetch_current_user(token=token).id == test_user.id
+    auth.revoke_tokens(db_session, test_user.id)
+    with pytest.raises(HTTPException) as exc_info:
+        fetch_current_user(token=token)
+    assert exc_info.value.status_code == status.HTTP_401_UNAUTHORIZED
@@ -0,0 +1,198 @@
+import asyncio
+import threading
+import time
+from datetime import datetime, timedelta
+import pytest
+from app import cache
+from app.cache import LinkEntry, LocalCache, cache_get, cache_set, cache_delete
+
+ENTRY = LinkEntry(1, "https://example.com", None, None, 0)
+
+
+@pytest.fixture(autouse=True)
+def clear_local_cache():
+    cache.local_cache.clear()
+    yield
+    cache.local_cache.clear()
+
+
+def test_local_cache_lru_eviction():
+    local = LocalCache(max_size=2, ttl=60)
+    local.set("a", "1")
+    local.set("b", "2")
+    assert local.get("a") == "1"
+    local.set("c", "3")
+    assert local.get("b") is None
+    assert local.get("a") == "1"
+    assert local.get("c") == "3"
+    assert local.stats()["evictions"] == 1
+
+
+def test_local_cache_ttl_expiry():
+    local = LocalCache(max_size=10, ttl=0.01)
+    local.set("a", "1")
+    time.sleep(0.02)
+    assert local.get("a") is None
+    stats = local.stats()
+    assert stats["expirations"] == 1
+    assert stats["misses"] == 1
+
+
+def test_cache_get_serves_hot_keys_from_memory(mocker):
+    pipeline = mocker.patch("app.cache.redis_client.pipeline")
+    pipeline.return_value.execute.return_value = [ENTRY.pack(), 3600000]
+    assert cache_get("hot") == ENTRY
+    assert cache_get("hot") == ENTRY
+    assert pipeline.return_value.execute.call_count == 1
+
+
+def test_cache_set_and_delete_publish_invalidation(mocker):
+    mocker.patch("app.cache.redis_client.setex")
+    mocker.patch("app.cache.redis_client.delete")
+    publish = mocker.patch("app.cache.redis_client.publish")
+    cache_set("code", ENTRY)
+    cache_delete("code")
+    assert publish.call_count == 2
+    assert publish.call_args[0][1] == f"{cache.WORKER_ID}:link:code"
+    assert cache.local_cache.get("code") is None
+
+
+def test_link_entry_round_trip_and_legacy_values():
+    expires_at = datetime.utcnow() + timedelta(days=1)
+    entry = LinkEntry(7, "https://example.com/path", expires_at, 3, 2)
+    unpacked = LinkEntry.unpack(entry.pack())
+    assert unpacked._replace(expires_at=None) == entry._replace(expires_at=None)
+    assert timedelta(0) <= expires_at - unpacked.expires_at < timedelta(seconds=1)
+    assert LinkEntry.unpack(b"https://example.com") is None
+    assert LinkEntry(1, "https://old.com", datetime.utcnow() - timedelta(seconds=1), None, 0).expired()
+
+
+def test_invalidation_from_other_worker_evicts_entry():
+    cache.local_cache.set("code", "https://stale.com")
+    cache.invalidation_listener.handle(f"{cache.WORKER_ID}:link:code".encode())
+    assert cache.local_cache.get("code") == "https://stale.com"
+    cache.invalidation_listener.handle(b"other-worker:link:code")
+    assert cache.local_cache.get("code") is None
+
+
+def test_single_flight_shares_one_call_between_threads():
+    flight = cache.SingleFlight()
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def load():
+        calls.append(1)
+        started.set()
+        release.wait(1)
+        return "value"
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(flight.do("code", load)))
+    leader.start()
+    started.wait(1)
+    followers = [threading.Thread(target=lambda: results.append(flight.do("code", load))) for _ in range(5)]
+    for follower in followers:
+        follower.start()
+    time.sleep(0.05)
+    release.set()
+    for thread in [leader, *followers]:
+        thread.join(1)
+    assert calls == [1]
+    assert results == ["value"] * 6
+
+
+def test_async_single_flight_shares_one_call():
+    flight = cache.AsyncSingleFlight()
+    calls = []
+
+    async def load():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "value"
+
+    async def scenario():
+        return await asyncio.gather(*(flight.do("code", load) for _ in range(5)))
+
+    assert asyncio.run(scenario()) == ["value"] * 5
+    assert calls == [1]
+
+
+def test_cache_fill_loads_and_caches_under_lease(mocker):
+    mocker.patch("app.cache.redis_client.set", return_value=True)
+    store = mocker.patch("app.cache.store_if_newer_script")
+    release = mocker.patch("app.cache.release_lock_script")
+    assert cache.cache_fill("cold", lambda: ENTRY) == ENTRY
+    assert store.call_args.kwargs["keys"] == ["cold", "tombstone:cold"]
+    assert store.call_args.kwargs["args"][:2] == [ENTRY.pack(), ENTRY.version]
+    assert release.call_args.kwargs["keys"] == ["fill-lock:cold"]
+    assert cache.cache_fill("gone", lambda: None) is None
+
+
+def test_delete_during_fill_is_not_undone(mocker):
+    redis_values = {}
+
+    def redis_set(key, value, nx=False, **expiry):
+        if nx and key in redis_values:
+            return None
+        redis_values[key] = value
+        return True
+
+    mocker.patch("app.cache.redis_client.set", side_effect=redis_set)
+    mocker.patch("app.cache.redis_client.delete", side_effect=lambda key: redis_values.pop(key, None))
+    mocker.patch("app.cache.redis_client.publish")
+    mocker.patch("app.cache.release_lock_script", side_effect=lambda keys, args: redis_values.pop(keys[0], None))
+
+    def store_if_newer(keys, args):
+        # Stands in for STORE_IF_NEWER_SCRIPT's tombstone check
+        if redis_values.get(keys[1]) == f"{args[3]}:{args[1]}":
+            return 0
+        redis_values[keys[0]] = args[0]
+        return 1
+
+    mocker.patch("app.cache.store_if_newer_script", side_effect=store_if_newer)
+
+    def load():
+        # The row is read, then deleted and its cache entry dropped before the fill stores it
+        cache_delete("doomed", ENTRY)
+        return ENTRY
+
+    assert cache.cache_fill("doomed", load) == ENTRY
+    assert "doomed" not in redis_values
+    assert redis_values["tombstone:doomed"] == f"{ENTRY.id}:{ENTRY.version}"
+    assert cache.local_cache.get("doomed") is None
+    # A new link under the same code is a different row and is cached as usual
+    assert cache.cache_fill("doomed", lambda: ENTRY._replace(id=ENTRY.id + 1)).id == ENTRY.id + 1
+    assert "doomed" in redis_values
+
+
+def test_cache_fill_waits_for_other_workers_lease(mocker):
+    mocker.patch("app.cache.redis_client.set", return_value=False)
+    mocker.patch("app.cache.redis_client.get", side_effect=[None, ENTRY.pack()])
+    mocker.patch("app.cache.redis_client.exists", return_value=1)
+    load = mocker.Mock()
+    assert cache.cache_fill("cold", load) == ENTRY
+    load.assert_not_called()
+
+
+def test_cache_fill_loads_itself_when_lease_ends_without_value(mocker):
+    mocker.patch("app.cache.redis_client.set", return_value=False)
+    mocker.patch("app.cache.redis_client.get", return_value=None)
+    mocker.patch("app.cache.redis_client.exists", return_value=0)
+    release = mocker.patch("app.cache.release_lock_script")
+    assert cache.cache_fill("missing", lambda: None) is None
+    release.assert_not_called()
+
+
+def test_refresh_early_only_near_expiry(mocker):
+    mocker.patch("app.cache.fill_seconds", 0.01)
+    mocker.patch("app.cache.random.random", return_value=0.99)
+    assert not cache.refresh_early(3600000)
+    assert not cache.refresh_early(-1)
+    assert cache.refresh_early(10)
+
+
+def test_cache_get_reports_early_refresh_as_miss(mocker):
+    pipeline = mocker.patch("app.cache.redis_client.pipeline")
+    pipeline.return_value.execute.return_value = [ENTRY.pack(), 5]
+    mocker.patch("app.cache.refresh_early", return_value=True)
+    assert cache_get("expiring") is None
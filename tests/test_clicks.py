@@ -0,0 +1,48 @@
+from app.clicks import record_click, flush_clicks, pending_clicks
+from app.models import Link
+from app.services import create_link, get_stats
+
+
+def test_record_click_is_buffered(db_session):
+    link = create_link(db_session, "https://example.com", short_code="buffered")
+    record_click("buffered")
+    record_click("buffered")
+    db_session.refresh(link)
+    assert link.clicks == 0
+    delta, last_used = pending_clicks("buffered")
+    assert delta == 2
+    assert last_used is not None
+
+
+def test_flush_clicks_applies_batched_update(db_session):
+    create_link(db_session, "https://one.com", short_code="one")
+    create_link(db_session, "https://two.com", short_code="two")
+    for _ in range(3):
+        record_click("one")
+    record_click("two")
+    assert flush_clicks(db_session) == 2
+    db_session.expire_all()
+    one = db_session.query(Link).filter(Link.short_code == "one").first()
+    two = db_session.query(Link).filter(Link.short_code == "two").first()
+    assert one.clicks == 3
+    assert two.clicks == 1
+    assert one.last_used is not None
+    assert pending_clicks("one") == (0, None)
+    assert flush_clicks(db_session) == 0
+
+
+def test_get_stats_merges_unflushed_clicks(db_session):
+    create_link(db_session, "https://example.com", short_code="merged")
+    record_click("merged")
+    stats = get_stats(db_session, "merged")
+    assert stats["clicks"] == 1
+    assert stats["last_used"] is not None
+
+
+def test_read_link_does_not_write_clicks(client, db_session):
+    link = create_link(db_session, "https://example.com", short_code="hot")
+    for _ in range(3):
+        assert client.get("/links/hot").status_code == 200
+    db_session.refresh(link)
+    assert link.clicks == 0
+    assert client.get("/links/hot/stats").json()["clicks"] == 3
@@ -0,0 +1,78 @@
+import pytest
+from app import services
+from app.codegen import (
+    BlockCodeGenerator,
+    PoolCodeGenerator,
+    RandomCodeGenerator,
+    SnowflakeCodeGenerator,
+    base62_decode,
+    base62_encode,
+    memory_block_allocator,
+)
+from app.services import create_link
+
+
+def test_base62_roundtrip():
+    for number in (0, 1, 61, 62, 3843, 62 ** 6 - 1, 2 ** 63):
+        assert base62_decode(base62_encode(number)) == number
+    assert base62_encode(1, width=6) == "000001"
+
+
+def test_block_generator_is_collision_free_and_fixed_width():
+    generator = BlockCodeGenerator(memory_block_allocator(), length=6, block_size=100)
+    codes = [generator.next_code() for _ in range(10000)]
+    assert len(set(codes)) == len(codes)
+    assert all(len(code) == 6 for code in codes)
+
+
+def test_block_generator_leases_blocks_lazily():
+    leases = []
+    allocate = memory_block_allocator()
+
+    def tracking_allocator(size):
+        leases.append(size)
+        return allocate(size)
+
+    generator = BlockCodeGenerator(tracking_allocator, block_size=10)
+    for _ in range(25):
+        generator.next_code()
+    assert leases == [10, 10, 10]
+
+
+def test_snowflake_ids_are_unique_and_increasing():
+    generator = SnowflakeCodeGenerator(worker_id=7)
+    ids = [generator.next_id() for _ in range(20000)]
+    assert ids == sorted(ids)
+    assert len(set(ids)) == len(ids)
+    assert (ids[0] >> SnowflakeCodeGenerator.SEQUENCE_BITS) & 1023 == 7
+
+
+def test_snowflake_rejects_out_of_range_worker():
+    with pytest.raises(ValueError):
+        SnowflakeCodeGenerator(worker_id=1024)
+
+
+def test_pool_generator_pops_and_falls_back(mocker):
+    client = mocker.Mock()
+    client.lpop.side_effect = [b"pooled", None]
+    source = BlockCodeGenerator(memory_block_allocator(), block_size=10)
+    generator = PoolCodeGenerator(client, source, key="pool", refill_size=4)
+    assert generator.next_code() == "pooled"
+    assert generator.next_code() == source.encode(0)
+    client.llen.return_value = 0
+    assert generator.refill() == 4
+    assert len(client.rpush.call_args[0]) == 5
+
+
+def test_create_link_retries_generated_code_collision(db_session, mocker):
+    create_link(db_session, "https://taken.com", short_code="taken1")
+    generator = mocker.Mock()
+    generator.next_code.side_effect = ["taken1", "fresh1"]
+    mocker.patch.object(services, "code_generator", generator)
+    link = create_link(db_session, "https://example.com")
+    assert link.short_code == "fresh1"
+    assert generator.next_code.call_count == 2
+
+
+def test_random_generator_length():
+    assert len(RandomCodeGenerator(length=8).next_code()) == 8
@@ -1,4 +1,7 @@
 import pytest
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import StaticPool
 from datetime import datetime, timedelta
 from app.services import (
     create_link,
@@ -7,8 +10,23 @@ from app.services import (
     delete_link,
     normalize_url,
 )
-from app.database import get_db
+from app.config import DB_POOL_PRE_PING, DB_POOL_SIZE, DB_STATEMENT_CACHE_SIZE
+from app.database import Base, engine_options, get_db, get_read_db
+from app.migrate import backfill_url_fields, migrate
 from app.models import Link
+from app.services import get_link, search_by_url, search_links
+
+# The schema as created by the first release, before any migration existed
+BASELINE_SCHEMA = (
+    "CREATE TABLE users (id INTEGER NOT NULL PRIMARY KEY, username VARCHAR, hashed_password VARCHAR)",
+    "CREATE INDEX ix_users_id ON users (id)",
+    "CREATE UNIQUE INDEX ix_users_username ON users (username)",
+    "CREATE TABLE links (id INTEGER NOT NULL PRIMARY KEY, original_url VARCHAR, short_code VARCHAR, created_at DATETIME, "
+    "expires_at DATETIME, last_used DATETIME, clicks INTEGER, user_id INTEGER REFERENCES users (id))",
+    "CREATE INDEX ix_links_id ON links (id)",
+    "CREATE INDEX ix_links_original_url ON links (original_url)",
+    "CREATE UNIQUE INDEX ix_links_short_code ON links (short_code)",
+)
 
 def test_update_link_success(db_session):
     link = create_link(db_session, "https://example.com", short_code="testup", user_id=1)
@@ -49,4 +67,75 @@ def test_get_db_functionality(db_session):
     db_instance = next(db_gen)
     result = db_instance.query(Link).all()
     with pytest.raises(StopIteration):
-        next(db_gen)
\ No newline at end of file
+        next(db_gen)
+
+def test_engine_options_size_only_pooled_backends():
+    assert engine_options("sqlite:///:memory:") == {"query_cache_size": DB_STATEMENT_CACHE_SIZE}
+    options = engine_options("postgresql+psycopg2://user:password@db/dbname")
+    assert options["pool_size"] == DB_POOL_SIZE
+    assert options["pool_pre_ping"] is DB_POOL_PRE_PING
+    assert "connect_args" not in options
+    options = engine_options("postgresql+asyncpg://user:password@db/dbname")
+    assert options["connect_args"] == {"prepared_statement_cache_size": DB_STATEMENT_CACHE_SIZE}
+
+def test_read_link_falls_back_to_primary_when_replica_lags(client, db_session, mocker):
+    create_link(db_session, "https://fresh.com", short_code="fresh")
+    # A replica that hasn't received the new link yet
+    replica = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(bind=replica)
+    lagging_replica = Session(replica)
+    client.app.dependency_overrides[get_read_db] = lambda: lagging_replica
+    mocker.patch("app.routers.links.replica_engine", replica)
+    mocker.patch("app.routers.links.SessionLocal", return_value=db_session)
+    response = client.get("/links/fresh")
+    assert response.status_code == 200
+    assert response.json()["original_url"] == "https://fresh.com"
+    lagging_replica.close()
+
+def test_migrate_backfills_url_fields_in_batches(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'baseline.db'}")
+    with engine.begin() as connection:
+        for statement in BASELINE_SCHEMA:
+            connection.execute(text(statement))
+        for index in range(25):
+            connection.execute(
+                text("INSERT INTO links (original_url, short_code, clicks) VALUES (:url, :code, 0)"),
+                {"url": f"https://Old.com/{index}", "code": f"old{index}"},
+            )
+    migrate(engine, {})
+    assert backfill_url_fields(engine) == 0
+    with engine.begin() as connection:
+        connection.execute(text("UPDATE links SET url_digest = NULL, netloc = NULL"))
+    assert backfill_url_fields(engine, batch_size=10) == 25
+
+    with Session(engine) as db:
+        link = search_by_url(db, "https://Old.com/7/")
+        assert (link.short_code, link.netloc) == ("old7", "old.com")
+        assert len(link.url_digest) == 32
+        links, _ = search_links(db, 50, domain="old.com")
+        assert len(links) == 25
+
+
+def test_migrate_upgrades_baseline_schema(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'baseline.db'}")
+    with engine.begin() as connection:
+        for statement in BASELINE_SCHEMA:
+            connection.execute(text(statement))
+        connection.execute(text("INSERT INTO users (username, hashed_password) VALUES ('old', 'x')"))
+        connection.execute(text("INSERT INTO links (original_url, short_code, clicks, user_id) VALUES ('https://old.com/a', 'olda', 3, 1)"))
+    migrate(engine, {})
+    migrate(engine, {})
+
+    columns = {column["name"] for column in inspect(engine).get_columns("links")}
+    assert {"url_digest", "netloc", "deduplicated", "version"} <= columns
+    assert "token_version" in {column["name"] for column in inspect(engine).get_columns("users")}
+    with engine.connect() as connection:
+        indexes = set(connection.scalars(text("SELECT name FROM sqlite_master WHERE type = 'index'")))
+    assert {"ix_links_netloc_created_id", "ix_links_url_digest", "uq_links_url_digest_owner"} <= indexes
+    assert not indexes & {"ix_links_id", "ix_links_original_url", "ix_users_id"}
+    with Session(engine) as db:
+        legacy = get_link(db, "olda", count_click=False)
+        assert (legacy.clicks, legacy.version, legacy.deduplicated) == (3, 0, False)
+        created = create_link(db, "https://new.com/b", user_id=1)
+        assert get_link(db, created.short_code, count_click=False).original_url == "https://new.com/b"
+        assert search_by_url(db, "https://new.com/b").id == created.id
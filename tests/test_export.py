@@ -0,0 +1,51 @@
+import csv
+import gzip
+import io
+import json
+from datetime import datetime
+from app.auth import generate_access_token
+from app.export import EXPORT_COLUMNS, export_chunks, export_query, iter_link_rows, main
+from app.services import create_link
+
+
+def test_export_pages_through_every_link(db_session):
+    for index in range(7):
+        create_link(db_session, f"https://page.com/{index}", short_code=f"page{index}", user_id=1 + index % 2)
+    rows = list(iter_link_rows(db_session, export_query(user_id=1), page_size=2, fetch_size=1))
+    assert [row.short_code for row in rows] == ["page0", "page2", "page4", "page6"]
+    # Each page runs in a transaction of its own
+    assert not db_session.in_transaction()
+
+    lines = b"".join(export_chunks(rows, "csv", chunk_size=10)).decode("utf-8").splitlines()
+    records = list(csv.DictReader(lines))
+    assert list(records[0]) == list(EXPORT_COLUMNS)
+    assert [record["original_url"] for record in records] == [f"https://page.com/{index}" for index in (0, 2, 4, 6)]
+    assert records[0]["clicks"] == "0" and records[0]["last_used"] == ""
+
+    compressed = b"".join(export_chunks(rows, "ndjson", compress=True, chunk_size=10))
+    records = [json.loads(line) for line in gzip.decompress(compressed).splitlines()]
+    assert [record["short_code"] for record in records] == ["page0", "page2", "page4", "page6"]
+    assert datetime.fromisoformat(records[0]["created_at"])
+
+
+def test_export_filters_by_creation_time(db_session, mocker, tmp_path):
+    for index, created_at in enumerate([datetime(2025, 1, 1), datetime(2025, 2, 1), datetime(2025, 3, 1)]):
+        link = create_link(db_session, f"https://time.com/{index}", short_code=f"time{index}")
+        link.created_at = created_at
+    db_session.commit()
+    mocker.patch("app.export.ReadSessionLocal", return_value=db_session)
+    output = tmp_path / "links.ndjson"
+    main(["--format", "ndjson", "--created-from", "2025-01-15", "--created-to", "2025-03-01", "-o", str(output)])
+    assert [json.loads(line)["short_code"] for line in output.read_text().splitlines()] == ["time1"]
+
+
+def test_export_endpoint_streams_own_links(client, db_session, test_user):
+    create_link(db_session, "https://mine.com", short_code="mine", user_id=test_user.id)
+    create_link(db_session, "https://theirs.com", short_code="theirs", user_id=test_user.id + 1)
+    token = generate_access_token({"sub": test_user.username})
+    response = client.get("/links/export?gzip=true", headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 200
+    assert response.headers["content-disposition"] == 'attachment; filename="links.csv.gz"'
+    records = list(csv.DictReader(io.StringIO(gzip.decompress(response.content).decode("utf-8"))))
+    assert [record["short_code"] for record in records] == ["mine"]
+    assert client.get("/links/export?format=xml", headers={"Authorization": f"Bearer {token}"}).status_code == 422
@@ -1,6 +1,10 @@
+import json
+import pytest
 from app.services import create_link
 from app.models import Link
 from app.auth import generate_access_token
+from app.cache import LinkEntry
+from app.responses import build_link_response
 from datetime import datetime, timedelta
 
 
@@ -66,13 +70,38 @@ def test_get_link_stats(client, db_session, test_user):
     assert data["clicks"] == 5
     assert "last_used" in data
 
-def test_search_link(client, db_session):
+def test_search_link(client, db_session, test_user):
     """Тест поиска ссылки по оригинальному URL"""
-    create_link(db_session, "https://search.me", short_code="findme")
+    create_link(db_session, "https://search.me", short_code="findme", user_id=test_user.id)
+    client.headers["Authorization"] = f"Bearer {generate_access_token({'sub': test_user.username})}"
     response = client.get("/links/search?original_url=https://search.me")
     assert response.status_code == 200
     assert response.json()[0]["short_code"] == "findme"
 
+def test_search_link_pages_by_domain(client, db_session, test_user):
+    for index in range(3):
+        create_link(db_session, f"https://search.me/{index}", short_code=f"page{index}", user_id=test_user.id)
+    client.headers["Authorization"] = f"Bearer {generate_access_token({'sub': test_user.username})}"
+    response = client.get("/links/search", params={"domain": "search.me", "limit": 2})
+    assert [item["short_code"] for item in response.json()] == ["page2", "page1"]
+    response = client.get("/links/search", params={"domain": "search.me", "cursor": response.headers["X-Next-Cursor"]})
+    assert [item["short_code"] for item in response.json()] == ["page0"]
+    assert "X-Next-Cursor" not in response.headers
+
+def test_search_link_only_finds_own_links(client, db_session, test_user):
+    create_link(db_session, "https://private.me/a", short_code="private", user_id=test_user.id + 1)
+    create_link(db_session, "https://private.me/b", short_code="anonymous")
+    assert client.get("/links/search", params={"domain": "private.me"}).status_code == 401
+    client.headers["Authorization"] = f"Bearer {generate_access_token({'sub': test_user.username})}"
+    assert client.get("/links/search", params={"domain": "private.me"}).status_code == 404
+    assert client.get("/links/search", params={"original_url": "https://private.me/a"}).status_code == 404
+
+def test_search_link_requires_one_term(client, test_user):
+    client.headers["Authorization"] = f"Bearer {generate_access_token({'sub': test_user.username})}"
+    assert client.get("/links/search").status_code == 422
+    assert client.get("/links/search", params={"domain": "a.com", "prefix": "https://a"}).status_code == 422
+    assert client.get("/links/search", params={"prefix": "https://nothing"}).status_code == 404
+
 def test_create_link_invalid_url(client, db_session, test_user):
     token = generate_access_token({"sub": test_user.username})
     client.headers["Authorization"] = f"Bearer {token}"
@@ -90,6 +119,26 @@ def test_get_link_not_found(client):
     assert response.status_code == 404, f"Expected 404, got {response.status_code}: {response.text}"
     assert response.json()["detail"] == "Link not found"
 
+def test_get_link_served_from_cached_entry(client, mocker):
+    entry = LinkEntry(1, "https://cached.com", None, None, 0)
+    mocker.patch("app.cache.redis_client.pipeline").return_value.execute.return_value = [entry.pack(), 3600000]
+    response = client.get("/links/cached")
+    assert response.status_code == 200
+    assert response.json()["original_url"] == "https://cached.com"
+
+def test_get_link_rejects_expired_cached_entry(client, mocker):
+    entry = LinkEntry(1, "https://old.com", datetime.utcnow() - timedelta(minutes=1), None, 0)
+    mocker.patch("app.cache.local_cache.get", return_value=entry)
+    assert client.get("/links/old").status_code == 404
+
+def test_modify_link_bumps_cached_version(client, db_session, test_user, mocker):
+    token = generate_access_token({"sub": test_user.username})
+    create_link(db_session, "https://before.com", short_code="bump", user_id=test_user.id)
+    setex = mocker.patch("app.cache.redis_client.setex")
+    response = client.put("/links/bump", json={"original_url": "https://after.com"}, headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 200
+    assert LinkEntry.unpack(setex.call_args[0][2]).version == 1
+
 def test_delete_link(client, db_session, test_user):
     token = generate_access_token({"sub": test_user.username})
     client.headers["Authorization"] = f"Bearer {token}"
@@ -97,3 +146,98 @@ def test_delete_link(client, db_session, test_user):
     response = client.delete(f"/links/{link.short_code}")
     assert response.status_code == 200, f"Expected 200, got {response.status_code}: {response.text}"
     assert response.json()["message"] == "Link deleted"
+
+def test_bulk_create_json_array(client, db_session, test_user):
+    token = generate_access_token({"sub": test_user.username})
+    client.headers["Authorization"] = f"Bearer {token}"
+    payload = [
+        {"original_url": "https://one.com/"},
+        "https://two.com",
+        {"original_url": "not-a-url"},
+        {"original_url": "https://three.com", "custom_alias": "three"},
+    ]
+    response = client.post("/links/bulk", json=payload)
+    assert response.status_code == 200
+    results = [json.loads(line) for line in response.text.splitlines()]
+    assert [result["index"] for result in results] == [0, 1, 2, 3]
+    assert results[0]["original_url"] == "https://one.com"
+    assert "error" in results[2]
+    assert results[3]["short_code"] == "three"
+    assert db_session.query(Link).filter(Link.user_id == test_user.id).count() == 3
+
+def test_bulk_create_ndjson_stream(client, db_session, test_user):
+    token = generate_access_token({"sub": test_user.username})
+    create_link(db_session, "https://taken.com", short_code="taken")
+    body = '{"original_url": "https://a.com"}\n{"original_url": "https://b.com", "custom_alias": "taken"}\nnot json\n'
+    response = client.post(
+        "/links/bulk",
+        content=body,
+        headers={"Authorization": f"Bearer {token}", "Content-Type": "application/x-ndjson"},
+    )
+    assert response.status_code == 200
+    results = [json.loads(line) for line in response.text.splitlines()]
+    assert len(results) == 3
+    assert "short_code" in results[0]
+    assert results[1]["error"] == "Short code already exists"
+    assert "error" in results[2]
+
+def test_bulk_create_rejects_non_array(client, test_user):
+    token = generate_access_token({"sub": test_user.username})
+    response = client.post("/links/bulk", json={"original_url": "https://a.com"}, headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 422
+
+def test_list_links_pages_through_own_links(client, db_session, test_user):
+    token = generate_access_token({"sub": test_user.username})
+    client.headers["Authorization"] = f"Bearer {token}"
+    created_at = datetime(2024, 1, 1)
+    for index in range(5):
+        link = create_link(db_session, "https://mine.com", short_code=f"mine{index}", user_id=test_user.id)
+        # Two links share a timestamp so the id tie-breaker is exercised
+        link.created_at = created_at + timedelta(minutes=index // 2)
+    create_link(db_session, "https://other.com", short_code="other", user_id=test_user.id + 1)
+    db_session.commit()
+
+    codes, cursor = [], None
+    while True:
+        response = client.get("/links", params={"limit": 2, **({"cursor": cursor} if cursor else {})})
+        assert response.status_code == 200
+        page = response.json()
+        codes += [item["short_code"] for item in page["items"]]
+        cursor = page["next_cursor"]
+        if not cursor:
+            break
+    assert codes == ["mine4", "mine3", "mine2", "mine1", "mine0"]
+
+def test_list_links_filters(client, db_session, test_user):
+    token = generate_access_token({"sub": test_user.username})
+    client.headers["Authorization"] = f"Bearer {token}"
+    create_link(db_session, "https://old.com", short_code="old", user_id=test_user.id, expires_at=datetime.utcnow() - timedelta(days=1))
+    popular = create_link(db_session, "https://hot.com", short_code="hot", user_id=test_user.id)
+    popular.clicks = 10
+    db_session.commit()
+    assert [item["short_code"] for item in client.get("/links?expired=true").json()["items"]] == ["old"]
+    assert [item["short_code"] for item in client.get("/links?expired=false").json()["items"]] == ["hot"]
+    assert [item["short_code"] for item in client.get("/links?min_clicks=5").json()["items"]] == ["hot"]
+
+def test_list_links_rejects_bad_cursor_and_anonymous(client, test_user):
+    assert client.get("/links").status_code == 401
+    token = generate_access_token({"sub": test_user.username})
+    response = client.get("/links?cursor=garbage", headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 400
+
+def test_get_link_redirect_mode(client, db_session, mocker):
+    mocker.patch("app.routers.links.link_response", build_link_response("302"))
+    link = create_link(db_session, "https://example.com/page", short_code="jump", expires_at=datetime.utcnow() + timedelta(seconds=90))
+    response = client.get("/links/jump", follow_redirects=False)
+    assert response.status_code == 302
+    assert response.headers["location"] == "https://example.com/page"
+    assert response.headers["etag"] == f'"{link.id}-0"'
+    max_age = int(response.headers["cache-control"].rsplit("=", 1)[1])
+    assert 0 < max_age <= 90
+    assert response.content == b""
+    response = client.get("/links/jump", headers={"If-None-Match": f'"{link.id}-0"'}, follow_redirects=False)
+    assert response.status_code == 304
+
+def test_unknown_redirect_mode_is_rejected():
+    with pytest.raises(ValueError):
+        build_link_response("308")
@@ -0,0 +1,108 @@
+from app import membership
+from app.cache import invalidation_listener, publish_invalidation
+from app.membership import BloomFilter, ShortCodeFilter, code_filter, negative_cache, rebuild_code_filter
+from app.services import create_link, create_links_bulk, delete_link
+
+
+def test_bloom_filter_has_no_false_negatives_and_few_false_positives():
+    bloom = BloomFilter(capacity=10000, error_rate=0.01)
+    for index in range(10000):
+        bloom.add(f"code{index}")
+    assert all(f"code{index}" in bloom for index in range(10000))
+    false_positives = sum(f"other{index}" in bloom for index in range(10000))
+    assert false_positives < 300
+
+
+def test_filter_says_maybe_until_built():
+    short_code_filter = ShortCodeFilter(capacity=100)
+    assert not short_code_filter.ready
+    assert short_code_filter.might_contain("anything")
+    short_code_filter.rebuild(["known"], 1)
+    assert short_code_filter.might_contain("known")
+    assert not short_code_filter.might_contain("unknown")
+
+
+def test_codes_added_during_rebuild_are_kept():
+    short_code_filter = ShortCodeFilter(capacity=100)
+
+    def snapshot():
+        yield "old"
+        short_code_filter.add("concurrent")
+
+    short_code_filter.rebuild(snapshot(), 1)
+    assert short_code_filter.might_contain("old")
+    assert short_code_filter.might_contain("concurrent")
+
+
+def test_codes_added_shortly_before_rebuild_survive_a_lagging_replica(mocker):
+    short_code_filter = ShortCodeFilter(capacity=100, replay_seconds=60)
+    clock = mocker.patch("app.membership.time.monotonic", return_value=1000.0)
+    short_code_filter.add("old")
+    clock.return_value = 1050.0
+    short_code_filter.add("recent")
+    clock.return_value = 1070.0
+    # The replica has neither code yet
+    short_code_filter.rebuild([], 1)
+    assert short_code_filter.might_contain("recent")
+    assert not short_code_filter.might_contain("old")
+
+
+def test_rebuild_and_service_writes_keep_filter_current(db_session):
+    create_link(db_session, "https://example.com", short_code="before")
+    assert rebuild_code_filter(db_session) == 1
+    assert code_filter.might_contain("before")
+    create_link(db_session, "https://example.com", short_code="after")
+    create_links_bulk(db_session, [{"original_url": "https://bulk.com", "short_code": "bulk1"}])
+    assert code_filter.might_contain("after")
+    assert code_filter.might_contain("bulk1")
+    assert not code_filter.might_contain("never")
+
+
+def test_unknown_code_is_rejected_without_db(client, db_session, mocker):
+    create_link(db_session, "https://example.com", short_code="exists")
+    rebuild_code_filter(db_session)
+    get_link = mocker.patch("app.routers.links.get_link")
+    redis_get = mocker.patch("app.cache.redis_client.get", return_value=None)
+    response = client.get("/links/missing")
+    assert response.status_code == 404
+    get_link.assert_not_called()
+    redis_get.assert_not_called()
+
+
+def test_db_miss_is_negatively_cached(client, mocker):
+    get_link = mocker.patch("app.routers.links.get_link", return_value=None)
+    assert client.get("/links/ghost").status_code == 404
+    assert client.get("/links/ghost").status_code == 404
+    assert get_link.call_count == 1
+
+
+def test_create_and_delete_update_negative_cache(client, db_session):
+    assert client.get("/links/later").status_code == 404
+    create_link(db_session, "https://example.com", short_code="later")
+    assert client.get("/links/later").status_code == 200
+    delete_link(db_session, "later")
+    assert negative_cache.get("later")
+
+
+def test_invalidation_from_other_worker_updates_filter_and_negative_cache(db_session):
+    rebuild_code_filter(db_session)
+    negative_cache.set("remote", True)
+    invalidation_listener.handle(b"other-worker:link:remote")
+    assert code_filter.might_contain("remote")
+    assert negative_cache.get("remote") is None
+
+
+def test_user_invalidations_stay_out_of_the_filter(db_session, mocker):
+    rebuild_code_filter(db_session)
+    mocker.patch("app.cache.redis_client.publish")
+    invalidation_listener.handle(b"other-worker:user:user:7")
+    publish_invalidation("user:8", namespace="user")
+    assert not code_filter.might_contain("user:7")
+    assert not code_filter.might_contain("user:8")
+    # A custom alias that merely looks like a user key is still a short code
+    invalidation_listener.handle(b"other-worker:link:user:9")
+    assert code_filter.might_contain("user:9")
+
+
+def test_resubscribe_schedules_rebuild():
+    assert membership.code_filter_rebuilder.trigger in invalidation_listener.resync_callbacks
@@ -0,0 +1,64 @@
+import os
+from prometheus_client import REGISTRY
+from sqlalchemy import create_engine, text
+from sqlalchemy.pool import QueuePool
+from app import metrics
+from app.metrics import instrument_engine, statement_kind
+from app.services import create_link
+
+
+def sample(name, labels=None):
+    return REGISTRY.get_sample_value(name, labels or {}) or 0
+
+
+def test_metrics_endpoint_reports_route_latency(client, db_session):
+    create_link(db_session, "https://example.com", short_code="metric")
+    labels = {"method": "GET", "route": "/links/{short_code}", "status": "200"}
+    before = sample("shortlink_http_request_duration_seconds_count", labels)
+    client.get("/links/metric")
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert "shortlink_http_request_duration_seconds" in response.text
+    assert "shortlink_local_cache_hits" in response.text
+    assert sample("shortlink_http_request_duration_seconds_count", labels) == before + 1
+
+
+def test_unmatched_routes_share_one_label(client):
+    before = sample("shortlink_http_request_duration_seconds_count", {"method": "GET", "route": "unmatched", "status": "404"})
+    client.get("/no/such/path")
+    assert sample("shortlink_http_request_duration_seconds_count", {"method": "GET", "route": "unmatched", "status": "404"}) == before + 1
+
+
+def test_redis_cache_miss_is_counted(client):
+    before = sample("shortlink_redis_cache_requests_total", {"result": "miss"})
+    client.get("/links/unknown")
+    assert sample("shortlink_redis_cache_requests_total", {"result": "miss"}) == before + 1
+
+
+def test_instrument_engine_records_queries_and_slow_log(mocker, caplog):
+    mocker.patch.object(metrics, "SLOW_QUERY_SECONDS", 0)
+    test_engine = create_engine("sqlite://")
+    instrument_engine(test_engine, "test")
+    before = sample("shortlink_db_query_duration_seconds_count", {"statement": "SELECT"})
+    slow_before = sample("shortlink_db_slow_queries_total")
+    with test_engine.connect() as connection:
+        connection.execute(text("SELECT 1"))
+    assert sample("shortlink_db_query_duration_seconds_count", {"statement": "SELECT"}) == before + 1
+    assert sample("shortlink_db_slow_queries_total") == slow_before + 1
+    assert sample("shortlink_db_pool_checkout_wait_seconds_count", {"pool": "test"}) >= 1
+    assert "Slow query" in caplog.text
+
+
+def test_statement_kind():
+    assert statement_kind("  select 1") == "SELECT"
+    assert statement_kind("PRAGMA table_info(links)") == "OTHER"
+
+
+def test_multiprocess_registry_keeps_cache_and_pool_metrics(client, tmp_path, monkeypatch):
+    instrument_engine(create_engine("sqlite://", poolclass=QueuePool), "multiprocess")
+    monkeypatch.setenv("PROMETHEUS_MULTIPROC_DIR", str(tmp_path))
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    pid = os.getpid()
+    assert f'shortlink_local_cache_size{{cache="links",pid="{pid}"}}' in response.text
+    assert f'shortlink_db_pool_checked_in{{pid="{pid}",pool="multiprocess"}} 0.0' in response.text
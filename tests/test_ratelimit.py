@@ -0,0 +1,63 @@
+import asyncio
+import pytest
+import redis
+from fastapi import HTTPException
+from app.auth import generate_access_token
+from app.metrics import RATE_LIMIT_DECISIONS
+from app.ratelimit import Limit, RateLimiter, parse_user_limits
+
+
+def decisions(route, result, source):
+    return RATE_LIMIT_DECISIONS.labels(route, result, source)._value.get()
+
+
+def test_limits_parse():
+    assert Limit.parse("30/60") == Limit(30, 60.0)
+    assert Limit.parse("5") == Limit(5, 1.0)
+    assert not Limit.parse("0/60").enabled
+    assert parse_user_limits("7=1000/60, 9=0/1") == {7: Limit(1000, 60.0), 9: Limit(0, 1.0)}
+    with pytest.raises(ValueError):
+        Limit.parse("10/0")
+
+
+def test_tokens_are_leased_in_batches_and_rejections_remembered(mocker):
+    script = mocker.patch("app.ratelimit.async_take_tokens_script", new=mocker.AsyncMock(return_value=[10, 0]))
+    limiter = RateLimiter("test-lease", Limit(100, 60))
+    for _ in range(10):
+        asyncio.run(limiter.check("ip:1"))
+    # A tenth of the limit per round trip: nine of the ten requests are decided locally
+    assert script.await_count == 1
+    assert script.await_args.kwargs == {"keys": ["ratelimit:test-lease:ip:1"], "args": [600.0, 60000, 10]}
+    assert decisions("test-lease", "allowed", "local") == 9
+
+    script.return_value = [0, 2500]
+    with pytest.raises(HTTPException) as rejected:
+        asyncio.run(limiter.check("ip:1"))
+    assert rejected.value.status_code == 429
+    assert rejected.value.headers["Retry-After"] == "3"
+    # Until Retry-After passes the client is turned away without asking Redis
+    with pytest.raises(HTTPException):
+        asyncio.run(limiter.check("ip:1"))
+    assert script.await_count == 2
+    assert decisions("test-lease", "rejected", "local") == 1
+
+
+def test_overrides_and_unavailable_redis(mocker):
+    script = mocker.patch("app.ratelimit.async_take_tokens_script", new=mocker.AsyncMock(side_effect=redis.ConnectionError))
+    limiter = RateLimiter("test-override", Limit(10, 60), {7: Limit(0, 60)})
+    asyncio.run(limiter.check("user:7", 7))
+    assert script.await_count == 0
+    asyncio.run(limiter.check("user:8", 8))
+    assert decisions("test-override", "allowed", "unavailable") == 1
+
+
+def test_register_and_shorten_are_limited(client, test_user, mocker):
+    mocker.patch("app.ratelimit.async_take_tokens_script", new=mocker.AsyncMock(return_value=[0, 60000]))
+    response = client.post("/register", json={"username": "flood", "password": "secret"})
+    assert response.status_code == 429
+    assert response.headers["retry-after"] == "60"
+    token = generate_access_token({"sub": test_user.username})
+    response = client.post("/links/shorten", json={"original_url": "https://a.com"}, headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 429
+    response = client.post("/links/bulk", json=["https://a.com"], headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 429
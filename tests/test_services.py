@@ -1,15 +1,20 @@
 from datetime import datetime, timedelta
 import pytest
+from sqlalchemy import select
 from urllib.parse import urlparse, urlunparse
 from app.services import (
     normalize_url,
     create_link,
+    create_links_bulk,
     get_link,
     delete_link,
     update_link,
     get_stats,
     search_by_url,
+    search_links,
+    deduplicated_query,
 )
+from app.models import Link
 
 
 # Тестирование normalize_url
@@ -24,7 +29,7 @@ def normalize_url(url: str) -> str:
 def test_create_link_with_auto_generated_code(db_session):
     link = create_link(db_session, "https://example.com")
     assert link.original_url == "https://example.com"
-    assert len(link.short_code) == 6  # Предполагаем, что generate_short_code() возвращает 6 символов
+    assert len(link.short_code) == 6  # CODE_LENGTH по умолчанию — 6 символов
     assert link.expires_at > datetime.utcnow()  # Срок должен быть в будущем
 
 
@@ -91,4 +96,81 @@ def test_search_by_url_finds_link(db_session):
 
 
 def test_search_by_url_returns_none_if_not_found(db_session):
-    assert search_by_url(db_session, "https://non-existent.com") is None
\ No newline at end of file
+    assert search_by_url(db_session, "https://non-existent.com") is None
+
+
+def test_search_by_url_uses_stored_hash(db_session):
+    link = create_link(db_session, "https://Example.com/path/")
+    assert len(link.url_digest) == 32
+    assert link.netloc == "example.com"
+    assert search_by_url(db_session, "https://Example.com/path").id == link.id
+
+
+def test_search_links_by_domain_and_prefix(db_session):
+    create_link(db_session, "https://docs.com/a", short_code="doca")
+    create_link(db_session, "https://docs.com/b", short_code="docb")
+    create_link(db_session, "https://docs.org/a_b", short_code="org")
+
+    links, _ = search_links(db_session, 10, domain="DOCS.com")
+    assert {link.short_code for link in links} == {"doca", "docb"}
+    links, _ = search_links(db_session, 10, prefix="https://docs.")
+    assert len(links) == 3
+    links, _ = search_links(db_session, 10, prefix="https://docs.org/a_")
+    assert [link.short_code for link in links] == ["org"]
+    assert search_links(db_session, 10, prefix="https://docs.com/a_")[0] == []
+
+
+def test_search_links_paginates(db_session):
+    for index in range(3):
+        create_link(db_session, "https://same.com", short_code=f"same{index}")
+    first_page, cursor = search_links(db_session, 2, original_url="https://same.com/")
+    second_page, last_cursor = search_links(db_session, 2, cursor, original_url="https://same.com/")
+    assert [link.short_code for link in first_page + second_page] == ["same2", "same1", "same0"]
+    assert last_cursor is None
+
+
+def test_create_link_deduplicates_same_url_per_owner(db_session, mocker):
+    mocker.patch("app.services.DEDUPLICATE_LINKS", True)
+    first = create_link(db_session, "https://dup.com/page/")
+    assert create_link(db_session, "https://dup.com/page").short_code == first.short_code
+    assert create_link(db_session, "https://dup.com/page", user_id=1).short_code != first.short_code
+    assert create_link(db_session, "https://dup.com/page", short_code="mine").short_code == "mine"
+    assert db_session.query(Link).filter(Link.url_digest == first.url_digest).count() == 3
+
+
+def test_create_link_deduplication_returns_race_winner(db_session, mocker):
+    mocker.patch("app.services.DEDUPLICATE_LINKS", True)
+    winner = create_link(db_session, "https://race.com")
+    # The first lookup misses as if the winner had not committed yet; ON CONFLICT DO NOTHING returns no row
+    mocker.patch("app.services.deduplicated_query", side_effect=[select(Link).where(Link.id < 0), deduplicated_query(winner.url_digest, None)])
+    assert create_link(db_session, "https://race.com").id == winner.id
+
+
+def test_create_link_deduplication_replaces_expired_link(db_session, mocker):
+    mocker.patch("app.services.DEDUPLICATE_LINKS", True)
+    stale = create_link(db_session, "https://stale.com")
+    stale.expires_at = datetime.utcnow() - timedelta(days=1)
+    db_session.commit()
+    stale_code = stale.short_code
+    fresh = create_link(db_session, "https://stale.com")
+    assert fresh.short_code != stale_code
+    assert fresh.expires_at > datetime.utcnow()
+
+
+def test_create_links_bulk_alias_taken_concurrently_fails_only_its_item(db_session, mocker):
+    create_link(db_session, "https://first.com", short_code="raced")
+    real_scalars = db_session.scalars
+    # The upfront alias check misses the link as if it were committed just after it
+    alias_check = mocker.patch.object(
+        db_session, "scalars", side_effect=lambda statement: iter([]) if alias_check.call_count == 1 else real_scalars(statement),
+    )
+    results = create_links_bulk(db_session, [
+        {"original_url": "https://one.com"},
+        {"original_url": "https://second.com", "short_code": "raced"},
+        {"original_url": "https://three.com", "short_code": "free"},
+    ])
+    assert alias_check.call_count == 2
+    assert results[1] == {"error": "Short code already exists"}
+    assert results[2]["short_code"] == "free"
+    assert get_link(db_session, results[0]["short_code"], count_click=False).original_url == "https://one.com"
+    assert get_link(db_session, "raced", count_click=False).original_url == "https://first.com"
@@ -0,0 +1,79 @@
+from datetime import datetime, timedelta
+from app.cache import LinkEntry, cache_delete_many, cache_set_many, invalidation_listener
+from app.models import Link
+from app.services import create_link
+from app.snapshot import LinkSnapshot, SnapshotIndex, export_links, link_snapshot
+
+
+def test_export_and_lookup(db_session, tmp_path):
+    path = str(tmp_path / "links.snapshot")
+    for index in range(50):
+        create_link(db_session, f"https://example.com/{index}", short_code=f"code{index}")
+    create_link(db_session, "https://short.lived", short_code="brief", expires_at=datetime.utcnow() + timedelta(minutes=5))
+    link = create_link(db_session, "https://forever.com/ünïcode", short_code="forever")
+    link.expires_at = None
+    db_session.commit()
+
+    assert export_links(path, db_session) == 51
+    index = SnapshotIndex(path)
+    assert index.get("code7").original_url == "https://example.com/7"
+    assert index.get("code7").expires_at > datetime.utcnow()
+    entry = index.get("forever")
+    assert (entry.id, entry.original_url, entry.expires_at) == (link.id, "https://forever.com/ünïcode", None)
+    # Links expiring before SNAPSHOT_MIN_TTL_SECONDS are left to Redis and the database
+    assert index.get("brief") is None
+    assert index.get("missing") is None
+
+
+def test_reload_swaps_file_and_skips_changed_codes(db_session, tmp_path, mocker):
+    path = str(tmp_path / "links.snapshot")
+    create_link(db_session, "https://one.com", short_code="one")
+    export_links(path, db_session)
+    client = mocker.Mock()
+    client.zrangebyscore.return_value = [b"one"]
+    snapshot = LinkSnapshot(path, client)
+    assert snapshot.get("one") is None
+    assert snapshot.reload() is True
+    # Changed after the build (per Redis), so it is answered elsewhere
+    assert snapshot.get("one") is None
+    assert snapshot.reload() is False
+
+    client.zrangebyscore.return_value = []
+    create_link(db_session, "https://two.com", short_code="two")
+    export_links(path, db_session)
+    assert snapshot.reload() is True
+    assert snapshot.get("one").original_url == "https://one.com"
+    snapshot.record_changes(["two"])
+    assert snapshot.get("two") is None
+    assert client.zadd.call_args[0][1].keys() == {"two"}
+
+
+def test_read_link_served_from_snapshot(client, db_session, tmp_path, mocker):
+    path = str(tmp_path / "links.snapshot")
+    create_link(db_session, "https://snap.com", short_code="snap")
+    export_links(path, db_session)
+    # Gone from the database: only the snapshot can answer
+    db_session.query(Link).filter(Link.short_code == "snap").delete()
+    db_session.commit()
+    # The router only imports the snapshot when SNAPSHOT_PATH is set
+    mocker.patch.object(link_snapshot, "_index", SnapshotIndex(path))
+    mocker.patch("app.routers.links.link_snapshot", link_snapshot)
+    cache_get = mocker.patch("app.routers.links.cache_get")
+    response = client.get("/links/snap")
+    assert response.status_code == 200
+    assert response.json()["original_url"] == "https://snap.com"
+    cache_get.assert_not_called()
+
+
+def test_batch_changes_are_one_zadd_on_the_callers_pipeline(mocker):
+    client = mocker.Mock()
+    snapshot = LinkSnapshot(None, client)
+    mocker.patch.object(invalidation_listener, "local_callbacks", [snapshot.record_changes])
+    pipeline = mocker.patch("app.cache.redis_client.pipeline").return_value
+    cache_delete_many([f"gone{index}" for index in range(100)])
+    assert pipeline.zadd.call_count == 1
+    assert len(pipeline.zadd.call_args[0][1]) == 100
+    assert client.zadd.call_count == 0
+    # Freshly created codes can't be in any snapshot
+    cache_set_many([("new", LinkEntry(1, "https://new.com", None, None, 0))], created=True)
+    assert pipeline.zadd.call_count == 1
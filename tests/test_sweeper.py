@@ -0,0 +1,40 @@
+from datetime import datetime, timedelta
+from app.cache import cache_ttl
+from app.config import CACHE_EXPIRE_SECONDS
+from app.models import Link
+from app.services import create_link, get_link
+from app.sweeper import sweep_expired_links
+
+
+def test_sweep_deletes_expired_links_in_batches(db_session, mocker):
+    pipeline = mocker.patch("app.cache.redis_client.pipeline")
+    expired = datetime.utcnow() - timedelta(minutes=1)
+    for index in range(5):
+        create_link(db_session, "https://old.com", short_code=f"old{index}", expires_at=expired)
+    create_link(db_session, "https://live.com", short_code="live")
+    assert sweep_expired_links(db_session, batch_size=2) == 5
+    assert db_session.query(Link).count() == 1
+    deleted_keys = [call.args for call in pipeline.return_value.delete.call_args_list]
+    assert sorted(key for keys in deleted_keys for key in keys) == [f"old{index}" for index in range(5)]
+
+
+def test_sweep_respects_max_batches(db_session, mocker):
+    mocker.patch("app.cache.redis_client.pipeline")
+    expired = datetime.utcnow() - timedelta(minutes=1)
+    for index in range(4):
+        create_link(db_session, "https://old.com", short_code=f"old{index}", expires_at=expired)
+    assert sweep_expired_links(db_session, batch_size=1, max_batches=3) == 3
+    assert sweep_expired_links(db_session, batch_size=1) == 1
+
+
+def test_get_link_does_not_delete_expired_link(db_session):
+    create_link(db_session, "https://old.com", short_code="stale", expires_at=datetime.utcnow() - timedelta(days=1))
+    assert get_link(db_session, "stale") is None
+    assert db_session.query(Link).filter(Link.short_code == "stale").count() == 1
+
+
+def test_cache_ttl_is_capped_by_link_lifetime():
+    assert cache_ttl(None) == CACHE_EXPIRE_SECONDS
+    assert cache_ttl(datetime.utcnow() + timedelta(days=1)) == CACHE_EXPIRE_SECONDS
+    assert 0 < cache_ttl(datetime.utcnow() + timedelta(seconds=30)) <= 30
+    assert cache_ttl(datetime.utcnow() - timedelta(seconds=30)) == 0
@@ -1,5 +1,8 @@
+import threading
 import pytest
 from jose import jwt
+from passlib.context import CryptContext
+from app import auth
 from app.auth import SECRET_KEY, ALGORITHM
 
 def test_register_user_success(client):
@@ -55,4 +58,34 @@ def test_token_content(client, test_user):
     )
     token = response.json()["access_token"]
     payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-    assert payload["sub"] == "admin"
\ No newline at end of file
+    assert payload["sub"] == "admin"
+
+def test_token_contains_user_id_and_version(client, test_user):
+    response = client.post(
+        "/token",
+        data={"username": "admin", "password": "admin"}
+    )
+    payload = jwt.decode(response.json()["access_token"], SECRET_KEY, algorithms=[ALGORITHM])
+    assert payload["uid"] == test_user.id
+    assert payload["ver"] == 0
+
+def test_revoke_tokens_endpoint(client, test_user):
+    token = client.post("/token", data={"username": "admin", "password": "admin"}).json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    assert client.post("/token/revoke", headers=headers).status_code == 200
+    assert client.post("/token/revoke", headers=headers).status_code == 401
+
+def test_login_rehashes_outdated_password_hash(client, db_session, test_user):
+    test_user.hashed_password = CryptContext(schemes=["bcrypt"], bcrypt__rounds=4).hash("admin")
+    db_session.commit()
+    response = client.post("/token", data={"username": "admin", "password": "admin"})
+    assert response.status_code == 200
+    db_session.refresh(test_user)
+    assert not test_user.hashed_password.startswith("$2b$04$")
+
+def test_login_returns_429_when_hash_pool_is_saturated(client, test_user, mocker):
+    mocker.patch("app.auth.password_pool_slots", threading.BoundedSemaphore(1))
+    auth.password_pool_slots.acquire()
+    response = client.post("/token", data={"username": "admin", "password": "admin"})
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "1"
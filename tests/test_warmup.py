@@ -0,0 +1,62 @@
+import os
+import subprocess
+import sys
+from datetime import datetime, timedelta
+import pytest
+from app import warmup
+from app.cache import LinkEntry
+from app.services import create_link
+
+
+@pytest.fixture(autouse=True)
+def reset_ready():
+    warmup.ready.clear()
+    yield
+    warmup.ready.clear()
+
+
+def test_preload_links_warms_most_clicked_live_links(db_session, mocker):
+    mocker.patch("app.warmup.redis_client.set", return_value=True)
+    pipeline = mocker.patch("app.cache.redis_client.pipeline")
+    for clicks in (5, 50, 1):
+        link = create_link(db_session, f"https://hot{clicks}.com", short_code=f"hot{clicks}")
+        link.clicks = clicks
+    create_link(db_session, "https://old.com", short_code="old", expires_at=datetime.utcnow() - timedelta(days=1)).clicks = 500
+    db_session.commit()
+    mocker.patch("app.warmup.WARMUP_LINKS", 2)
+    assert warmup.preload_links(db_session) == 2
+    calls = pipeline.return_value.set.call_args_list
+    assert [call.args[0] for call in calls] == ["hot50", "hot5"]
+    assert LinkEntry.unpack(calls[0].args[1]).original_url == "https://hot50.com"
+    assert all(call.kwargs["nx"] for call in calls)
+
+
+def test_preload_links_runs_once_per_deploy(db_session, mocker):
+    mocker.patch("app.warmup.redis_client.set", return_value=None)
+    pipeline = mocker.patch("app.cache.redis_client.pipeline")
+    create_link(db_session, "https://hot.com", short_code="hot")
+    assert warmup.preload_links(db_session) == 0
+    pipeline.assert_not_called()
+
+
+def test_ready_endpoint_after_warm_up(client, mocker):
+    assert client.get("/ready").status_code == 503
+    mocker.patch("app.warmup.redis_client.ping")
+    mocker.patch("app.warmup.preload_links", return_value=0)
+    warmup.warm_up()
+    assert client.get("/ready").status_code == 200
+
+
+def test_failed_warm_up_stays_not_ready(client, mocker):
+    mocker.patch("app.warmup.redis_client.ping", side_effect=ConnectionError)
+    with pytest.raises(ConnectionError):
+        warmup.warm_up()
+    assert client.get("/ready").status_code == 503
+
+
+def test_optional_subsystems_are_not_imported_when_disabled():
+    check = "import sys, app.main; print(sorted({'app.snapshot', 'app.export', 'app.rebalance'} & sys.modules.keys()))"
+    environment = {**os.environ, "SECRET_KEY": "SECRET_KEY", "DATABASE_URL": "sqlite://"}
+    environment.pop("SNAPSHOT_PATH", None)
+    result = subprocess.run([sys.executable, "-c", check], capture_output=True, text=True, env=environment, check=True)
+    assert result.stdout.strip() == "[]"